@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+# bugcache_check.py : checks that known bugs in bug systems are looked up once and then cached, using a stand-in for
+# GitHub's issue API served locally.
+
+# Usage bugcache_check.py [ -n <tests> ] [ -d <working_dir> ] [ -x ]
+
+# <tests> is the number of tests in the generated suite, default 20. They all fail, and all match the same bug.
+
+# <working_dir> indicates where the suite, the results and the cache are written. It defaults to a new temporary
+# directory.
+
+# The -x flag should be provided if the temporary files are to be left.
+
+# The suite is run twice. The first run should ask about the bug once, and the second not at all, as the answer is
+# kept on disk. Then the cache is used directly: with many threads asking at once, each bug should be asked about
+# once. Once the cache timeout has passed it should be asked about again, and lookups that fail should never be
+# kept. The exit code is the number of checks that failed.
+
+import os
+import sys
+import json
+import time
+import shutil
+import subprocess
+import tempfile
+import threading
+from collections import Counter
+from getopt import getopt
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+libDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StubTrackerHandler(BaseHTTPRequestHandler):
+    # Issues whose number starts with 9 don't exist
+    def do_GET(self):
+        bugId = self.path.rstrip("/").split("/")[-1]
+        self.server.countRequest(bugId)
+        time.sleep(self.server.delay)  # so that lookups from different threads overlap
+        if bugId.startswith("9"):
+            self.send_error(404)
+            return
+        body = json.dumps({"state": "open", "title": "Stub bug " + bugId, "user": {"login": "texttest"},
+                           "assignee": None, "updated_at": "today", "milestone": None,
+                           "body": "Found by the stub tracker"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubTracker(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, delay=0.2):
+        ThreadingHTTPServer.__init__(self, ("127.0.0.1", 0), StubTrackerHandler)
+        self.delay = delay
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def getLocation(self):
+        return "http://127.0.0.1:" + str(self.server_address[1]) + "/"
+
+    def countRequest(self, bugId):
+        with self.lock:
+            self.requests[bugId] += 1
+
+    def takeRequests(self):
+        with self.lock:
+            requests = self.requests
+            self.requests = Counter()
+            return requests
+
+
+def writeFile(fileName, text):
+    with open(fileName, "w") as f:
+        f.write(text)
+
+
+def makeSuite(rootDir, testCount, location):
+    appDir = os.path.join(rootDir, "bugs")
+    os.makedirs(appDir)
+    writeFile(os.path.join(appDir, "config.bugs"), "executable:/bin/echo\n[bug_system_location]\ngithub:" +
+              location + "\n[end]\n")
+    writeFile(os.path.join(appDir, "knownbugs.bugs"), "[Reported Bug 1]\nsearch_string:known problem\n" +
+              "search_file:output\nbug_system:github\nbug_id:7\n")
+    names = ["T%03d" % i for i in range(testCount)]
+    for name in names:
+        testDir = os.path.join(appDir, name)
+        os.mkdir(testDir)
+        writeFile(os.path.join(testDir, "options.bugs"), "known problem in " + name + "\n")
+        writeFile(os.path.join(testDir, "output.bugs"), name + " works\n")
+        writeFile(os.path.join(testDir, "errors.bugs"), "")
+    writeFile(os.path.join(appDir, "testsuite.bugs"), "\n".join(names) + "\n")
+
+
+def getEnvironment(workDir):
+    return dict(os.environ, TEXTTEST_HOME=os.path.join(workDir, "root"), TEXTTEST_TMP=os.path.join(workDir, "tmp"),
+                TEXTTEST_PERSONAL_CONFIG=os.path.join(workDir, "personal"), USER=os.getenv("USER", "texttest"))
+
+
+def runTextTest(workDir):
+    texttest = os.path.join(libDir, "bin", "texttest")
+    proc = subprocess.run([sys.executable, texttest, "-con", "-b"], env=getEnvironment(workDir),
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    return proc.stdout
+
+
+def report(description, ok, output=""):
+    print(("PASSED" if ok else "FAILED") + " : " + description)
+    if not ok and output:
+        print("\n".join(output.splitlines()[-20:]))
+    return 0 if ok else 1
+
+
+def describeRequests(requests):
+    return ", ".join((bugId + " x" + str(count) for bugId, count in sorted(requests.items()))) or "none"
+
+
+def checkRuns(workDir, tracker, testCount):
+    makeSuite(os.path.join(workDir, "root"), testCount, tracker.getLocation())
+    failures = 0
+    for run, expectedRequests in [("first", 1), ("second", 0)]:
+        output = runTextTest(workDir)
+        requests = tracker.takeRequests()
+        matched = output.count(" had known bugs (bug 7 (open))") // 2  # once as each test finishes, once at the end
+        description = run + " run : " + str(matched) + " of " + str(testCount) + " tests matched the bug, " + \
+            "requests: " + describeRequests(requests)
+        failures += report(description, matched == testCount and sum(requests.values()) == expectedRequests, output)
+    return failures
+
+
+def lookUp(cache, bugId, location, timeout):
+    from texttestlib.default.knownbugs import BugSystemBug
+    bug = BugSystemBug("github", bugId, "", 0, 0, 0)
+    return cache.getBugInfo(bug, location, None, None, timeout)
+
+
+def checkCacheDirectly(workDir, tracker):
+    # A new cache, as if in a new run, but writing to a directory of its own
+    os.environ["TEXTTEST_PERSONAL_CONFIG"] = os.path.join(workDir, "direct")
+    sys.path.insert(0, libDir)
+    from texttestlib.default.knownbugs import BugInfoCache
+    cache = BugInfoCache()
+    location = tracker.getLocation()
+    bugIds = ["11", "12", "13", "14"]
+    results = []
+    threads = [threading.Thread(target=lambda bugId=bugId: results.append(lookUp(cache, bugId, location, 1)))
+               for bugId in bugIds * 10]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    requests = tracker.takeRequests()
+    failures = report("40 lookups from 40 threads at once, requests: " + describeRequests(requests),
+                      requests == Counter(bugIds) and all((info[0] == "open" for info in results)))
+
+    lookUp(cache, "15", location, 1)
+    lookUp(cache, "15", location, 1)
+    time.sleep(1.2)
+    lookUp(cache, "15", location, 1)
+    requests = tracker.takeRequests()
+    failures += report("2 lookups within the timeout, then 1 after it, requests: " + describeRequests(requests),
+                       requests == Counter({"15": 2}))
+
+    statuses = [lookUp(cache, "99", location, 300)[0] for _ in range(3)]
+    requests = tracker.takeRequests()
+    failures += report("3 lookups of a bug that doesn't exist, requests: " + describeRequests(requests),
+                       requests == Counter({"99": 3}) and statuses == ["NONEXISTENT"] * 3)
+    return failures
+
+
+def runChecks(workDir, testCount):
+    tracker = StubTracker()
+    try:
+        return checkRuns(workDir, tracker, testCount) + checkCacheDirectly(workDir, tracker)
+    finally:
+        tracker.shutdown()
+
+
+if __name__ == "__main__":
+    options, leftovers = getopt(sys.argv[1:], "n:d:x")
+    optDict = dict(options)
+    workDir = optDict.get("-d")
+    if workDir:
+        workDir = os.path.abspath(workDir)
+        os.makedirs(workDir)
+    else:
+        workDir = tempfile.mkdtemp(prefix="bugcache_check")
+    try:
+        failures = runChecks(workDir, int(optDict.get("-n", "20")))
+    finally:
+        if "-x" in optDict:
+            print("Files left in", workDir)
+        else:
+            shutil.rmtree(workDir, ignore_errors=True)
+    sys.exit(failures)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+# fakegrid_benchmark.py : measures how the master process copes with many slaves, by running a generated
+# test suite on the simulated grid in texttestlib/queuesystem/fakegrid.py
+
+# Usage fakegrid_benchmark.py [ -n <tests> ] [ -g <nodes> ] [ -t <test_time> ] [ -b <batch_time> ] [ -d <working_dir> ] [ -x ]
+
+# <tests> is the number of tests in the generated suite, default 1000.
+
+# <nodes> is the number of fake grid nodes, and hence the most slaves that can run at once, default 100.
+
+# <test_time> is how long, in seconds, each simulated test takes. Default 0.1.
+
+# <batch_time> is the value of queue_system_batch_time to use. Default 2, as in TextTest itself.
+
+# <working_dir> indicates where the suite and the results are written. It defaults to a new temporary directory.
+
+# The -x flag should be provided if the temporary files are to be left. Mostly useful for looking at slave logs.
+
+# Other aspects of the fake grid can be set up with its own environment variables, TEXTTEST_FAKEGRID_*,
+# which are passed through.
+
+import os
+import sys
+import shutil
+import subprocess
+import resource
+import tempfile
+import time
+from glob import glob
+from getopt import getopt
+
+
+def writeFile(fileName, text):
+    with open(fileName, "w") as f:
+        f.write(text)
+
+
+def makeSuite(rootDir, testCount, batchTime):
+    appDir = os.path.join(rootDir, "bench")
+    os.makedirs(appDir)
+    writeFile(os.path.join(appDir, "config.bench"),
+              "executable:/bin/echo\nconfig_module:queuesystem\nqueue_system_module:fakegrid\n" +
+              "queue_system_batch_time:" + str(batchTime) + "\n")
+    names = ["T%06d" % i for i in range(testCount)]
+    for name in names:
+        testDir = os.path.join(appDir, name)
+        os.mkdir(testDir)
+        writeFile(os.path.join(testDir, "output.bench"), name + "\n")
+    writeFile(os.path.join(appDir, "testsuite.bench"), "\n".join(names) + "\n")
+
+
+def getRoundTripTimes(tmpDir):
+    times = []
+    prefix = "Message round trip times:"
+    for logFile in glob(os.path.join(tmpDir, "*", "slavelogs", "*.log")):
+        with open(logFile) as f:
+            for line in f:
+                if line.startswith(prefix):
+                    times += [float(t) for t in line[len(prefix):].split()]
+    return sorted(times)
+
+
+def getPercentile(values, percent):
+    index = min(len(values) - 1, int(len(values) * percent / 100))
+    return values[index]
+
+
+def runBenchmark(workDir, testCount, nodeCount, testTime, batchTime):
+    rootDir = os.path.join(workDir, "root")
+    tmpDir = os.path.join(workDir, "tmp")
+    personalDir = os.path.join(workDir, "personal")
+    makeSuite(rootDir, testCount, batchTime)
+    os.makedirs(personalDir)
+    libDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, TEXTTEST_HOME=rootDir, TEXTTEST_TMP=tmpDir, TEXTTEST_PERSONAL_CONFIG=personalDir,
+               TEXTTEST_FAKEGRID_NODES=str(nodeCount), TEXTTEST_FAKEGRID_TEST_TIME=str(testTime),
+               PYTHONPATH=os.pathsep.join([libDir] + os.getenv("PYTHONPATH", "").split(os.pathsep)).rstrip(os.pathsep))
+    texttest = os.path.join(libDir, "bin", "texttest")
+    print("Running", testCount, "tests taking", testTime, "seconds each on", nodeCount, "fake grid nodes...")
+    startTime = time.time()
+    proc = subprocess.run([sys.executable, texttest, "-con", "-b", "bench"], env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    elapsed = time.time() - startTime
+    succeeded = proc.stdout.count(" succeeded")
+    if succeeded < testCount:
+        print("\n".join(proc.stdout.splitlines()[-20:]))
+    # ru_maxrss is the largest of any single descendant, in kilobytes on Linux
+    peakRss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    print("Tests succeeded   :", succeeded, "of", testCount)
+    print("Elapsed time      : %.2f s" % elapsed)
+    print("Throughput        : %.1f tests/s" % (testCount / elapsed))
+    print("Peak RSS          : %.1f MB (largest single process)" % (peakRss / 1024.0))
+    times = getRoundTripTimes(tmpDir)
+    if times:
+        print("Message round trip: %d messages, median %.1f ms, 90%% %.1f ms, 99%% %.1f ms, max %.1f ms" %
+              (len(times), 1000 * getPercentile(times, 50), 1000 * getPercentile(times, 90),
+               1000 * getPercentile(times, 99), 1000 * times[-1]))
+
+
+if __name__ == "__main__":
+    options, leftovers = getopt(sys.argv[1:], "n:g:t:b:d:x")
+    optDict = dict(options)
+    workDir = optDict.get("-d")
+    if workDir:
+        workDir = os.path.abspath(workDir)
+        os.makedirs(workDir)
+    else:
+        workDir = tempfile.mkdtemp(prefix="fakegrid_benchmark")
+    try:
+        runBenchmark(workDir, int(optDict.get("-n", "1000")), int(optDict.get("-g", "100")),
+                     float(optDict.get("-t", "0.1")), float(optDict.get("-b", "2")))
+    finally:
+        if "-x" in optDict:
+            print("Files left in", workDir)
+        else:
+            shutil.rmtree(workDir, ignore_errors=True)
@@ -0,0 +1,434 @@
+#!/usr/bin/env python
+
+# fakescheduler.py : a stand-in for the commands of SGE, LSF and Condor, so that TextTest's grid engine support
+# can be tested without a grid. Every job runs straight away on this machine, as a process of its own.
+
+# To use it, make links to this script in a directory, named after the commands it should stand in for, and put
+# that directory first in PATH. Those understood are
+#   SGE    : qsub, qstat, qdel, qacct
+#   LSF    : bsub, bkill, bjobs
+#   Condor : condor_submit, condor_q, condor_rm, condor_history, condor_config_val
+# Only the options TextTest uses are supported. Array jobs are, and each task runs with the grid's variable telling
+# it which it is. Unlike real grids, all jobs get the environment they were submitted with.
+
+# The following environment variables can be set:
+
+# TEXTTEST_FAKESCHEDULER_DIR is where the jobs are recorded. It must be set.
+
+# TEXTTEST_FAKESCHEDULER_ERROR, if set, makes SGE jobs go into the error state (Eqw) instead of starting, with this
+# as their error reason.
+
+# TEXTTEST_FAKESCHEDULER_START_FAILURE, if set, makes every job write this to its standard error and exit instead of
+# running its command, as if it failed to start on its machine.
+
+# TEXTTEST_FAKESCHEDULER_LOG is a file to which a line is written for every command run, giving its arguments.
+
+import os
+import re
+import sys
+import json
+import time
+import fcntl
+import shlex
+import signal
+import socket
+import subprocess
+from getopt import getopt, GetoptError
+
+
+def getStateDir():
+    stateDir = os.getenv("TEXTTEST_FAKESCHEDULER_DIR")
+    if not stateDir:
+        sys.stderr.write("TEXTTEST_FAKESCHEDULER_DIR must be set\n")
+        sys.exit(2)
+    os.makedirs(stateDir, exist_ok=True)
+    return stateDir
+
+
+def writeLog(argv):
+    logFile = os.getenv("TEXTTEST_FAKESCHEDULER_LOG")
+    if logFile:
+        with open(logFile, "a") as f:
+            f.write(" ".join([os.path.basename(argv[0])] + argv[1:]) + "\n")
+
+
+def getNewJobId():
+    with open(os.path.join(getStateDir(), "lastjob"), "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        jobId = int(f.read() or "99") + 1
+        f.seek(0)
+        f.truncate()
+        f.write(str(jobId))
+        return str(jobId)
+
+
+def getRecordFile(jobId, taskId):
+    return os.path.join(getStateDir(), jobId + "." + str(taskId) + ".json")
+
+
+def readRecord(fileName):
+    try:
+        with open(fileName) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+
+
+def writeRecord(record):
+    fileName = getRecordFile(record["job"], record["task"])
+    with open(fileName + ".new", "w") as f:
+        json.dump(record, f)
+    os.rename(fileName + ".new", fileName)
+
+
+def getRecords(jobIds=[]):
+    # Job ids may be <job> or <job>.<task>
+    records = []
+    for fileName in sorted(os.listdir(getStateDir()), key=lambda name: [int(part) for part in name.split(".")[:2]]
+                           if name.endswith(".json") else []):
+        if fileName.endswith(".json"):
+            record = readRecord(os.path.join(getStateDir(), fileName))
+            if record and (not jobIds or record["job"] in jobIds or record["job"] + "." + str(record["task"]) in jobIds):
+                records.append(record)
+    return records
+
+
+def isLive(record):
+    return record["status"] in ["running", "error"]
+
+
+def quoteForShell(word):
+    # Plain words are left for the job's shell, so it expands variables like $SHELL, as the grid's shell would
+    return word if re.match(r"^[\w$./:=-]+$", word) else shlex.quote(word)
+
+
+def submitJob(name, command, taskIds, taskVariable, outputFiles=(os.devnull, os.devnull), extraEnv={}, isArray=True):
+    jobId = getNewJobId()
+    errorReason = os.getenv("TEXTTEST_FAKESCHEDULER_ERROR")
+    for taskId in taskIds:
+        record = {"job": jobId, "task": taskId, "array": isArray, "name": name, "status": "running", "pid": None,
+                  "exitCode": None, "errorReason": None, "submitTime": time.time()}
+        if errorReason and taskVariable == "SGE_TASK_ID":
+            record["status"] = "error"
+            record["errorReason"] = errorReason
+            writeRecord(record)
+            continue
+        writeRecord(record)
+        env = dict(os.environ, SHELL=os.getenv("SHELL", "/bin/sh"), JOB_ID=jobId, LSB_JOBID=jobId)
+        if isArray and taskVariable:
+            env[taskVariable] = str(taskId)
+        for var, value in extraEnv.items():
+            env[var] = value.replace("$(Process)", str(taskId))
+        files = [fileName.replace("$(Process)", str(taskId)) for fileName in outputFiles]
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "--run", getRecordFile(jobId, taskId), command] + files,
+                         env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         start_new_session=True)
+    return jobId
+
+
+def runJob(recordFile, command, outputFile, errorFile):
+    # Runs in its own process, so that whoever submitted the job need not wait for it
+    startFailure = os.getenv("TEXTTEST_FAKESCHEDULER_START_FAILURE")
+    if startFailure:
+        command = "echo " + shlex.quote(startFailure) + " >&2; exit 1"
+    with open(outputFile, "a") as out, open(errorFile, "a") as err:
+        proc = subprocess.Popen(["/bin/sh", "-c", command], stdin=subprocess.DEVNULL, stdout=out, stderr=err,
+                                start_new_session=True)
+    record = readRecord(recordFile)
+    record["pid"] = proc.pid
+    writeRecord(record)
+    exitCode = proc.wait()
+    record = readRecord(recordFile)
+    record["exitCode"] = exitCode
+    if record["status"] == "running":
+        record["status"] = "done"
+    writeRecord(record)
+    return 0
+
+
+def deleteJobs(jobIds, sig):
+    # Returns the records of those deleted
+    deleted = []
+    for record in getRecords(jobIds):
+        if isLive(record):
+            record["status"] = "deleted"
+            writeRecord(record)
+            if record["pid"]:
+                try:
+                    os.killpg(record["pid"], sig)
+                except OSError:
+                    pass  # already gone
+            deleted.append(record)
+    return deleted
+
+
+def expandTaskRange(taskRange):
+    # e.g. 1-10:2
+    rangeText, _, step = taskRange.partition(":")
+    first, _, last = rangeText.partition("-")
+    return list(range(int(first), int(last or first) + 1, int(step or 1)))
+
+
+def formatTaskRange(taskIds):
+    if len(taskIds) > 1 and taskIds == list(range(taskIds[0], taskIds[-1] + 1)):
+        return str(taskIds[0]) + "-" + str(taskIds[-1]) + ":1"
+    else:
+        return ",".join(map(str, taskIds))
+
+
+def parseSubmitOptions(argv, valueOptions):
+    # Submit commands have options of more than one letter, which getopt can't handle. The command comes after them
+    # valueOptions says how many values each option that has them takes
+    options, index = {}, 0
+    while index < len(argv) and argv[index].startswith("-"):
+        valueCount = valueOptions.get(argv[index], 0)
+        options[argv[index]] = " ".join(argv[index + 1:index + 1 + valueCount])
+        index += 1 + valueCount
+    return options, argv[index:]
+
+
+def getUser():
+    return os.getenv("USER", "nobody")
+
+
+def formatDate(record):
+    return time.strftime("%m/%d/%Y %H:%M:%S", time.localtime(record["submitTime"]))
+
+
+# SGE
+
+def runQsub(argv):
+    valueOptions = dict.fromkeys(["-N", "-t", "-q", "-p", "-l", "-w", "-m", "-b", "-o", "-e", "-v", "-binding"], 1)
+    optDict, command = parseSubmitOptions(argv, dict(valueOptions, **{"-pe": 2}))
+    taskRange = optDict.get("-t")
+    taskIds = expandTaskRange(taskRange) if taskRange else [1]
+    name = optDict.get("-N", "job")
+    files = optDict.get("-o", os.devnull), optDict.get("-e", os.devnull)
+    jobId = submitJob(name, " ".join(map(quoteForShell, command)), taskIds, "SGE_TASK_ID", files, isArray=bool(taskRange))
+    if taskRange:
+        print("Your job-array " + jobId + "." + taskRange + " (\"" + name + "\") has been submitted")
+    else:
+        print("Your job " + jobId + " (\"" + name + "\") has been submitted")
+    return 0
+
+
+def runQstat(argv):
+    options, _ = getopt(argv, "j:")
+    optDict = dict(options)
+    if "-j" in optDict:
+        return describeSgeJob(optDict["-j"])
+    print("job-ID  prior   name       user         state submit/start at     queue                          slots ja-task-ID")
+    print("-" * 108)
+    errorTasks = {}
+    for record in getRecords():
+        if record["status"] == "running":
+            words = [record["job"], "0.55500", record["name"][:10], getUser(), "r", formatDate(record),
+                     "all.q@" + socket.gethostname(), "1"]
+            if record["array"]:
+                words.append(str(record["task"]))
+            print(" ".join(words))
+        elif record["status"] == "error":
+            errorTasks.setdefault(record["job"], []).append(record)
+    # Tasks that haven't started are shown together, as in SGE
+    for jobId, records in errorTasks.items():
+        words = [jobId, "0.55500", records[0]["name"][:10], getUser(), "Eqw", formatDate(records[0]), "1"]
+        if records[0]["array"]:
+            words.append(formatTaskRange([record["task"] for record in records]))
+        print(" ".join(words))
+    return 0
+
+
+def describeSgeJob(jobId):
+    records = getRecords([jobId])
+    if not records:
+        sys.stderr.write("Following jobs do not exist:\n" + jobId + "\n")
+        return 1
+    print("job_number:                 " + jobId)
+    print("job_name:                   " + records[0]["name"])
+    for record in records:
+        if record["errorReason"]:
+            print("error reason    " + str(record["task"]) + ":          " + record["errorReason"])
+    return 0
+
+
+def runQdel(argv):
+    # Jobs are given as <job>, <job>.<task> or <job>.<task range>
+    for jobText in argv:
+        jobId, _, taskRange = jobText.partition(".")
+        jobIds = [jobId + "." + str(taskId) for taskId in expandTaskRange(taskRange)] if taskRange else [jobId]
+        deleted = deleteJobs(jobIds, signal.SIGUSR2)
+        if not deleted:
+            print("denied: job \"" + jobText + "\" does not exist")
+        for record in deleted:
+            if record["array"]:
+                print(getUser() + " has deleted job-array task " + record["job"] + "." + str(record["task"]))
+            else:
+                print(getUser() + " has deleted job " + record["job"])
+    return 0
+
+
+def runQacct(argv):
+    options, _ = getopt(argv, "j:t:f:")
+    optDict = dict(options)
+    jobId = optDict.get("-j", "")
+    records = [record for record in getRecords([jobId]) if not isLive(record)]
+    if "-t" in optDict:
+        records = [record for record in records if str(record["task"]) == optDict["-t"]]
+    if not records:
+        sys.stderr.write("error: job id " + jobId + " not found\n")
+        return 1
+    for record in records:
+        print("=" * 62)
+        print("qname        all.q")
+        print("hostname     " + socket.gethostname())
+        print("jobname      " + record["name"])
+        print("jobnumber    " + record["job"])
+        print("taskid       " + (str(record["task"]) if record["array"] else "undefined"))
+        print("failed       " + ("0" if record["status"] == "done" else "100 : assumedly after job"))
+        print("exit_status  " + str(record["exitCode"]))
+    return 0
+
+
+# LSF
+
+def runBsub(argv):
+    optDict, command = parseSubmitOptions(argv, dict.fromkeys(["-J", "-n", "-q", "-R", "-m", "-u", "-o", "-e"], 1))
+    name = optDict.get("-J", "job")
+    match = re.match(r"^(.*)\[(.*)\]$", name)
+    taskIds = expandTaskRange(match.group(2)) if match else [0]
+    files = optDict.get("-o", os.devnull), optDict.get("-e", os.devnull)
+    jobId = submitJob(name, " ".join(map(quoteForShell, command)), taskIds, "LSB_JOBINDEX", files, isArray=bool(match))
+    print("Job <" + jobId + "> is submitted to default queue <normal>.")
+    return 0
+
+
+def getLsfJobIds(jobText):
+    # Array tasks are <job>[<task>]
+    match = re.match(r"^(.*)\[(.*)\]$", jobText)
+    return [match.group(1) + "." + match.group(2)] if match else [jobText]
+
+
+def runBkill(argv):
+    options, jobTexts = getopt(argv, "s:")
+    sigName = dict(options).get("-s", "KILL")
+    sig = getattr(signal, "SIG" + sigName) if not sigName.isdigit() else int(sigName)
+    for jobText in jobTexts:
+        if deleteJobs(getLsfJobIds(jobText), sig):
+            print("Job <" + jobText + "> is being " + ("terminated" if sig == signal.SIGKILL else "signaled"))
+        else:
+            print("Job <" + jobText + ">: No matching job found")
+    return 0
+
+
+def runBjobs(argv):
+    _, jobTexts = getopt(argv, "alwum:")
+    for jobText in jobTexts:
+        records = getRecords(getLsfJobIds(jobText))
+        if not records:
+            print("Job <" + jobText + "> is not found")
+        for record in records:
+            status = "RUN" if isLive(record) else ("DONE" if record["exitCode"] == 0 else "EXIT")
+            print("Job <" + jobText + ">, Job Name <" + record["name"] + ">, User <" + getUser() + ">, Status <" +
+                  status + ">, Exit code <" + str(record["exitCode"]) + ">")
+    return 0
+
+
+# Condor
+
+def readSubmitFile(fileName):
+    settings, taskCount = {}, 1
+    with open(fileName) as f:
+        for line in f:
+            key, sep, value = line.partition("=")
+            if sep:
+                settings[key.strip().lower()] = value.strip()
+            elif line.strip().startswith("queue"):
+                words = line.split()
+                taskCount = int(words[1]) if len(words) > 1 else 1
+    return settings, taskCount
+
+
+def runCondorSubmit(argv):
+    settings, taskCount = readSubmitFile(argv[0])
+    # Old-style Condor arguments are just split on white space
+    command = " ".join(map(quoteForShell, [settings["executable"]] + settings.get("arguments", "").split()))
+    extraEnv = dict((var.partition("=")[0], var.partition("=")[2]) for var in settings.get("environment", "").split("|") if var)
+    files = settings.get("output", os.devnull), settings.get("error", os.devnull)
+    jobId = submitJob(os.path.basename(argv[0]), command, list(range(taskCount)), None, files, extraEnv)
+    print("Submitting job(s)" + "." * taskCount)
+    print(str(taskCount) + " job(s) submitted to cluster " + jobId + ".")
+    return 0
+
+
+def getCondorAttributes(record):
+    status = "2" if isLive(record) else "4"
+    return {"clusterid": record["job"], "procid": str(record["task"]), "jobstatus": status, "owner": getUser()}
+
+
+def runCondorQ(argv):
+    # Only -format is understood, which prints the given attributes
+    jobIds, formats, index = [], [], 0
+    while index < len(argv):
+        if argv[index] == "-format":
+            formats.append((argv[index + 1].replace("\\n", "\n"), argv[index + 2].lower()))
+            index += 3
+        elif argv[index] in ["-run"]:
+            index += 1
+        elif argv[index] in ["-name"]:
+            index += 2
+        else:
+            jobIds.append(argv[index])
+            index += 1
+    for record in getRecords(jobIds):
+        if isLive(record):
+            attributes = getCondorAttributes(record)
+            sys.stdout.write("".join((formatText % attributes.get(attribute, "") for formatText, attribute in formats)))
+    return 0
+
+
+def runCondorRm(argv):
+    deleted = deleteJobs(argv, signal.SIGTERM)
+    if not deleted:
+        sys.stderr.write("Couldn't find/remove all jobs matching constraint\n")
+        return 1
+    for jobId in argv:
+        print("Job " + jobId + " marked for removal")
+    return 0
+
+
+def runCondorHistory(argv):
+    records = [record for record in getRecords(argv) if not isLive(record)]
+    print(" ID     OWNER          SUBMITTED   RUN_TIME     ST COMPLETED   CMD")
+    for record in records:
+        status = "C" if record["status"] == "done" else "X"
+        print(" " + record["job"] + "." + str(record["task"]) + "  " + getUser() + "  " + formatDate(record) +
+              "  " + status + "  exit code " + str(record["exitCode"]))
+    return 0
+
+
+def runCondorConfigVal(argv):
+    for name in argv:
+        print(socket.gethostname() if name.upper() == "HOSTNAME" else "Not defined: " + name)
+    return 0
+
+
+runners = {"qsub": runQsub, "qstat": runQstat, "qdel": runQdel, "qacct": runQacct,
+           "bsub": runBsub, "bkill": runBkill, "bjobs": runBjobs,
+           "condor_submit": runCondorSubmit, "condor_q": runCondorQ, "condor_rm": runCondorRm,
+           "condor_history": runCondorHistory, "condor_config_val": runCondorConfigVal}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--run":
+        sys.exit(runJob(*sys.argv[2:]))
+    writeLog(sys.argv)
+    runner = runners.get(os.path.basename(sys.argv[0]))
+    if runner is None:
+        sys.stderr.write("fakescheduler.py must be run through a link called one of " + ", ".join(sorted(runners)) + "\n")
+        sys.exit(2)
+    try:
+        sys.exit(runner(sys.argv[1:]))
+    except GetoptError as e:
+        sys.stderr.write(str(e) + "\n")
+        sys.exit(2)
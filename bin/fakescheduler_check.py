@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+# fakescheduler_check.py : runs a generated test suite through TextTest's SGE, LSF and Condor support, using
+# fakescheduler.py in place of the real grid commands, and checks that it works as expected.
+
+# Usage fakescheduler_check.py [ -n <tests> ] [ -c <capacity> ] [ -d <working_dir> ] [ -x ]
+
+# <tests> is the number of tests in the generated suite, default 30.
+
+# <capacity> is the value of queue_system_max_capacity to use, default 10. With fewer than <tests>, slaves are reused,
+# and the first submission is an array job of <capacity> tasks. When checking the SGE error state, it is used as
+# queue_system_max_array_size instead.
+
+# <working_dir> indicates where the suite, the results and the fake grid's records are written. It defaults to a
+# new temporary directory.
+
+# The -x flag should be provided if the temporary files are to be left. Mostly useful for looking at slave logs.
+
+# For each grid, it checks that all tests succeed and that fewer submissions than tests were made. For SGE it then
+# makes every job go into the error state, and checks that each array was asked about and deleted only once. For
+# Condor it then makes every job fail to start, and checks that each test reports what its own task wrote.
+# The exit code is the number of checks that failed.
+
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+from getopt import getopt
+
+commands = ["qsub", "qstat", "qdel", "qacct", "bsub", "bkill", "bjobs",
+            "condor_submit", "condor_q", "condor_rm", "condor_history", "condor_config_val"]
+gridModules = [("SGE", "qsub"), ("LSF", "bsub"), ("condor", "condor_submit")]
+
+
+def writeFile(fileName, text):
+    with open(fileName, "w") as f:
+        f.write(text)
+
+
+def makeSuite(rootDir, testCount, configEntries):
+    appDir = os.path.join(rootDir, "fakesched")
+    os.makedirs(appDir)
+    configEntries = [("executable", "/bin/echo"), ("config_module", "queuesystem")] + configEntries
+    writeFile(os.path.join(appDir, "config.fakesched"), "".join((key + ":" + str(value) + "\n" for key, value in configEntries)))
+    names = ["T%04d" % i for i in range(testCount)]
+    for name in names:
+        testDir = os.path.join(appDir, name)
+        os.mkdir(testDir)
+        writeFile(os.path.join(testDir, "options.fakesched"), name + "\n")
+        writeFile(os.path.join(testDir, "output.fakesched"), name + "\n")
+        writeFile(os.path.join(testDir, "errors.fakesched"), "")
+    writeFile(os.path.join(appDir, "testsuite.fakesched"), "\n".join(names) + "\n")
+
+
+def makeCommandLinks(binDir):
+    os.makedirs(binDir)
+    script = os.path.abspath(os.path.join(os.path.dirname(__file__), "fakescheduler.py"))
+    for command in commands:
+        os.symlink(script, os.path.join(binDir, command))
+
+
+def runTextTest(workDir, testCount, configEntries, extraEnv={}):
+    # Returns the output, and the fake grid commands run, one list of arguments per command
+    makeSuite(os.path.join(workDir, "root"), testCount, configEntries)
+    os.makedirs(os.path.join(workDir, "personal"))
+    libDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    binDir = os.path.join(os.path.dirname(workDir), "bin")
+    logFile = os.path.join(workDir, "fakescheduler.log")
+    env = dict(os.environ, TEXTTEST_HOME=os.path.join(workDir, "root"), TEXTTEST_TMP=os.path.join(workDir, "tmp"),
+               TEXTTEST_PERSONAL_CONFIG=os.path.join(workDir, "personal"),
+               TEXTTEST_FAKESCHEDULER_DIR=os.path.join(workDir, "jobs"), TEXTTEST_FAKESCHEDULER_LOG=logFile,
+               USER=os.getenv("USER", "texttest"), PATH=binDir + os.pathsep + os.getenv("PATH", ""),
+               PYTHONPATH=os.pathsep.join([libDir] + os.getenv("PYTHONPATH", "").split(os.pathsep)).rstrip(os.pathsep),
+               **extraEnv)
+    texttest = os.path.join(libDir, "bin", "texttest")
+    proc = subprocess.run([sys.executable, texttest, "-con", "-b", "fakesched"], env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    calls = []
+    if os.path.isfile(logFile):
+        with open(logFile) as f:
+            calls = [line.split() for line in f]
+    return proc.stdout, calls
+
+
+def countCalls(calls, *words):
+    return len([call for call in calls if call[:len(words)] == list(words)])
+
+
+def report(description, ok, output):
+    print(("PASSED" if ok else "FAILED") + " : " + description)
+    if not ok:
+        print("\n".join(output.splitlines()[-20:]))
+    return 0 if ok else 1
+
+
+def checkGrid(workDir, queueModule, submitCommand, testCount, capacity):
+    configEntries = [("queue_system_module", queueModule), ("queue_system_max_capacity", capacity)]
+    output, calls = runTextTest(workDir, testCount, configEntries)
+    succeeded = output.count(" succeeded")
+    submissions = countCalls(calls, submitCommand)
+    description = queueModule + " : " + str(succeeded) + " of " + str(testCount) + " tests succeeded, " + \
+        str(submissions) + " " + submitCommand + " calls"
+    return report(description, succeeded == testCount and 0 < submissions < testCount, output)
+
+
+def checkSgeErrorState(workDir, testCount, capacity):
+    # Jobs in the error state never free their capacity: the master only polls once everything is submitted
+    configEntries = [("queue_system_module", "SGE"), ("queue_system_max_capacity", testCount),
+                     ("queue_system_max_array_size", capacity)]
+    extraEnv = {"TEXTTEST_FAKESCHEDULER_ERROR": "can't chdir to directory: No such file or directory",
+                "TEXTTEST_QS_POLL_WAIT": "1"}
+    output, calls = runTextTest(workDir, testCount, configEntries, extraEnv)
+    submissions, queries, deletions = countCalls(calls, "qsub"), countCalls(calls, "qstat", "-j"), countCalls(calls, "qdel")
+    reported = output.count("SGE job entered error state")
+    description = "SGE error state : " + str(submissions) + " qsub, " + str(queries) + " qstat -j and " + \
+        str(deletions) + " qdel calls, " + str(reported) + " of " + str(testCount) + " tests reported the error"
+    return report(description, submissions > 0 and queries == submissions and deletions == submissions and
+                  reported == testCount, output)
+
+
+def checkCondorStartFailure(workDir, testCount, capacity):
+    # Each array task writes its own error file, which the failure of its test should show
+    configEntries = [("queue_system_module", "condor"), ("queue_system_max_capacity", testCount),
+                     ("queue_system_max_array_size", capacity)]
+    extraEnv = {"TEXTTEST_FAKESCHEDULER_START_FAILURE": "could not start the slave", "TEXTTEST_QS_POLL_WAIT": "1"}
+    output, calls = runTextTest(workDir, testCount, configEntries, extraEnv)
+    submissions = countCalls(calls, "condor_submit")
+    reported = output.count("Error messages written by condor job")
+    description = "condor start failure : " + str(submissions) + " condor_submit calls, " + str(reported) + " of " + \
+        str(testCount) + " tests reported their task's errors"
+    return report(description, 0 < submissions < testCount and reported == testCount, output)
+
+
+def runChecks(workDir, testCount, capacity):
+    makeCommandLinks(os.path.join(workDir, "bin"))
+    failures = 0
+    for queueModule, submitCommand in gridModules:
+        failures += checkGrid(os.path.join(workDir, queueModule), queueModule, submitCommand, testCount, capacity)
+    failures += checkSgeErrorState(os.path.join(workDir, "SGE_error"), testCount, capacity)
+    failures += checkCondorStartFailure(os.path.join(workDir, "condor_error"), testCount, capacity)
+    return failures
+
+
+if __name__ == "__main__":
+    options, leftovers = getopt(sys.argv[1:], "n:c:d:x")
+    optDict = dict(options)
+    workDir = optDict.get("-d")
+    if workDir:
+        workDir = os.path.abspath(workDir)
+        os.makedirs(workDir)
+    else:
+        workDir = tempfile.mkdtemp(prefix="fakescheduler_check")
+    try:
+        failures = runChecks(workDir, int(optDict.get("-n", "30")), int(optDict.get("-c", "10")))
+    finally:
+        if "-x" in optDict:
+            print("Files left in", workDir)
+        else:
+            shutil.rmtree(workDir, ignore_errors=True)
+    sys.exit(failures)
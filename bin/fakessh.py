@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+# fakessh.py : a stand-in for ssh and scp, so that TextTest's remote execution can be tested without a remote machine.
+# Every "remote machine" is really this one, but with its own home directory and a simulated delay for connecting.
+
+# To use it, make links called ssh and scp to this script in a directory, and put that directory first in PATH.
+# Then run TextTest with e.g. -m fakehost and remote_copy_program:scp in your config file.
+
+# As in ssh, connections can be shared, by providing -o ControlPath=<socket> and starting a master with
+# -o ControlMaster=yes (or -M) and -N. ControlPersist=<seconds> and -f are supported for the master, as are -O check
+# and -O exit for the clients. Unlike ssh, ControlMaster=auto never starts a master.
+
+# The following environment variables can be set:
+
+# TEXTTEST_FAKESSH_HOME is the home directory on the remote machine. It defaults to the real one.
+
+# TEXTTEST_FAKESSH_CONNECT_TIME is how long, in seconds, connecting to the remote machine takes. Default 0.1.
+
+# TEXTTEST_FAKESSH_LOG is a file to which a line is written for every ssh and scp run. The line says whether it
+# connected ("connect") or used a shared connection ("shared"), which machine it went to, and what it did.
+
+import os
+import sys
+import time
+import shlex
+import socket
+import subprocess
+from getopt import getopt, GetoptError
+
+sshArgOptions = "BbcDEeFIiJLlmOopQRSWw"
+scpArgOptions = "cFiJloPS"
+
+
+def getOptions(argv, argOptions, allOptions):
+    optString = "".join((letter + ":" if letter in argOptions else letter for letter in allOptions))
+    options, leftovers = getopt(argv, optString)
+    config, flags = {}, set()
+    for option, value in options:
+        if option == "-o":
+            key, _, configValue = value.replace("=", " ", 1).partition(" ")
+            config[key.lower()] = configValue.strip()
+        elif value:
+            config[option] = value
+        else:
+            flags.add(option)
+    if "-M" in flags:
+        config["controlmaster"] = "yes"
+    if "-S" in config:
+        config["controlpath"] = config["-S"]
+    return config, flags, leftovers
+
+
+def writeLog(mode, how, machine, description):
+    logFile = os.getenv("TEXTTEST_FAKESSH_LOG")
+    if logFile:
+        with open(logFile, "a") as f:
+            f.write(" ".join([mode, how, machine, description]) + "\n")
+
+
+def getControlPath(config, machine):
+    path = config.get("controlpath")
+    if path and path != "none":
+        user, _, host = machine.rpartition("@")
+        for token, value in [("%%", "\0"), ("%h", host), ("%r", user or os.getenv("USER", "")),
+                             ("%p", config.get("-p", "22")), ("%C", host), ("\0", "%")]:
+            path = path.replace(token, value)
+        return os.path.expanduser(path)
+
+
+def sendToMaster(controlPath, message):
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(controlPath)
+        sock.sendall((message + "\n").encode())
+        sock.close()
+        return True
+    except OSError:
+        return False
+
+
+def connect(mode, config, machine, description):
+    controlPath = getControlPath(config, machine)
+    if controlPath and sendToMaster(controlPath, "use"):
+        writeLog(mode, "shared", machine, description)
+    else:
+        writeLog(mode, "connect", machine, description)
+        time.sleep(float(os.getenv("TEXTTEST_FAKESSH_CONNECT_TIME", "0.1")))
+
+
+def getPersistSeconds(config):
+    # With -N, the master only goes away by itself if it has a time to persist
+    persist = config.get("controlpersist", "no")
+    if persist.isdigit() and int(persist) > 0:
+        return int(persist)
+
+
+def daemonise():
+    if os.fork():
+        os._exit(0)
+    os.setsid()
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in range(3):
+        os.dup2(devnull, fd)
+
+
+def serveConnections(server, persistSeconds):
+    # Leave when nobody has used it for a while, or when told to
+    server.settimeout(persistSeconds)
+    while True:
+        try:
+            conn, _ = server.accept()
+        except socket.timeout:
+            return
+        with conn:
+            message = conn.makefile().readline().strip()
+        if message == "exit":
+            return
+
+
+def runMaster(config, flags, machine):
+    controlPath = getControlPath(config, machine)
+    if sendToMaster(controlPath, "check"):
+        sys.stderr.write("ControlSocket " + controlPath + " already exists\n")
+        return 255
+    writeLog("ssh", "connect", machine, "master")
+    time.sleep(float(os.getenv("TEXTTEST_FAKESSH_CONNECT_TIME", "0.1")))
+    if os.path.exists(controlPath):
+        os.remove(controlPath)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(controlPath)
+    server.listen(100)
+    persistSeconds = getPersistSeconds(config)
+    if "-f" in flags:
+        daemonise()
+    try:
+        serveConnections(server, persistSeconds)
+    finally:
+        server.close()
+        os.remove(controlPath)
+    return 0
+
+
+def getRemoteEnvironment():
+    env = dict(os.environ)
+    home = os.getenv("TEXTTEST_FAKESSH_HOME")
+    if home:
+        env["HOME"] = home
+    return env
+
+
+def runSsh(argv):
+    config, flags, leftovers = getOptions(argv, sshArgOptions, "46AaCfGgKkMNnqsTtVvXxYy" + sshArgOptions)
+    if not leftovers:
+        sys.stderr.write("usage: ssh [options] destination [command]\n")
+        return 255
+    machine, command = leftovers[0], " ".join(leftovers[1:])
+    if "-O" in config:
+        controlPath = getControlPath(config, machine)
+        return 0 if controlPath and sendToMaster(controlPath, config["-O"]) else 255
+    elif config.get("controlmaster") == "yes" and "-N" in flags:
+        return runMaster(config, flags, machine)
+
+    connect("ssh", config, machine, command or "-N")
+    if not command:
+        return 0
+    # Like a real remote shell, the words given are joined together and interpreted again by the shell
+    return subprocess.call(["sh", "-c", command], env=getRemoteEnvironment())
+
+
+def getCopyArgument(path):
+    # Remote paths are interpreted by the remote shell, local ones are taken literally
+    machine, sep, remotePath = path.partition(":")
+    if sep and "/" not in machine:
+        return machine, remotePath
+    else:
+        return None, shlex.quote(path)
+
+
+def runScp(argv):
+    config, _, leftovers = getOptions(argv, scpArgOptions, "346ABCpqrTv" + scpArgOptions)
+    if len(leftovers) < 2:
+        sys.stderr.write("usage: scp [options] source ... target\n")
+        return 1
+    paths = list(map(getCopyArgument, leftovers))
+    machines = set((machine for machine, _ in paths if machine))
+    for machine in machines:
+        connect("scp", config, machine, " ".join(leftovers))
+    # Copy programs follow symbolic links
+    command = " ".join(["cp", "-R", "-L"] + [path for _, path in paths])
+    return subprocess.call(["sh", "-c", command], env=getRemoteEnvironment())
+
+
+if __name__ == "__main__":
+    runner = runScp if "scp" in os.path.basename(sys.argv[0]) else runSsh
+    try:
+        sys.exit(runner(sys.argv[1:]))
+    except GetoptError as e:
+        sys.stderr.write(str(e) + "\n")
+        sys.exit(255)
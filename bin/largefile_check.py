@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+# largefile_check.py : checks that previews of result files and the floating point filter (floating_point_tolerance)
+# work on large files without reading them into memory.
+
+# Usage largefile_check.py [ -s <megabytes> ] [ -l <megabytes> ] [ -d <working_dir> ] [ -x ]
+
+# -s gives the size of the generated files, default 200.
+
+# -l gives how much more memory each step may use than a process that just imports what it needs, default 50.
+
+# <working_dir> indicates where the files are written. It defaults to a new temporary directory.
+
+# The -x flag should be provided if the temporary files are to be left.
+
+# Each step runs in a process of its own, which reports the most memory it used. The exit code is the number of
+# checks that failed.
+
+import os
+import sys
+import shutil
+import resource
+import subprocess
+import tempfile
+from getopt import getopt
+
+libDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+previewWidth, previewLength = 100, 30
+tolerance = 0.01
+# Every this many lines, the result really differs from the standard
+differenceInterval = 100000
+
+
+def writeFiles(workDir, megabytes):
+    # Returns the standard file, the result file and how many lines really differ
+    stdFile, resultFile = os.path.join(workDir, "output.std"), os.path.join(workDir, "output.result")
+    lineIndex, differences, size = 0, 0, 0
+    with open(stdFile, "w") as std, open(resultFile, "w") as result:
+        while size < megabytes * 1024 * 1024:
+            stdLine = "Step %d : position %.4f velocity %.4f\n" % (lineIndex, lineIndex * 0.5, lineIndex * 0.25)
+            if lineIndex % differenceInterval == differenceInterval - 1:
+                resultLine = "Step %d : diverged\n" % lineIndex
+                differences += 1
+            else:
+                # Within the tolerance
+                resultLine = "Step %d : position %.4f velocity %.4f\n" % (lineIndex, lineIndex * 0.5 + 0.001,
+                                                                          lineIndex * 0.25)
+            std.write(stdLine)
+            result.write(resultLine)
+            size += len(resultLine)
+            lineIndex += 1
+    return stdFile, resultFile, differences
+
+
+def runStep(step, *args):
+    # In this process: imports the code under test, runs one step, and writes the most memory used
+    sys.path.insert(0, libDir)
+    from texttestlib import plugins
+    from texttestlib.default.rundependent import FloatingPointFilter
+    if step == "preview":
+        preview = plugins.PreviewGenerator(previewWidth, previewLength).getPreview(open(args[0]))
+        print("Preview lines:", len(preview.splitlines()))
+    elif step == "fpfilter":
+        stdFile, resultFile, filteredFile = args
+        with open(resultFile) as inFile, open(filteredFile, "w") as writeFile:
+            FloatingPointFilter(stdFile, tolerance, None, "").filterFile(inFile, writeFile)
+    print("Max RSS:", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def runStepProcess(step, *args):
+    # Returns the output and the most memory used, in megabytes
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--step", step] + list(args),
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith("Max RSS:"):
+            return proc.stdout, int(line.split()[-1]) / 1024
+    return proc.stdout, float("inf")
+
+
+def countDifferentLines(fileName1, fileName2):
+    with open(fileName1) as f1, open(fileName2) as f2:
+        return sum((line1 != line2 for line1, line2 in zip(f1, f2)))
+
+
+def report(description, ok, output=""):
+    print(("PASSED" if ok else "FAILED") + " : " + description)
+    if not ok and output:
+        print("\n".join(output.splitlines()[-20:]))
+    return 0 if ok else 1
+
+
+def runChecks(workDir, megabytes, limit):
+    stdFile, resultFile, differences = writeFiles(workDir, megabytes)
+    _, baseline = runStepProcess("imports")
+    print("Generated files of", megabytes, "MB, importing alone uses %.0fMB" % baseline)
+
+    output, used = runStepProcess("preview", resultFile)
+    expectedLines = "Preview lines: " + str(previewLength + 1)  # and the line saying it was truncated
+    failures = report("preview used %.0fMB more, limit %dMB" % (used - baseline, limit),
+                      used - baseline <= limit and expectedLines in output, output)
+
+    filteredFile = os.path.join(workDir, "output.fpdiff")
+    output, used = runStepProcess("fpfilter", stdFile, resultFile, filteredFile)
+    remaining = countDifferentLines(stdFile, filteredFile)
+    description = "floating point filter used %.0fMB more, limit %dMB, %d of %d real differences left" % \
+        (used - baseline, limit, remaining, differences)
+    return failures + report(description, used - baseline <= limit and remaining == differences, output)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--step"]:
+        runStep(*sys.argv[2:])
+        sys.exit(0)
+    options, leftovers = getopt(sys.argv[1:], "s:l:d:x")
+    optDict = dict(options)
+    workDir = optDict.get("-d")
+    if workDir:
+        workDir = os.path.abspath(workDir)
+        os.makedirs(workDir)
+    else:
+        workDir = tempfile.mkdtemp(prefix="largefile_check")
+    try:
+        failures = runChecks(workDir, int(optDict.get("-s", "200")), int(optDict.get("-l", "50")))
+    finally:
+        if "-x" in optDict:
+            print("Files left in", workDir)
+        else:
+            shutil.rmtree(workDir, ignore_errors=True)
+    sys.exit(failures)
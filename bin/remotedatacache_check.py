@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+# remotedatacache_check.py : checks that remote_data_cache_size works, i.e. that test data and the SUT are copied
+# to each machine only once, using fakessh.py in place of ssh and scp.
+
+# Usage remotedatacache_check.py [ -n <tests> ] [ -d <working_dir> ] [ -x ]
+
+# <tests> is the number of tests in the generated suite, default 5. All share some of their data.
+
+# <working_dir> indicates where the suite, the results and the fake remote home directory are written. It defaults
+# to a new temporary directory.
+
+# The -x flag should be provided if the temporary files are to be left.
+
+# The suite is run twice on the fake machine "fakehost". It checks that all tests succeed both times, and that the
+# second run copies no data to the cache. It then uses the cache on "localhost" directly, as copying there needs
+# no remote machine, and checks the copied data, that the originals are left writable, and that a second copy
+# sends nothing. Last, it checks that files are only digested again if they change. The exit code is the number of
+# checks that failed.
+
+import os
+import sys
+import stat
+import shutil
+import filecmp
+import subprocess
+import tempfile
+from getopt import getopt
+
+libDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def writeFile(fileName, text, executable=False):
+    with open(fileName, "w") as f:
+        f.write(text)
+    if executable:
+        os.chmod(fileName, 0o755)
+
+
+def makeSuite(rootDir, testCount):
+    appDir = os.path.join(rootDir, "rdc")
+    os.makedirs(appDir)
+    sut = os.path.join(rootDir, "sut.sh")
+    writeFile(sut, "#!/bin/sh\ncat own/* ; wc -c < shared/big.txt\n", executable=True)
+    writeFile(os.path.join(appDir, "config.rdc"),
+              "executable:" + sut + "\nremote_shell_program:ssh\nremote_copy_program:scp\nremote_data_cache_size:100\n" +
+              "copy_test_path:own\nlink_test_path:shared\n")
+    bigText = "".join(("line %d of the data every test shares\n" % i for i in range(20000)))
+    names = ["T%03d" % i for i in range(testCount)]
+    for name in names:
+        testDir = os.path.join(appDir, name)
+        os.makedirs(os.path.join(testDir, "own"))
+        os.makedirs(os.path.join(testDir, "shared"))
+        writeFile(os.path.join(testDir, "own", "data.txt"), "data for " + name + "\n")
+        writeFile(os.path.join(testDir, "shared", "big.txt"), bigText)
+        writeFile(os.path.join(testDir, "output.rdc"), "data for " + name + "\n" + str(len(bigText)) + "\n")
+        writeFile(os.path.join(testDir, "errors.rdc"), "")
+    writeFile(os.path.join(appDir, "testsuite.rdc"), "\n".join(names) + "\n")
+
+
+def makeCommandLinks(binDir):
+    os.makedirs(binDir)
+    script = os.path.join(libDir, "bin", "fakessh.py")
+    for command in ["ssh", "scp"]:
+        os.symlink(script, os.path.join(binDir, command))
+
+
+def getEnvironment(workDir):
+    return dict(os.environ, TEXTTEST_HOME=os.path.join(workDir, "root"), TEXTTEST_TMP=os.path.join(workDir, "tmp"),
+                TEXTTEST_PERSONAL_CONFIG=os.path.join(workDir, "personal"),
+                TEXTTEST_FAKESSH_HOME=os.path.join(workDir, "remotehome"), TEXTTEST_FAKESSH_CONNECT_TIME="0",
+                USER=os.getenv("USER", "texttest"), PATH=os.path.join(workDir, "bin") + os.pathsep + os.getenv("PATH", ""),
+                PYTHONPATH=os.pathsep.join([libDir] + os.getenv("PYTHONPATH", "").split(os.pathsep)).rstrip(os.pathsep))
+
+
+def runTextTest(workDir, logFile):
+    # Returns the output, and the scp commands that copied data into the cache
+    env = dict(getEnvironment(workDir), TEXTTEST_FAKESSH_LOG=logFile)
+    texttest = os.path.join(libDir, "bin", "texttest")
+    proc = subprocess.run([sys.executable, texttest, "-con", "-b", "-m", "fakehost"], env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    with open(logFile) as f:
+        blobCopies = [line for line in f if line.startswith("scp ") and "/cache/data/incoming" in line]
+    return proc.stdout, blobCopies
+
+
+def report(description, ok, output=""):
+    print(("PASSED" if ok else "FAILED") + " : " + description)
+    if not ok and output:
+        print("\n".join(output.splitlines()[-20:]))
+    return 0 if ok else 1
+
+
+def checkRemoteRuns(workDir, testCount):
+    failures = 0
+    for run, expectCopies in [("first", True), ("second", False)]:
+        output, blobCopies = runTextTest(workDir, os.path.join(workDir, run + ".log"))
+        succeeded = output.count(" - SUCCESS!")
+        description = run + " run on fakehost : " + str(succeeded) + " of " + str(testCount) + " tests succeeded, " + \
+            str(len(blobCopies)) + " copies to the cache"
+        failures += report(description, succeeded == testCount and bool(blobCopies) == expectCopies, output)
+    return failures
+
+
+def getBlobInodes(cacheDir):
+    inodes = {}
+    for root, _, files in os.walk(os.path.join(cacheDir, "blobs")):
+        for fileName in files:
+            inodes[fileName] = os.stat(os.path.join(root, fileName)).st_ino
+    return inodes
+
+
+def checkLocalCache(workDir):
+    # There is no remote copying to localhost when running tests, so use the cache directly
+    os.environ.update(getEnvironment(workDir))
+    os.environ["HOME"] = os.path.join(workDir, "localhome")
+    sys.path.insert(0, libDir)
+    sys.argv = ["texttest", "-a", "rdc"]
+    from texttestlib import testmodel
+    from texttestlib.default.remotedatacache import RemoteDataCache
+    appDir = os.path.join(workDir, "root", "rdc")
+    app = testmodel.Application("rdc", testmodel.DirectoryCache(appDir), [], testmodel.OptionFinder())
+    cache = RemoteDataCache.getForMachine(app, "localhost")
+    if cache is None:
+        return report("localhost : no cache was provided")
+
+    sourceDir = os.path.join(appDir, "T000", "shared")
+    targetDir = os.path.join(workDir, "localtarget")
+    cacheDir = os.path.expandvars(cache.cacheDir)
+    copied = cache.copyPath(sourceDir, targetDir, link=True)
+    targetPath = os.path.join(targetDir, "shared")
+    same = copied and not filecmp.dircmp(sourceDir, targetPath).diff_files and \
+        os.listdir(sourceDir) == os.listdir(targetPath)
+    writable = all((os.stat(os.path.join(sourceDir, f)).st_mode & stat.S_IWUSR for f in os.listdir(sourceDir)))
+    blobsBefore = getBlobInodes(cacheDir)
+    copiedAgain = cache.copyPath(sourceDir, targetDir, link=True)
+    failures = report("localhost : data copied via the cache", same)
+    failures += report("localhost : original data left writable", writable)
+    return failures + report("localhost : second copy sent nothing", copiedAgain and blobsBefore and
+                             getBlobInodes(cacheDir) == blobsBefore)
+
+
+def checkDigests(workDir):
+    # Each file's contents should be read once per run, unless it changes
+    from texttestlib.default.remotedatacache import RemoteDataCache
+    path = os.path.join(workDir, "digested")
+    writeFile(path, "before")
+    first = RemoteDataCache.getBlobName(path)
+    digestCount = len(RemoteDataCache.digests)
+    second = RemoteDataCache.getBlobName(path)
+    failures = report("same file digested once", first == second and len(RemoteDataCache.digests) == digestCount)
+    modTime = os.stat(path).st_mtime_ns
+    writeFile(path, "after!")
+    os.utime(path, ns=(modTime + 10 ** 9, modTime + 10 ** 9))
+    return failures + report("changed file digested again", RemoteDataCache.getBlobName(path) != first)
+
+
+def runChecks(workDir, testCount):
+    makeSuite(os.path.join(workDir, "root"), testCount)
+    makeCommandLinks(os.path.join(workDir, "bin"))
+    return checkRemoteRuns(workDir, testCount) + checkLocalCache(workDir) + checkDigests(workDir)
+
+
+if __name__ == "__main__":
+    options, leftovers = getopt(sys.argv[1:], "n:d:x")
+    optDict = dict(options)
+    workDir = optDict.get("-d")
+    if workDir:
+        workDir = os.path.abspath(workDir)
+        os.makedirs(workDir)
+    else:
+        workDir = tempfile.mkdtemp(prefix="remotedatacache_check")
+    try:
+        failures = runChecks(workDir, int(optDict.get("-n", "5")))
+    finally:
+        if "-x" in optDict:
+            print("Files left in", workDir)
+        else:
+            shutil.rmtree(workDir, ignore_errors=True)
+    sys.exit(failures)
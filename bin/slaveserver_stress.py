@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+# slaveserver_stress.py : checks that the master's slave server copes with thousands of slaves at once, without a
+# thread per connection. The slaves are fakes, all run by one asyncio loop in a separate process, and the messages
+# they send are handled without changing any test state.
+
+# Usage slaveserver_stress.py [ -s <slaves> ] [ -m <messages> ] [ -k <kilobytes> ] [ -d <working_dir> ] [ -x ]
+
+# <slaves> is the number of fake slaves, each with its own connection, all connected at once. Default 2000.
+
+# <messages> is how many messages each slave sends, waiting for the answer to each before sending the next, as real
+# slaves do. Default 10.
+
+# <kilobytes> is the size of each message, default 2.
+
+# <working_dir> indicates where the application used to set up the server is written. It defaults to a new
+# temporary directory.
+
+# The -x flag should be provided if the temporary files are to be left.
+
+# It checks that every message is answered, and that the master never has more threads than its workers and a few
+# others. It also reports the rate and the memory used. The exit code is the number of checks that failed.
+
+import os
+import sys
+import time
+import shutil
+import asyncio
+import resource
+import tempfile
+import threading
+import subprocess
+from getopt import getopt
+
+libDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Besides the workers: the main thread, the server's loop, and this script's sampling
+otherThreads = 3
+
+
+def raiseFileLimit():
+    # Each connection is a file descriptor on both sides
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard if hard != resource.RLIM_INFINITY else 65536, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+async def runSlave(host, port, messageCount, message):
+    for _ in range(100):
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            break
+        except OSError:
+            await asyncio.sleep(0.05)  # listen queue full, try again
+    else:
+        return 0
+    from texttestlib.queuesystem.utils import connectionText, frameHeader
+    writer.write((connectionText + "\n").encode())
+    frame = frameHeader.pack(len(message)) + message + frameHeader.pack(0)
+    answered = 0
+    for _ in range(messageCount):
+        writer.write(frame)
+        await writer.drain()
+        size = frameHeader.unpack(await reader.readexactly(frameHeader.size))[0]
+        await reader.readexactly(size)
+        answered += 1
+    writer.close()
+    return answered
+
+
+async def runSlaves(host, port, slaveCount, messageCount, kilobytes):
+    # Like a slave sending a test state: identifier line, test line, then the pickled state
+    message = b"12345.NO_REUSE\nSTRESS:T0001\n" + os.urandom(kilobytes * 1024)
+    results = await asyncio.gather(*(runSlave(host, port, messageCount, message) for _ in range(slaveCount)))
+    return sum(results)
+
+
+def slaveMain(host, port, slaveCount, messageCount, kilobytes):
+    raiseFileLimit()
+    sys.path.insert(0, libDir)
+    start = time.time()
+    answered = asyncio.run(runSlaves(host, int(port), int(slaveCount), int(messageCount), int(kilobytes)))
+    print("Answered:", answered, time.time() - start)
+
+
+def makeApplication(workDir):
+    appDir = os.path.join(workDir, "stress")
+    os.makedirs(appDir)
+    with open(os.path.join(appDir, "config.stress"), "w") as f:
+        f.write("executable:/bin/echo\nconfig_module:queuesystem\nqueue_system_module:local\n")
+    os.environ.update(TEXTTEST_HOME=workDir, TEXTTEST_TMP=os.path.join(workDir, "tmp"),
+                      TEXTTEST_PERSONAL_CONFIG=os.path.join(workDir, "personal"))
+    sys.path.insert(0, libDir)
+    sys.argv = ["texttest", "-a", "stress"]
+    from texttestlib import testmodel
+    return testmodel.Application("stress", testmodel.DirectoryCache(appDir), [], testmodel.OptionFinder())
+
+
+def makeServer(app):
+    from texttestlib import plugins
+    from texttestlib.queuesystem import masterprocess
+    plugins.configureLogging()
+
+    class CountingHandler(masterprocess.SlaveRequestHandler):
+        def handleMessage(self, identifier):
+            # Read everything a slave sends with its results, but don't look for the test
+            self.rfile.readline()
+            self.rfile.read()
+            self.server.countMessage()
+
+    class StressServer(masterprocess.SlaveServerResponder):
+        def __init__(self, *args):
+            masterprocess.SlaveServerResponder.__init__(self, *args)
+            self.messageCount = 0
+            self.countLock = threading.Lock()
+
+        def handlerClass(self):
+            return CountingHandler
+
+        def countMessage(self):
+            with self.countLock:
+                self.messageCount += 1
+
+    return StressServer({}, [app])
+
+
+def report(description, ok, output=""):
+    print(("PASSED" if ok else "FAILED") + " : " + description)
+    if not ok and output:
+        print("\n".join(output.splitlines()[-20:]))
+    return 0 if ok else 1
+
+
+def runStress(workDir, slaveCount, messageCount, kilobytes):
+    fileLimit = raiseFileLimit()
+    if fileLimit < slaveCount + 100:
+        print("Only", fileLimit, "files can be open at once, which may not be enough for", slaveCount, "slaves")
+    server = makeServer(makeApplication(workDir))
+    serverThread = threading.Thread(target=server.run, daemon=True)
+    serverThread.start()
+    host, port = server.getAddress().split(":")
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--slaves", host, port,
+                             str(slaveCount), str(messageCount), str(kilobytes)],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    peakThreads = 0
+    while proc.poll() is None:
+        peakThreads = max(peakThreads, threading.active_count())
+        time.sleep(0.02)
+    output = proc.stdout.read()
+    server.terminate = True
+    server.wakeUp()
+    serverThread.join(10)
+
+    expected = slaveCount * messageCount
+    answered, elapsed = 0, 0.0
+    for line in output.splitlines():
+        if line.startswith("Answered:"):
+            answered, elapsed = int(line.split()[1]), float(line.split()[2])
+    rate = answered / elapsed if elapsed else 0.0
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    description = str(slaveCount) + " slaves x " + str(messageCount) + " messages : " + str(answered) + " of " + \
+        str(expected) + " answered in %.2fs, %.0f messages/s, max RSS %.0fMB" % (elapsed, rate, maxRss)
+    failures = report(description, answered == expected and server.messageCount == expected, output)
+    threadLimit = server.workerCount + otherThreads
+    return failures + report("at most " + str(peakThreads) + " threads in the master, limit " + str(threadLimit),
+                             peakThreads <= threadLimit)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--slaves"]:
+        slaveMain(*sys.argv[2:])
+        sys.exit(0)
+    options, leftovers = getopt(sys.argv[1:], "s:m:k:d:x")
+    optDict = dict(options)
+    workDir = optDict.get("-d")
+    if workDir:
+        workDir = os.path.abspath(workDir)
+        os.makedirs(workDir)
+    else:
+        workDir = tempfile.mkdtemp(prefix="slaveserver_stress")
+    try:
+        failures = runStress(workDir, int(optDict.get("-s", "2000")), int(optDict.get("-m", "10")),
+                             int(optDict.get("-k", "2")))
+    finally:
+        if "-x" in optDict:
+            print("Files left in", workDir)
+        else:
+            shutil.rmtree(workDir, ignore_errors=True)
+    sys.exit(failures)
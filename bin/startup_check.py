@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+# startup_check.py : checks that a console run of TextTest starts up quickly, and that it doesn't import the modules
+# that are only needed for batch web pages and reports.
+
+# Usage startup_check.py [ -n <tests> ] [ -t <seconds> ] [ -m <modules> ] [ -r <runs> ] [ -d <working_dir> ] [ -x ]
+
+# <tests> is the number of tests in the generated suite, default 100.
+
+# <seconds> is the longest start-up may take, from the interpreter starting until the test suite is read, as
+# printed by --startup-profile. Default 1.5.
+
+# <modules> is the most modules that may be loaded once the run is over, default 250.
+
+# <runs> is how many times to run the suite. The fastest start-up is the one checked, as the first run in particular
+# may be slowed down by compiling and the file system cache. Default 3.
+
+# <working_dir> indicates where the suite and the results are written. It defaults to a new temporary directory.
+
+# The -x flag should be provided if the temporary files are to be left.
+
+# The exit code is the number of checks that failed.
+
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+from getopt import getopt
+
+libDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Deferred until used: only batch runs generating web pages or external reports should need them
+deferredModules = ["texttestlib.default.batch.testoverview", "texttestlib.default.batch.summarypages",
+                   "texttestlib.default.batch.externalreport", "pprint"]
+# Runs TextTest in the same way as bin/texttest, and says what was imported once it's finished
+runnerCode = """
+import sys, runpy
+sys.argv[0] = {texttest!r}
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+finally:
+    print("Modules loaded: " + str(len(sys.modules)) + " " + " ".join(sorted(sys.modules)))
+"""
+
+
+def writeFile(fileName, text):
+    with open(fileName, "w") as f:
+        f.write(text)
+
+
+def makeSuite(rootDir, testCount):
+    appDir = os.path.join(rootDir, "startup")
+    os.makedirs(appDir)
+    writeFile(os.path.join(appDir, "config.startup"), "executable:/bin/echo\n")
+    names = ["T%04d" % i for i in range(testCount)]
+    for name in names:
+        testDir = os.path.join(appDir, name)
+        os.mkdir(testDir)
+        writeFile(os.path.join(testDir, "options.startup"), name + "\n")
+        writeFile(os.path.join(testDir, "output.startup"), name + "\n")
+        writeFile(os.path.join(testDir, "errors.startup"), "")
+    writeFile(os.path.join(appDir, "testsuite.startup"), "\n".join(names) + "\n")
+
+
+def runTextTest(workDir):
+    # Returns the output, the start-up time and the modules loaded
+    env = dict(os.environ, TEXTTEST_HOME=os.path.join(workDir, "root"), TEXTTEST_TMP=os.path.join(workDir, "tmp"),
+               TEXTTEST_PERSONAL_CONFIG=os.path.join(workDir, "personal"), USER=os.getenv("USER", "texttest"))
+    code = runnerCode.format(texttest=os.path.join(libDir, "bin", "texttest"))
+    proc = subprocess.run([sys.executable, "-c", code, "-con", "-b", "-startup-profile"], env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    startupTime, modules = None, []
+    for line in proc.stdout.splitlines():
+        words = line.split()
+        if words[:1] == ["Total"] and line.endswith("s"):
+            startupTime = float(words[-1][:-1])
+        elif line.startswith("Modules loaded: "):
+            modules = words[3:]
+    return proc.stdout, startupTime, modules
+
+
+def report(description, ok, output=""):
+    print(("PASSED" if ok else "FAILED") + " : " + description)
+    if not ok and output:
+        print("\n".join(output.splitlines()[-20:]))
+    return 0 if ok else 1
+
+
+def runChecks(workDir, testCount, maxSeconds, maxModules, runs):
+    makeSuite(os.path.join(workDir, "root"), testCount)
+    os.makedirs(os.path.join(workDir, "personal"))
+    results = [runTextTest(workDir) for _ in range(runs)]
+    output, startupTime, modules = min(results, key=lambda result: result[1] or float("inf"))
+    succeeded = output.count(" - SUCCESS!")
+    failures = report(str(succeeded) + " of " + str(testCount) + " tests succeeded", succeeded == testCount, output)
+    if startupTime is None:
+        return failures + report("no start-up profile was printed", False, output)
+    failures += report("started up in %.3fs, limit %.3fs" % (startupTime, maxSeconds), startupTime <= maxSeconds)
+    failures += report(str(len(modules)) + " modules loaded, limit " + str(maxModules), len(modules) <= maxModules)
+    imported = [module for module in deferredModules if module in modules]
+    return failures + report("modules that should be deferred : " + (", ".join(imported) or "none imported"), not imported)
+
+
+if __name__ == "__main__":
+    options, leftovers = getopt(sys.argv[1:], "n:t:m:r:d:x")
+    optDict = dict(options)
+    workDir = optDict.get("-d")
+    if workDir:
+        workDir = os.path.abspath(workDir)
+        os.makedirs(workDir)
+    else:
+        workDir = tempfile.mkdtemp(prefix="startup_check")
+    try:
+        failures = runChecks(workDir, int(optDict.get("-n", "100")), float(optDict.get("-t", "1.5")),
+                             int(optDict.get("-m", "250")), int(optDict.get("-r", "3")))
+    finally:
+        if "-x" in optDict:
+            print("Files left in", workDir)
+        else:
+            shutil.rmtree(workDir, ignore_errors=True)
+    sys.exit(failures)
@@ -1,6 +1,7 @@
 """ The default configuration, from which all others should be derived """
 
 import os
+import tarfile
 import subprocess
 import operator
 import logging
@@ -8,7 +9,6 @@ import texttestlib.default.sandbox
 import texttestlib.default.console
 import texttestlib.default.rundependent
 import texttestlib.default.comparetest
-import texttestlib.default.batch
 import texttestlib.default.performance
 from .. import plugins
 from copy import copy
@@ -18,10 +18,12 @@ from threading import Thread
 from locale import getpreferredencoding
 # For back-compatibility
 from .runtest import RunTest, Running, Killed
-from .batch.externalreport import ExternalFormatResponder, ExternalFormatCollector
 from .database_data import SaveDatabase
+from .grepindex import TrigramIndex
+from .remoteconnections import SharedConnection
 from .scripts import *
 from functools import reduce
+from importlib import import_module
 from configparser import ConfigParser
 
 
@@ -29,6 +31,16 @@ def getConfig(optionMap):
     return Config(optionMap)
 
 
+def __getattr__(name):
+    # For back-compatibility: these were once imported here, but only batch mode needs them, so load them when asked for
+    # import_module rather than "from . import", which would come back here while batch is still being imported
+    if name == "batch":
+        return import_module(".batch", __name__)
+    elif name in ["ExternalFormatResponder", "ExternalFormatCollector"]:
+        return getattr(import_module(".batch.externalreport", __name__), name)
+    raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+
+
 class Config:
     loggingSetup = False
     removePreviousThread = None
@@ -129,6 +141,7 @@ class Config:
                 group.addOption("s", "Run this script")
                 group.addOption("d", "Look for test files under")
                 group.addSwitch("help", "Print configuration help text on stdout")
+                group.addSwitch("startup-profile", "Print how long each phase of starting up took")
                 group.addSwitch("g", "use dynamic GUI")
                 group.addSwitch("gx", "use static GUI")
                 group.addSwitch("con", "use console interface")
@@ -414,6 +427,7 @@ class Config:
             classes += self.getThreadActionClasses()
 
         if self.batchMode() and not self.runningScript():
+            from . import batch
             if "coll" in self.optionMap:
                 arg = self.optionMap["coll"]
                 if arg != "mail":
@@ -421,6 +435,7 @@ class Config:
                 if not arg or "web" not in arg:
                     classes.append(batch.CollectFilesResponder)
                 if self.anyAppHas(allApps, lambda app: self.getBatchConfigValue(app, "batch_external_format") in ["trx", "jetbrains"]):
+                    from .batch.externalreport import ExternalFormatCollector
                     classes.append(ExternalFormatCollector)
             else:
                 if self.optionValue("b") is None:
@@ -429,6 +444,7 @@ class Config:
                 if self.anyAppHas(allApps, lambda app: self.emailEnabled(app)):
                     classes.append(batch.EmailResponder)
                 if self.anyAppHas(allApps, lambda app: self.getBatchConfigValue(app, "batch_external_format") != "false"):
+                    from .batch.externalreport import ExternalFormatResponder
                     classes.append(ExternalFormatResponder)
 
         if os.name == "posix" and self.useVirtualDisplay():
@@ -772,7 +788,7 @@ class Config:
                 filters.append(performance.TimeFilter(timeLimit))
         if "grep" in optionMap:
             grepFile = optionMap.get("grepfile", app.getConfigValue("log_file"))
-            filters.append(GrepFilter(optionMap["grep"], grepFile, **kw))
+            filters.append(GrepFilter(optionMap["grep"], grepFile, grepIndex=TrigramIndex.getForApp(app), **kw))
         return filters
 
     def batchMode(self):
@@ -918,6 +934,7 @@ class Config:
 
     def getStateSaver(self):
         if self.actualBatchMode():
+            from . import batch
             return batch.SaveState
         elif self.keepTemporaryDirectories() or "rerun" in self.optionMap:
             return SaveState
@@ -936,6 +953,7 @@ class Config:
         return console.InteractiveResponder
 
     def getWebPageResponder(self):
+        from . import batch
         return batch.WebPageResponder
 
     # Utilities, which prove useful in many derived classes
@@ -999,7 +1017,8 @@ class Config:
                 "Must provide '-b' argument to identify the batch session when running with '-coll' to collect batch run data")
         self.optionIntValue("delay", optionType=float)  # throws if it's not numeric...
         if batchSession is not None and "coll" not in self.optionMap:
-            batchFilter = batch.BatchVersionFilter(batchSession)
+            from .batch import BatchVersionFilter
+            batchFilter = BatchVersionFilter(batchSession)
             batchFilter.verifyVersions(suite.app)
         if self.isReconnecting():
             self.reconnectConfig.checkSanity(suite.app)
@@ -1417,6 +1436,8 @@ class Config:
                              "Mapping of result file names to paths to collect them from")
         app.setConfigDefault("collate_script", self.getDefaultCollateScripts(),
                              "Mapping of result file names to scripts which turn them into suitable text")
+        app.setConfigDefault("collate_script_max_processes", 4,
+                             "How many collate_script pipelines may run at the same time for each test")
         trafficText = "Deprecated. Use CaptureMock."
         app.setConfigDefault("collect_traffic", {"default": [], "asynchronous": []}, trafficText)
         app.setConfigDefault("collect_traffic_environment", {"default": []}, trafficText)
@@ -1430,6 +1451,8 @@ class Config:
 
         app.setConfigDefault("unordered_text", {"default": []},
                              "Mapping of patterns to extract and sort from result files", trackFiles=True)
+        app.setConfigDefault("unordered_text_memory_limit", 100000000,
+                             "Bytes of unordered text to sort in memory before spilling sorted runs to temporary files. -1 means no limit.")
         app.setConfigDefault("file_split_pattern", {}, "Pattern to use for splitting result files")
         app.setConfigDefault("create_catalogues", "false", "Do we create a listing of files created/removed by tests")
         app.setConfigAlias("collect_file_changes", "create_catalogues")
@@ -1518,6 +1541,8 @@ class Config:
                              "Username to use when logging in to bug systems defined in bug_system_location")
         app.setConfigDefault("bug_system_password", {},
                              "Password to use when logging in to bug systems defined in bug_system_location")
+        app.setConfigDefault("bug_system_cache_timeout", 300,
+                             "How long, in seconds, to reuse information fetched from bug systems. 0 means always fetch it again.")
         app.setConfigDefault("batch_jenkins_marked_artefacts", {
                              "default": []}, "Artefacts to highlight in the report when they are updated")
         app.setConfigDefault("batch_jenkins_archive_file_pattern", {
@@ -1550,6 +1575,7 @@ class Config:
             return cmdArgs
         else:
             args = self.getRemoteProgramArgs(app, "remote_shell_program")
+            args = self.addSharedConnectionOptions(app, machine, args)
             if args[0] == "ssh":
                 if graphical:
                     args.append("-Y")
@@ -1632,11 +1658,57 @@ class Config:
     def getRemoteCopyFileProcess(self, app, srcFile, srcMachine, dstFile, dstMachine, ignoreLinks=False):
         srcPath = self.getRemotePath(srcFile, srcMachine)
         dstPath = self.getRemotePath(dstFile, dstMachine)
-        args = self.getRemoteProgramArgs(app, "remote_copy_program") + [srcPath, dstPath]
+        remoteMachine = srcMachine if dstMachine == "localhost" else dstMachine
+        args = self.getRemoteProgramArgs(app, "remote_copy_program")
+        args = self.addSharedConnectionOptions(app, remoteMachine, args) + [srcPath, dstPath]
         if ignoreLinks:
             args = self.removeLinkArgs(args)
         return subprocess.Popen(args, stdin=open(os.devnull), stdout=open(os.devnull, "w"), stderr=subprocess.STDOUT)
 
+    def copyFilesRemotely(self, app, srcFiles, dstDir, dstMachine):
+        # Sending them all at once saves connecting to the machine for each one
+        if len(srcFiles) > 1 and self.canSendFilesTogether(app) and \
+                self.sendFilesTogether(app, srcFiles, dstDir, dstMachine) == 0:
+            return 0
+        exitCodes = [self.copyFileRemotely(app, srcFile, "localhost", dstDir, dstMachine) for srcFile in srcFiles]
+        return max(exitCodes, default=0)
+
+    def canSendFilesTogether(self, app):
+        # Only ssh reliably forwards the exit code, and other copy programs (e.g. rsync) may have their own behaviour
+        shellArgs = self.getRemoteProgramArgs(app, "remote_shell_program")
+        copyArgs = self.getRemoteProgramArgs(app, "remote_copy_program")
+        return SharedConnection.isSsh(shellArgs) and os.path.basename(copyArgs[0]) == "scp"
+
+    def sendFilesTogether(self, app, srcFiles, dstDir, dstMachine):
+        # Sends several local files in one archive stream over the remote shell, rather than copying each separately
+        cmdArgs = ["mkdir", "-p", plugins.quote(dstDir), "&&", "tar", "-xf", "-", "-C", plugins.quote(dstDir)]
+        allArgs = self.getCommandArgsOn(app, dstMachine, cmdArgs)
+        proc = subprocess.Popen(allArgs, stdin=subprocess.PIPE, stdout=open(os.devnull, "w"), stderr=subprocess.STDOUT)
+        try:
+            # Follow links, like scp does
+            with tarfile.open(fileobj=proc.stdin, mode="w|", dereference=True) as tarFile:
+                for srcFile in srcFiles:
+                    tarFile.add(srcFile, arcname=os.path.basename(srcFile))
+        except OSError as e:
+            # A broken pipe, or a local path we can't read such as a dangling link.
+            # Don't leave tar waiting for the rest: the caller copies each path instead, reporting any bad ones
+            logging.getLogger("remote commands").info("Failed to send files to " + dstMachine + " : " + str(e))
+            proc.kill()
+        finally:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+        return proc.wait()
+
+    def addSharedConnectionOptions(self, app, machine, progArgs):
+        sshArgs = self.getRemoteProgramArgs(app, "remote_shell_program")
+        if SharedConnection.isSsh(sshArgs):
+            connection = SharedConnection.getForMachine(app, machine)
+            if connection:
+                return connection.addOptions(progArgs, sshArgs)
+        return progArgs
+
     def removeLinkArgs(self, args):
         for opt in ["--copy-unsafe-links", "--delete"]:  # rsync args. Add others...
             if opt in args:
@@ -1661,8 +1733,16 @@ class Config:
                              "Default options to use for particular remote shell programs")
         app.setConfigDefault("remote_copy_program", "",
                              "(UNIX) Program to use for copying files remotely, in case of non-shared file systems")
+        app.setConfigDefault("remote_connection_sharing", 1,
+                             "(UNIX) When the remote shell program is ssh, keep one connection open to each remote machine " +
+                             "and share it between all the commands and copies made there")
+        app.setConfigDefault("remote_data_cache_size", 0,
+                             "(UNIX) Megabytes of test data and SUT files to keep cached on each remote machine, " +
+                             "so that they need only be copied there once. 0 means no cache")
         app.setConfigDefault("default_filter_file", [],
                              "Filter file to use by default, generally only useful for versions")
+        app.setConfigDefault("use_grep_index", 0,
+                             "Keep an index of test file contents in the personal cache, so that searching test files reads only those which might match")
         app.setConfigDefault("test_data_environment", {},
                              "Environment variables to be redirected for linked/copied test data")
         app.setConfigDefault("test_data_require", [], "Test data names that are required to exist for the SUT to work")
@@ -1782,19 +1862,28 @@ class TestRelPathFilter(plugins.TextFilter):
 
 
 class GrepFilter(plugins.TextFilter):
-    def __init__(self, filterText, fileStem, useTmpFiles=False):
+    def __init__(self, filterText, fileStem, useTmpFiles=False, grepIndex=None):
         plugins.TextFilter.__init__(self, filterText)
         self.fileStem = fileStem
         self.useTmpFiles = useTmpFiles
+        self.grepIndex = None
+        self.requiredTrigrams = None
+        if grepIndex and not useTmpFiles and fileStem != "free_text":
+            self.requiredTrigrams = grepIndex.getRequiredTrigrams(self.textTriggers)
+            if self.requiredTrigrams is not None:
+                self.grepIndex = grepIndex
 
     def acceptsTestCase(self, test):
         if self.fileStem == "free_text":
             return self.stringContainsText(test.state.freeText)
         for logFile in self.findAllFiles(test):
-            if self.matches(logFile):
+            if self.mightMatch(logFile) and self.matches(logFile):
                 return True
         return False
 
+    def mightMatch(self, logFile):
+        return self.grepIndex is None or self.grepIndex.mightContain(logFile, self.requiredTrigrams)
+
     def findAllFiles(self, test):
         if self.useTmpFiles:
             files = []
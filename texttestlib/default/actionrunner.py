@@ -319,10 +319,10 @@ class TestRunner:
             action = self.actionSequence.pop(0)
             if abandon and not action.callDuringAbandon(self.test):
                 continue
-            self.diag.info("->Performing action " + str(action) + " on " + repr(self.test))
+            self.diag.info("->Performing action %s on %r", action, self.test)
             if self.handleExceptions(self.appRunner.setUpSuites, action, self.test):
                 self.callAction(action)
-            self.diag.info("<-End Performing action " + str(action))
+            self.diag.info("<-End Performing action %s", action)
             if not abandon and self.test.state.shouldAbandon():
                 self.diag.info("Abandoning test...")
                 abandon = True
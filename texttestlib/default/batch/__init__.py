@@ -9,14 +9,26 @@ import logging
 import re
 import tarfile
 import stat
-from texttestlib.default.batch import testoverview
 from texttestlib import plugins
-from .summarypages import GenerateSummaryPage, GenerateGraphs  # only so they become package level entities
 from collections import OrderedDict
 from .batchutils import getBatchRunName, BatchVersionFilter, parseFileName, convertToUrl
 import subprocess
 from glob import glob
 
+# The web page generation brings in a lot of modules, only import it when used, e.g. by running these as scripts
+summaryPageScripts = ["GenerateSummaryPage", "GenerateGraphs"]
+
+
+def __getattr__(name):
+    if name in summaryPageScripts:
+        from . import summarypages
+        return getattr(summarypages, name)
+    raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + summaryPageScripts)
+
 
 class BatchCategory(plugins.Filter):
     def __init__(self, state):
@@ -603,6 +615,7 @@ class MigrateBatchRepository(plugins.Action):
         self.successFileName = "succeeded_runs"
 
     def migrateFile(self, path):
+        from . import testoverview
         state = testoverview.GenerateWebPages.readState(path)
         if state.hasSucceeded():
             dirname, fn = os.path.split(path)
@@ -915,6 +928,7 @@ class WebPageResponder(plugins.Responder):
         self.suitesToGenerate = []
         self.archiveUnused = "manualarchive" not in optionMap
         self.descriptionInfo = {}
+        from .summarypages import GenerateSummaryPage
         self.summaryGenerator = GenerateSummaryPage()
 
     def notifyAdd(self, test, *args, **kw):
@@ -1137,6 +1151,7 @@ class WebPageResponder(plugins.Responder):
             plugins.printException()
 
     def getWebPageGenerator(self, getConfigValue, *args):
+        from . import testoverview
         return testoverview.GenerateWebPages(getConfigValue, *args)
 
     def generateWebPages(self, subDirs, getConfigValue, *args):
@@ -1,12 +1,12 @@
 
 import os
-import filecmp
 import time
+import hashlib
 import subprocess
 import logging
 import re
 from texttestlib import plugins
-from shutil import copyfile
+from shutil import copyfile, copyfileobj
 
 from fnmatch import fnmatch
 
@@ -24,6 +24,7 @@ class FileComparison:
         self.stem = stem
         self.differenceCache = self.SAME
         self.recalculationTime = None
+        self.fileDigests = {}
         self.diag = logging.getLogger("FileComparison")
         stemForConfig = self.stemForConfig()
         self.severity = test.getCompositeConfigValue("failure_severity", stemForConfig)
@@ -40,8 +41,7 @@ class FileComparison:
         self.freeTextBody = None
         # subclasses may override if they don't want to store in this way
         self.cacheDifferences(test, testInProgress)
-        self.diag.info("Created file comparison std: " + repr(self.stdFile) + " tmp: " +
-                       repr(self.tmpFile) + " diff: " + repr(self.differenceCache))
+        self.diag.info("Created file comparison std: %r tmp: %r diff: %r", self.stdFile, self.tmpFile, self.differenceCache)
 
     def stemForConfig(self):
         return self.stem
@@ -141,6 +141,8 @@ class FileComparison:
         self.__dict__ = state
         self.diag = logging.getLogger("TestComparison")
         self.recalculationTime = None
+        if not hasattr(self, "fileDigests"):  # state from older versions
+            self.fileDigests = {}
 
     def __repr__(self):
         return self.stem
@@ -243,15 +245,35 @@ class FileComparison:
         if os.path.isfile(tmpCmpFileName):
             self.tmpCmpFile = tmpCmpFileName
 
+    def getDigest(self, fileName, size, modTime):
+        # Digests are stored with the state, so unchanged files need not be read again when recomputing or reconnecting
+        cached = self.fileDigests.get(fileName)
+        if cached and cached[0] == size and cached[1] == modTime:
+            return cached[2]
+        self.diag.info("Computing digest for %s", fileName)
+        digest = hashlib.blake2b()
+        with open(fileName, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        value = digest.hexdigest()
+        self.fileDigests[fileName] = size, modTime, value
+        return value
+
+    def filesEqual(self, file1, file2):
+        stat1 = os.stat(file1)
+        stat2 = os.stat(file2)
+        if stat1.st_size != stat2.st_size:
+            return False
+        return self.getDigest(file1, stat1.st_size, stat1.st_mtime_ns) == self.getDigest(file2, stat2.st_size, stat2.st_mtime_ns)
+
     def updateDifferenceCache(self, valueForEqual):
         if self.stdCmpFile and self.tmpCmpFile:
-            if filecmp.cmp(self.stdCmpFile, self.tmpCmpFile, 0):
+            if self.filesEqual(self.stdCmpFile, self.tmpCmpFile):
                 if self.differenceCache != self.APPROVED:
                     self.differenceCache = valueForEqual
             else:
                 self.differenceCache = self.DIFFERENT
-            self.diag.info("Caching differences " + repr(self.stdCmpFile) + " " +
-                           repr(self.tmpCmpFile) + " = " + repr(self.differenceCache))
+            self.diag.info("Caching differences %r %r = %r", self.stdCmpFile, self.tmpCmpFile, self.differenceCache)
 
     def cacheDifferences(self, test, testInProgress):
         self.setCmpFiles(test, testInProgress)
@@ -319,6 +341,8 @@ class FileComparison:
 
     def updateAfterLoad(self, changedPaths):
         for oldPath, newPath in changedPaths:
+            self.fileDigests = dict((fileName.replace(oldPath, newPath), digestInfo)
+                                    for fileName, digestInfo in self.fileDigests.items())
             if self.stdFile:
                 self.stdFile = self.stdFile.replace(oldPath, newPath)
                 self.stdCmpFile = self.stdCmpFile.replace(oldPath, newPath)
@@ -374,7 +398,8 @@ class FileComparison:
         self.backupOrRemove(self.stdFile, backupVersionStrings)
         with open(self.stdFile, "w") as f:
             for splitComp in splitComps:
-                f.write(open(splitComp.stdFile).read())
+                with open(splitComp.stdFile) as splitFile:
+                    copyfileobj(splitFile, f)
         self.stdCmpFile = self.stdFile
         self.updateDifferenceCache(self.APPROVED)
 
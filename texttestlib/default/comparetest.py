@@ -178,10 +178,8 @@ class TestComparison(BaseTestComparison):
 
     def __getstate__(self):
         # don't pickle the diagnostics
-        state = {}
-        for var, value in list(self.__dict__.items()):
-            if var != "diag":
-                state[var] = value
+        state = plugins.TestState.__getstate__(self)
+        state.pop("diag", None)
         return state
 
     def __setstate__(self, state):
@@ -1,6 +1,9 @@
-import sys
+import re
 import difflib
 
+# Runs of characters that _getNumberAt will consider part of a number
+_numberSplitter = re.compile("([0-9.eE+\\-]+)")
+
 
 def _getNumberAt(l, pos):
     start = pos
@@ -30,23 +33,26 @@ def _getNumberAt(l, pos):
     return l[start:end], l[end:]
 
 
-def _fpequalAtPos(l1, l2, tolerance, relTolerance, pos):
-    number1, l1 = _getNumberAt(l1, pos)
-    number2, l2 = _getNumberAt(l2, pos)
+def _numbersEqual(number1, number2, tolerance, relTolerance):
     try:
-        equal = False
         deviation = abs(float(number1) - float(number2))
         if tolerance != None and deviation <= tolerance:
-            equal = True
+            return True
         elif relTolerance != None:
             referenceValue = abs(float(number1))
             if referenceValue == 0:
-                equal = (deviation == 0)
+                return deviation == 0
             elif deviation / referenceValue <= relTolerance:
-                equal = True
+                return True
     except ValueError:
         pass
-    return equal, l1, l2
+    return False
+
+
+def _fpequalAtPos(l1, l2, tolerance, relTolerance, pos):
+    number1, l1 = _getNumberAt(l1, pos)
+    number2, l2 = _getNumberAt(l2, pos)
+    return _numbersEqual(number1, number2, tolerance, relTolerance), l1, l2
 
 
 def _fpequal(l1, l2, tolerance, relTolerance):
@@ -65,6 +71,30 @@ def _fpequal(l1, l2, tolerance, relTolerance):
     return equal and l1 == "" and l2 == ""
 
 
+def _isSimpleNumber(token):
+    # _getNumberAt stops at a second "." or exponent, so only then does a whole token correspond to one number
+    return token.count(".") < 2 and token.count("e") + token.count("E") < 2
+
+
+def _fpequalTokens(l1, l2, tolerance, relTolerance):
+    # Splits into alternating text and number tokens, texts at even indices.
+    # Gives the same answer as _fpequal, which we fall back on whenever the tokens don't line up simply
+    tokens1 = _numberSplitter.split(l1)
+    tokens2 = _numberSplitter.split(l2)
+    if len(tokens1) != len(tokens2):
+        return _fpequal(l1, l2, tolerance, relTolerance)
+    for index, (token1, token2) in enumerate(zip(tokens1, tokens2)):
+        if token1 == token2:
+            continue
+        if index % 2 == 0:
+            return False
+        if not _isSimpleNumber(token1) or not _isSimpleNumber(token2):
+            return _fpequal(l1, l2, tolerance, relTolerance)
+        if not _numbersEqual(token1, token2, tolerance, relTolerance):
+            return False
+    return True
+
+
 def _cmpLines(fromlines, tolines, outlines, tolerance, relTolerance, split):
     for fromline, toline in zip(fromlines, tolines):
         equal = True
@@ -75,12 +105,12 @@ def _cmpLines(fromlines, tolines, outlines, tolerance, relTolerance, split):
                 if len(fromSplit) == len(toSplit):
                     for f, t in zip(fromSplit, toSplit):
                         f, t = f.strip(), t.strip()
-                        if f != t and not _fpequal(f, t, tolerance, relTolerance):
+                        if f != t and not _fpequalTokens(f, t, tolerance, relTolerance):
                             equal = False
                             break
                 else:
                     equal = False
-            elif not _fpequal(fromline, toline, tolerance, relTolerance):
+            elif not _fpequalTokens(fromline, toline, tolerance, relTolerance):
                 equal = False
         if equal:
             outlines.write(fromline)
@@ -92,8 +122,10 @@ def fpfilter(fromlines, tolines, outlines, tolerance, relTolerance=None, useDiff
     if split == 'None':
         split = None
     if not useDifflib:
+        # Works on any iterables, so files can be streamed: zip stops without consuming tolines once fromlines is exhausted
+        tolines = iter(tolines)
         _cmpLines(fromlines, tolines, outlines, tolerance, relTolerance, split)
-        outlines.writelines(tolines[len(fromlines):])
+        outlines.writelines(tolines)
         return
     s = difflib.SequenceMatcher(None, fromlines, tolines)
     for tag, i1, i2, j1, j2 in s.get_opcodes():
@@ -0,0 +1,132 @@
+""" On-disk trigram index of test files, so that -grep need only read files which can contain the text searched for """
+
+import os
+import atexit
+import pickle
+import hashlib
+import logging
+from array import array
+from bisect import bisect_left
+from threading import Lock
+from texttestlib import plugins
+
+
+class TrigramIndex:
+    # One per index file, shared by every filter in the process
+    instances = {}
+    instanceLock = Lock()
+    formatVersion = 3
+    maxFileSize = 1000000
+    saveInterval = 1000
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.entries = None
+        self.unsavedCount = 0
+        self.lock = Lock()
+        self.diag = logging.getLogger("Grep Index")
+
+    @classmethod
+    def getForApp(cls, app):
+        if not app.getConfigValue("use_grep_index") or not plugins.getPersonalConfigDir():
+            return
+        rootDir = os.path.normpath(app.getDirectory())
+        indexName = hashlib.md5(rootDir.encode()).hexdigest() + ".pickle"
+        fileName = os.path.join(plugins.getPersonalDir("cache"), "grep_index", indexName)
+        with cls.instanceLock:
+            index = cls.instances.get(fileName)
+            if index is None:
+                if not cls.instances:
+                    # Whatever the filters found, even if nothing at all, what we read should be kept
+                    atexit.register(cls.saveAll)
+                index = cls.instances[fileName] = cls(fileName)
+            return index
+
+    @classmethod
+    def saveAll(cls):
+        with cls.instanceLock:
+            indices = list(cls.instances.values())
+        for index in indices:
+            index.save()
+
+    @staticmethod
+    def getTrigrams(data):
+        # Each 3 bytes packed into an int: far smaller to keep than tuples of characters
+        return {(a << 16) | (b << 8) | c for a, b, c in zip(data, data[1:], data[2:])}
+
+    @classmethod
+    def getRequiredTrigrams(cls, textTriggers):
+        # Only plain texts tell us anything: for each, the trigrams a file must have to contain it
+        # Only ASCII texts look the same in whatever encoding the files have. None means any file might match
+        required = []
+        for trigger in textTriggers:
+            if trigger.regex is not None or len(trigger.text) < 3 or not trigger.text.isascii():
+                return
+            required.append(cls.getTrigrams(trigger.text.encode("ascii")))
+        return required
+
+    def readEntries(self):
+        if os.path.isfile(self.fileName):
+            try:
+                with open(self.fileName, "rb") as f:
+                    version, entries = pickle.load(f)
+                if version == self.formatVersion:
+                    return entries
+            except (OSError, EOFError, ValueError, pickle.UnpicklingError) as e:
+                self.diag.info("Could not read grep index at " + self.fileName + " : " + str(e))
+        return {}
+
+    def save(self):
+        with self.lock:
+            if self.unsavedCount == 0:
+                return
+            try:
+                plugins.ensureDirExistsForFile(self.fileName)
+                tmpFile = self.fileName + "." + str(os.getpid())
+                with open(tmpFile, "wb") as f:
+                    pickle.dump((self.formatVersion, self.entries), f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmpFile, self.fileName)
+                self.diag.info("Saved grep index with " + str(len(self.entries)) + " files to " + self.fileName)
+                self.unsavedCount = 0
+            except OSError as e:
+                self.diag.info("Could not write grep index at " + self.fileName + " : " + str(e))
+
+    def getFileTrigrams(self, fileName):
+        try:
+            stat = os.stat(fileName)
+        except OSError:
+            return
+        with self.lock:
+            if self.entries is None:
+                self.entries = self.readEntries()
+            entry = self.entries.get(fileName)
+            if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+                return entry[2]
+        trigrams = None
+        if stat.st_size <= self.maxFileSize:
+            try:
+                with open(fileName, "rb") as f:
+                    trigrams = array("I", sorted(self.getTrigrams(f.read())))
+            except OSError:
+                return
+        with self.lock:
+            self.entries[fileName] = stat.st_mtime_ns, stat.st_size, trigrams
+            self.unsavedCount += 1
+            saveNow = self.unsavedCount >= self.saveInterval
+        if saveNow:
+            self.save()
+        return trigrams
+
+    @staticmethod
+    def containsAll(trigrams, required):
+        for trigram in required:
+            index = bisect_left(trigrams, trigram)
+            if index == len(trigrams) or trigrams[index] != trigram:
+                return False
+        return True
+
+    def mightContain(self, fileName, requiredTrigrams):
+        trigrams = self.getFileTrigrams(fileName)
+        if trigrams is None:
+            return True
+        return any((self.containsAll(trigrams, required) for required in requiredTrigrams))
@@ -5,6 +5,9 @@ import sys
 import logging
 import glob
 import re
+import json
+import time
+from threading import Lock, Event
 from texttestlib import plugins
 from configparser import ConfigParser, NoOptionError
 from copy import copy
@@ -66,7 +69,8 @@ class BugSystemBug(Bug):
         location = test.getCompositeConfigValue("bug_system_location", self.bugSystem)
         username = test.getCompositeConfigValue("bug_system_username", self.bugSystem)
         password = test.getCompositeConfigValue("bug_system_password", self.bugSystem)
-        status, bugText, isResolved, bugId = self.findBugInfo(self.bugId, location, username, password)
+        timeout = test.getConfigValue("bug_system_cache_timeout")
+        status, bugText, isResolved, bugId = bugInfoCache.getBugInfo(self, location, username, password, timeout)
         self.bugId = bugId
         category = self.findCategory(isResolved)
         briefText = "bug " + self.bugId + " (" + status + ")"
@@ -80,6 +84,93 @@ class BugSystemBug(Bug):
         except ImportError:
             return "unknown", "Bug " + bugId + " in unknown bug system '" + self.bugSystem + "'", False, bugId
 
+
+class BugInfoCache:
+    """ Shared by all tests, so that a bug found by many tests is only looked up once per timeout,
+    even if they ask at the same time. Also stored on disk so later runs can make use of it """
+    # What the bug system modules report when they couldn't find out about the bug: worth asking again next time
+    failureStatuses = {"BAD SCRIPT", "NONEXISTENT", "PARSE ERROR", "PAT not set"}
+
+    def __init__(self):
+        self.entries = None
+        self.lookupsInProgress = {}
+        self.lock = Lock()
+        self.writeLock = Lock()
+        self.diag = logging.getLogger("Check For Bugs")
+
+    def getCacheFile(self):
+        if plugins.getPersonalConfigDir():
+            return os.path.join(plugins.getPersonalDir("cache"), "bug_system_info.json")
+
+    def readEntries(self, cacheFile):
+        if cacheFile and os.path.isfile(cacheFile):
+            try:
+                with open(cacheFile) as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                self.diag.info("Could not read bug cache at " + cacheFile + " : " + str(e))
+        return {}
+
+    def writeEntry(self, key, entry):
+        cacheFile = self.getCacheFile()
+        if not cacheFile:
+            return
+        # Only one thread writes at a time, but lookups from the cache in memory carry on meanwhile
+        with self.writeLock:
+            # Other processes may have written since we read it
+            entries = self.readEntries(cacheFile)
+            entries[key] = entry
+            try:
+                plugins.ensureDirExistsForFile(cacheFile)
+                tmpFile = cacheFile + "." + str(os.getpid())
+                with open(tmpFile, "w") as f:
+                    json.dump(entries, f)
+                os.replace(tmpFile, cacheFile)
+            except OSError as e:
+                self.diag.info("Could not write bug cache at " + cacheFile + " : " + str(e))
+
+    def isSuccessfulLookup(self, info):
+        status = info[0]
+        return status not in self.failureStatuses and not status.endswith(" ERROR")
+
+    def getBugInfo(self, bug, location, username, password, timeout):
+        if timeout <= 0:
+            return bug.findBugInfo(bug.bugId, location, username, password)
+        key = "|".join([bug.bugSystem, str(location), str(username or ""), bug.bugId])
+        while True:
+            with self.lock:
+                if self.entries is None:
+                    self.entries = self.readEntries(self.getCacheFile())
+                entry = self.entries.get(key)
+                if entry and time.time() - entry[0] < timeout:
+                    self.diag.info("Using cached information for bug " + bug.bugId)
+                    return tuple(entry[1])
+                lookupFinished = self.lookupsInProgress.get(key)
+                if lookupFinished is None:
+                    lookupFinished = self.lookupsInProgress[key] = Event()
+                    break
+            # Someone else is already asking the bug system, wait for them and then check the cache again
+            lookupFinished.wait()
+
+        try:
+            info = bug.findBugInfo(bug.bugId, location, username, password)
+            if self.isSuccessfulLookup(info):
+                entry = time.time(), list(info)
+                with self.lock:
+                    self.entries[key] = entry
+                self.writeEntry(key, entry)
+            else:
+                self.diag.info("Not caching failed lookup of bug " + bug.bugId + " : " + info[0])
+            return info
+        finally:
+            with self.lock:
+                del self.lookupsInProgress[key]
+            lookupFinished.set()
+
+
+bugInfoCache = BugInfoCache()
+
+
 class UnreportedBug(Bug):
     def __init__(self, fullText, briefText, internalError, priorityStr, *args):
         self.fullText = fullText
@@ -215,6 +306,7 @@ class FileBugData:
         self.absentList = []
         self.identicalList = []
         self.checkUnchanged = False
+        self.lineScreener = None
         self.diag = logging.getLogger("Check For Bugs")
 
     def addBugTrigger(self, getOption):
@@ -227,6 +319,7 @@ class FileBugData:
             self.identicalList.append(bugTrigger)
         else:
             self.presentList.append(bugTrigger)
+        self.lineScreener = None
 
     def findBugs(self, fileName, execHosts, isChanged, multipleDiffs):
         if not self.checkUnchanged and not isChanged:
@@ -241,7 +334,15 @@ class FileBugData:
 
         self.diag.info("Looking for bugs in " + fileName)
         dirname = os.path.dirname(fileName)
-        return self.findBugsInText(open(fileName).readlines(), execHosts=execHosts, isChanged=isChanged, multipleDiffs=multipleDiffs, tmpDir=dirname)
+        with open(fileName) as f:
+            # Only need all the lines at once for checking identical files
+            lines = f.readlines() if self.identicalList else f
+            return self.findBugsInText(lines, execHosts=execHosts, isChanged=isChanged, multipleDiffs=multipleDiffs, tmpDir=dirname)
+
+    def getLineScreener(self):
+        if self.lineScreener is None:
+            self.lineScreener = LineScreener(self.presentList + self.absentList)
+        return self.lineScreener
 
     def findBugsInText(self, lines, **kw):
         currAbsent = copy(self.absentList)
@@ -249,18 +350,27 @@ class FileBugData:
         for bugTrigger in self.identicalList:
             if bugTrigger not in bugs and bugTrigger.exactMatch(lines, **kw):
                 bugs.append(bugTrigger)
+        lineScreener = self.getLineScreener()
+        diagEnabled = self.diag.isEnabledFor(logging.INFO)
         for line in lines:
-            self.diag.info("Checking " + repr(line))
+            if not lineScreener.mightMatch(line):
+                continue
+            if diagEnabled:
+                self.diag.info("Checking " + repr(line))
             for bugTrigger in self.presentList:
-                self.diag.info("Checking for existence of " + repr(bugTrigger))
+                if diagEnabled:
+                    self.diag.info("Checking for existence of " + repr(bugTrigger))
                 if bugTrigger not in bugs and bugTrigger.hasBug(line, **kw):
-                    self.diag.info("FOUND!")
+                    if diagEnabled:
+                        self.diag.info("FOUND!")
                     bugs.append(bugTrigger)
             toRemove = []
             for bugTrigger in currAbsent:
-                self.diag.info("Checking for absence of " + repr(bugTrigger))
+                if diagEnabled:
+                    self.diag.info("Checking for absence of " + repr(bugTrigger))
                 if bugTrigger.matchesText(line):
-                    self.diag.info("PRESENT!")
+                    if diagEnabled:
+                        self.diag.info("PRESENT!")
                     toRemove.append(bugTrigger)
             for bugTrigger in toRemove:
                 currAbsent.remove(bugTrigger)
@@ -275,6 +385,19 @@ class FileBugData:
         return bugs
 
 
+class LineScreener:
+    """ Combines the text of every line of the given triggers into one regular expression.
+    A line it doesn't match cannot affect any of the triggers, so need not be checked against each one """
+    def __init__(self, bugTriggers):
+        textTriggers = [trigger for bugTrigger in bugTriggers for trigger in bugTrigger.textTrigger.triggers]
+        self.combined, self.uncombined = plugins.combineTextTriggers(textTriggers)
+
+    def mightMatch(self, line):
+        if self.combined is not None and self.combined.search(line):
+            return True
+        return any((trigger.matches(line) for trigger in self.uncombined))
+
+
 class ParseMethod:
     def __init__(self, parser, section):
         self.parser = parser
@@ -294,11 +417,28 @@ class BugMap(OrderedDict):
                 return True
         return False
 
+    parserCache = {}
+
     def readFromFile(self, fileName):
-        parser = self.makeParser(fileName)
+        parser = self.getCachedParser(fileName)
         if parser:
             self.readFromParser(parser)
 
+    @classmethod
+    def getCachedParser(cls, fileName):
+        # Only for reading: the same parser is handed out for every test using the file
+        try:
+            stat = os.stat(fileName)
+        except OSError:
+            return cls.makeParser(fileName)
+        fileKey = stat.st_mtime_ns, stat.st_size
+        cached = cls.parserCache.get(fileName)
+        if cached and cached[0] == fileKey:
+            return cached[1]
+        parser = cls.makeParser(fileName)
+        cls.parserCache[fileName] = fileKey, parser
+        return parser
+
     def readFromFileObject(self, f):
         parser = self.makeParserFromFileObject(f)
         if parser:
@@ -0,0 +1,97 @@
+""" Shared ssh connections to remote machines, so that remote commands and copies need not each connect afresh.
+Uses ssh's own connection multiplexing: one background master per machine, which the others talk to via a socket """
+
+import os
+import atexit
+import shutil
+import logging
+import tempfile
+import subprocess
+from threading import Lock
+
+
+class SharedConnection:
+    # One per remote machine
+    instances = {}
+    instanceLock = Lock()
+    socketDir = None
+    # The master exits by itself when unused for this long, and is restarted when next needed
+    persistSeconds = 60
+
+    def __init__(self, app, machine, socketPath):
+        self.app = app
+        self.machine = machine
+        self.socketPath = socketPath
+        self.failed = False
+        self.sshArgs = None
+        self.lock = Lock()
+        self.diag = logging.getLogger("Shared Connections")
+
+    @classmethod
+    def getForMachine(cls, app, machine):
+        if machine == "localhost" or not app.getConfigValue("remote_connection_sharing"):
+            return
+        with cls.instanceLock:
+            connection = cls.instances.get(machine)
+            if connection is None:
+                if cls.socketDir is None:
+                    # Unix socket paths must be short, so this can't live in the write directory
+                    cls.socketDir = tempfile.mkdtemp(prefix="texttest_ssh")
+                    atexit.register(cls.closeAll)
+                socketPath = os.path.join(cls.socketDir, machine.replace(os.sep, "_"))
+                connection = cls.instances[machine] = cls(app, machine, socketPath)
+            return connection
+
+    @classmethod
+    def closeAll(cls):
+        # The masters would otherwise linger until they time out, after we have removed their sockets
+        for connection in list(cls.instances.values()):
+            connection.close()
+        shutil.rmtree(cls.socketDir, True)
+
+    def close(self):
+        with self.lock:
+            if self.sshArgs and os.path.exists(self.socketPath):
+                self.diag.info("Stopping shared connection to " + self.machine)
+                devnull = subprocess.DEVNULL
+                subprocess.call(self.sshArgs + self.getOptions() + ["-O", "exit", self.machine],
+                                stdin=devnull, stdout=devnull, stderr=devnull)
+
+    @staticmethod
+    def isSsh(progArgs):
+        return os.path.basename(progArgs[0]) == "ssh"
+
+    def getOptions(self):
+        return ["-o", "ControlPath=" + self.socketPath]
+
+    def getStartArgs(self, sshArgs):
+        return sshArgs + self.getOptions() + ["-o", "ControlMaster=yes", "-o", "ControlPersist=" + str(self.persistSeconds),
+                                              "-N", "-f", self.machine]
+
+    def ensureStarted(self, sshArgs):
+        # ssh falls back to a connection of its own if the socket isn't there, so failing here does no harm
+        with self.lock:
+            if self.failed or os.path.exists(self.socketPath):
+                return
+            startArgs = self.getStartArgs(sshArgs)
+            self.diag.info("Starting shared connection to " + self.machine + " : " + repr(startArgs))
+            # -f returns once connected: the master must not keep our pipes, or anyone waiting on them will hang
+            devnull = subprocess.DEVNULL
+            exitCode = subprocess.call(startArgs, stdin=devnull, stdout=devnull, stderr=devnull)
+            if exitCode == 0:
+                self.sshArgs = sshArgs
+            else:
+                self.diag.info("Could not start shared connection to " + self.machine + ", exit code " + str(exitCode))
+                self.failed = True
+
+    def addOptions(self, progArgs, sshArgs):
+        # Works for ssh and scp, which pass -o on to ssh, and for rsync running ssh with -e
+        self.ensureStarted(sshArgs)
+        options = self.getOptions()
+        if self.isSsh(progArgs) or os.path.basename(progArgs[0]) == "scp":
+            return progArgs[:1] + options + progArgs[1:]
+        elif "-e" in progArgs:
+            index = progArgs.index("-e") + 1
+            if index < len(progArgs) and self.isSsh(progArgs[index].split()):
+                return progArgs[:index] + [progArgs[index] + " " + " ".join(options)] + progArgs[index + 1:]
+        return progArgs
@@ -0,0 +1,159 @@
+""" Copies test data and SUT files to remote machines via a content-addressed cache there, so that each file
+is only transferred once however many tests use it. The remote end is handled by libexec/datacache.py """
+
+import os
+import stat
+import shutil
+import hashlib
+import logging
+import tempfile
+import subprocess
+from threading import Lock
+from locale import getpreferredencoding
+from texttestlib import plugins
+
+
+class RemoteDataCache:
+    # One per remote machine
+    instances = {}
+    instanceLock = Lock()
+    scriptName = "datacache.py"
+    cacheDir = "${HOME}/.texttest/cache/data"
+    maxAttempts = 3
+    # SHA-1 of each file's contents, by path, size and modification time
+    digests = {}
+
+    def __init__(self, app, machine, maxBytes):
+        self.app = app
+        self.machine = machine
+        self.maxBytes = maxBytes
+        self.remoteScript = None
+        self.scriptLock = Lock()
+        self.diag = logging.getLogger("Remote Data Cache")
+
+    @classmethod
+    def getForMachine(cls, app, machine):
+        maxMegabytes = app.getConfigValue("remote_data_cache_size")
+        if not maxMegabytes:
+            return
+        with cls.instanceLock:
+            cache = cls.instances.get(machine)
+            if cache is None:
+                cache = cls.instances[machine] = cls(app, machine, int(maxMegabytes * 1024 * 1024))
+            return cache
+
+    def isLocal(self):
+        # Commands here are run without a shell, so nothing must be quoted, and nothing need be copied
+        return self.machine == "localhost"
+
+    def getRemoteScript(self):
+        # Copy it once for each run, into the run's own temporary directory
+        with self.scriptLock:
+            if self.remoteScript is None:
+                localPath = os.path.join(plugins.installationDir("libexec"), self.scriptName)
+                if self.isLocal():
+                    self.remoteScript = localPath
+                    return self.remoteScript
+                remoteDir = self.app.getRemoteTmpDirectory()[1]
+                self.app.ensureRemoteDirExists(self.machine, remoteDir)
+                remotePath = os.path.join(remoteDir, self.scriptName)
+                if self.app.copyFileRemotely(localPath, "localhost", remotePath, self.machine) == 0:
+                    self.remoteScript = remotePath
+            return self.remoteScript
+
+    @classmethod
+    def getBlobName(cls, path):
+        # Many tests share the same data, so don't read it again unless it might have changed
+        statInfo = os.stat(path)
+        key = path, statInfo.st_size, statInfo.st_mtime_ns
+        digest = cls.digests.get(key)
+        if digest is None:
+            sha = hashlib.sha1()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    sha.update(block)
+            digest = cls.digests[key] = sha.hexdigest()
+        return digest + ("x" if statInfo.st_mode & stat.S_IXUSR else "")
+
+    def makeManifest(self, sourcePath):
+        # Follow links, like the remote copy programs do by default
+        lines, blobPaths = [], {}
+        if os.path.isfile(sourcePath):
+            blob = self.getBlobName(sourcePath)
+            blobPaths[blob] = sourcePath
+            lines.append("\t".join(["F", blob, str(os.path.getsize(sourcePath)), "."]))
+            return lines, blobPaths
+
+        for root, dirs, files in os.walk(sourcePath, followlinks=True):
+            relRoot = os.path.relpath(root, sourcePath)
+            lines.append("D\t" + relRoot)
+            for fileName in sorted(files):
+                path = os.path.join(root, fileName)
+                if os.path.isfile(path):
+                    blob = self.getBlobName(path)
+                    blobPaths[blob] = path
+                    lines.append("\t".join(["F", blob, str(os.path.getsize(path)), os.path.join(relRoot, fileName)]))
+        return lines, blobPaths
+
+    def runSync(self, remoteScript, manifest, targetPath, link, incomingDir):
+        args = ["python3", remoteScript, self.cacheDir, targetPath, str(self.maxBytes), "1" if link else "0"]
+        if incomingDir:
+            args.append(incomingDir)
+        cmdArgs = self.app.getCommandArgsOn(self.machine, args if self.isLocal() else list(map(plugins.quote, args)))
+        self.diag.info("Syncing " + targetPath + " on " + self.machine + " : " + repr(cmdArgs))
+        proc = subprocess.Popen(cmdArgs, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                encoding=getpreferredencoding())
+        output, errors = proc.communicate("".join((line + "\n" for line in manifest)))
+        if proc.returncode:
+            self.diag.info("Remote data cache failed on " + self.machine + " :\n" + errors)
+            return
+        return output.split()
+
+    def stageBlobs(self, blobs, blobPaths, stagingDir, link):
+        for blob in blobs:
+            stagedPath = os.path.join(stagingDir, blob)
+            if link:
+                try:
+                    os.link(blobPaths[blob], stagedPath)
+                    continue
+                except OSError:
+                    pass  # e.g. a different file system
+            shutil.copyfile(blobPaths[blob], stagedPath)
+
+    def sendBlobs(self, blobs, blobPaths):
+        incomingDir = os.path.join(self.cacheDir, "incoming")
+        if self.isLocal():
+            # Put them straight where the cache will look. Not linked: the cache makes its blobs read-only
+            localIncomingDir = os.path.expandvars(incomingDir)
+            os.makedirs(localIncomingDir, exist_ok=True)
+            stagingDir = tempfile.mkdtemp(prefix="texttest_blobs", dir=localIncomingDir)
+            self.stageBlobs(blobs, blobPaths, stagingDir, link=False)
+            return stagingDir
+
+        stagingDir = tempfile.mkdtemp(prefix="texttest_blobs")
+        try:
+            self.stageBlobs(blobs, blobPaths, stagingDir, link=True)
+            self.diag.info("Copying " + str(len(blobs)) + " blobs to " + self.machine)
+            if self.app.copyFileRemotely(stagingDir, "localhost", incomingDir, self.machine) == 0:
+                return os.path.join(incomingDir, os.path.basename(stagingDir))
+        finally:
+            shutil.rmtree(stagingDir, ignore_errors=True)
+
+    def copyPath(self, sourcePath, remoteDir, link=False):
+        # Returns False if the caller should copy it the normal way instead
+        remoteScript = self.getRemoteScript()
+        if not remoteScript:
+            return False
+        manifest, blobPaths = self.makeManifest(sourcePath)
+        targetPath = os.path.join(remoteDir, os.path.basename(sourcePath))
+        incomingDir = None
+        for _ in range(self.maxAttempts):
+            missing = self.runSync(remoteScript, manifest, targetPath, link, incomingDir)
+            if missing is None:
+                return False
+            elif not missing:
+                return True
+            incomingDir = self.sendBlobs(missing, blobPaths)
+            if not incomingDir:
+                return False
+        return False
@@ -2,8 +2,13 @@
 
 
 import os
+import sys
+import heapq
+import itertools
+import pickle
 import logging
 import shutil
+import tempfile
 from texttestlib.default import fpdiff
 from texttestlib import plugins
 from optparse import OptionParser
@@ -27,7 +32,7 @@ class FilterAction(plugins.Action):
             self.changeToFilteringState(test)
 
         for fileName, postfix in self.filesToFilter(test):
-            self.diag.info("Considering for filtering : " + fileName)
+            self.diag.info("Considering for filtering : %s", fileName)
             stem = self.getStem(fileName)
             newFileName = test.makeTmpFileName(stem + "." + test.app.name + postfix, forFramework=1)
             self.performAllFilterings(test, stem, fileName, newFileName)
@@ -92,10 +97,13 @@ class FilterAction(plugins.Action):
         if test.app is not app:  # happens when testing filtering in the static GUI
             configObj = app
 
-        for filterClass in [RunDependentTextFilter, UnorderedTextFilter]:
-            texts = configObj.getCompositeConfigValue(filterClass.configKey, stem)
-            if texts:
-                filters.append(filterClass(texts, test.getRelPath()))
+        texts = configObj.getCompositeConfigValue(RunDependentTextFilter.configKey, stem)
+        if texts:
+            filters.append(RunDependentTextFilter(texts, test.getRelPath()))
+        texts = configObj.getCompositeConfigValue(UnorderedTextFilter.configKey, stem)
+        if texts:
+            memoryLimit = configObj.getConfigValue("unordered_text_memory_limit")
+            filters.append(UnorderedTextFilter(texts, test.getRelPath(), memoryLimit))
 
         return filters
 
@@ -188,9 +196,8 @@ class FloatingPointFilter:
         self.split = split
 
     def filterFile(self, inFile, writeFile):
-        fromlines = open(self.origFileName, errors="ignore").readlines()
-        tolines = inFile.readlines()
-        fpdiff.fpfilter(fromlines, tolines, writeFile, self.tolerance, self.relative, split=self.split)
+        with open(self.origFileName, errors="ignore") as fromFile:
+            fpdiff.fpfilter(fromFile, inFile, writeFile, self.tolerance, self.relative, split=self.split)
 
 
 class RunDependentTextFilter(plugins.Observable):
@@ -266,7 +273,7 @@ class RunDependentTextFilter(plugins.Observable):
                 newFile.write(filteredLine)
             else:
                 if filteredAway is not None and lineFilter is not None:
-                    filteredAway.setdefault(lineFilter, []).append(line)
+                    filteredAway.add(lineFilter, line)
             seekPoints.append(newFile.tell())
 
     def getFilteredLine(self, line, lineNumber, lineFilters):
@@ -299,23 +306,100 @@ class UnorderedTextFilter(RunDependentTextFilter):
     configKey = "unordered_text"
     postfix = "sorted"
 
+    def __init__(self, filterTexts, testId="", memoryLimit=-1):
+        RunDependentTextFilter.__init__(self, filterTexts, testId)
+        self.memoryLimit = memoryLimit
+
     def filterFile(self, file, newFile):
-        unorderedLines = {}
-        RunDependentTextFilter.filterFile(self, file, newFile, unorderedLines)
-        self.writeUnorderedText(newFile, unorderedLines)
+        unorderedLines = UnorderedLineStore(self.memoryLimit)
+        try:
+            RunDependentTextFilter.filterFile(self, file, newFile, unorderedLines)
+            self.writeUnorderedText(newFile, unorderedLines)
+            self.diag.info("Sorted unordered text with peak of " + str(unorderedLines.peakSize) +
+                           " bytes in memory, using " + str(unorderedLines.runCount) + " sorted runs on disk")
+        finally:
+            unorderedLines.close()
 
     def writeUnorderedText(self, newFile, lines):
         for filter in self.lineFilters:
-            unordered = lines.get(filter, [])
-            if len(unordered) == 0:
+            if not lines.hasLines(filter):
                 continue
-            unordered.sort()
             newFile.write("-- Unordered text as found by filter '" + filter.originalText + "' --" + "\n")
-            for line in unordered:
+            for line in lines.getSortedLines(filter):
                 newFile.write(line)
             newFile.write("\n")
 
 
+class UnorderedLineStore:
+    """ Collects lines per filter for sorting. Once they take up more than memoryLimit bytes,
+    each filter's lines are sorted and spilled to a temporary file, and the runs merged when read back """
+    chunkSize = 1000
+    maxRuns = 32
+
+    def __init__(self, memoryLimit):
+        self.memoryLimit = memoryLimit
+        self.lines = {}
+        self.runFiles = {}
+        self.size = 0
+        self.peakSize = 0
+        self.runCount = 0
+
+    def add(self, lineFilter, line):
+        self.lines.setdefault(lineFilter, []).append(line)
+        self.size += sys.getsizeof(line)
+        self.peakSize = max(self.peakSize, self.size)
+        if self.memoryLimit >= 0 and self.size > self.memoryLimit:
+            self.spill()
+
+    def spill(self):
+        for lineFilter, lines in self.lines.items():
+            if lines:
+                runFiles = self.runFiles.setdefault(lineFilter, [])
+                runFiles.append(self.writeRun(sorted(lines)))
+                self.runCount += 1
+                if len(runFiles) >= self.maxRuns:
+                    # Don't keep arbitrarily many files open: merge them into one bigger run
+                    self.runFiles[lineFilter] = [self.writeRun(heapq.merge(*list(map(self.readRun, runFiles))))]
+                    for runFile in runFiles:
+                        runFile.close()
+        self.lines = {}
+        self.size = 0
+
+    def writeRun(self, lines):
+        runFile = tempfile.TemporaryFile(prefix="texttest_unordered")
+        lines = iter(lines)
+        chunk = list(itertools.islice(lines, self.chunkSize))
+        while chunk:
+            pickle.dump(chunk, runFile, pickle.HIGHEST_PROTOCOL)
+            chunk = list(itertools.islice(lines, self.chunkSize))
+        runFile.seek(0)
+        return runFile
+
+    def readRun(self, runFile):
+        while True:
+            try:
+                yield from pickle.load(runFile)
+            except EOFError:
+                return
+
+    def hasLines(self, lineFilter):
+        return len(self.lines.get(lineFilter, [])) > 0 or lineFilter in self.runFiles
+
+    def getSortedLines(self, lineFilter):
+        lines = sorted(self.lines.get(lineFilter, []))
+        runFiles = self.runFiles.get(lineFilter)
+        if runFiles:
+            return heapq.merge(lines, *list(map(self.readRun, runFiles)))
+        else:
+            return lines
+
+    def close(self):
+        for runFiles in self.runFiles.values():
+            for runFile in runFiles:
+                runFile.close()
+        self.runFiles = {}
+
+
 class LineNumberTrigger:
     def __init__(self, lineNumber):
         self.lineNumber = lineNumber
@@ -471,7 +555,7 @@ class LineFilter:
             return False, None, 0
 
         if self.trigger.matches(line, lineNumber):
-            self.diag.info(repr(self.trigger) + " matched " + line.rstrip())
+            self.diag.info("%r matched %s", self.trigger, line.rstrip())
             return self.applyMatchingTrigger(line)
         else:
             return False, line, 0
@@ -479,7 +563,7 @@ class LineFilter:
     def applyAutoRemove(self, line):
         if self.untrigger:
             if self.untrigger.matches(line.rstrip()):
-                self.diag.info(repr(self.untrigger) + " (end) matched " + line.rstrip())
+                self.diag.info("%r (end) matched %s", self.untrigger, line.rstrip())
                 self.autoRemove = 0
                 if self.divider.endswith("]}"):
                     return True, None, 0
@@ -502,9 +586,9 @@ class LineFilter:
             stripped = line.rstrip()
             postfix = line.replace(stripped, "", 1)
             words = stripped.split(" ")
-            self.diag.info("Removing word " + str(self.wordNumber) + " from " + repr(words))
+            self.diag.info("Removing word %s from %r", self.wordNumber, words)
             realNumber = self.findRealWordNumber(words)
-            self.diag.info("Real number was " + str(realNumber))
+            self.diag.info("Real number was %s", realNumber)
             if realNumber < len(words):
                 if self.removeWordsAfter:
                     words = words[:realNumber]
@@ -11,7 +11,9 @@ import sys
 from texttestlib import plugins
 from texttestlib.jobprocess import killProcessAndChildren
 from .runtest import Killed
+from .remotedatacache import RemoteDataCache
 from collections import OrderedDict
+from fnmatch import fnmatch
 from string import Template
 
 
@@ -48,18 +50,21 @@ class PrepareWriteDirectory(plugins.Action):
         machine, remoteTmpDir = test.app.getRemoteTestTmpDir(test)
         if remoteTmpDir:
             test.app.ensureRemoteDirExists(machine, remoteTmpDir)
-            remoteCopy = plugins.Callable(self.copyDataRemotely, test, machine, remoteTmpDir)
+            pathsToCopy = []
+            remoteCopy = plugins.Callable(self.copyDataRemotely, test, machine, remoteTmpDir, pathsToCopy)
         else:
             remoteCopy = None
 
         self.collateAllPaths(test, remoteCopy)
+        if remoteCopy:
+            test.app.copyFilesRemotely(pathsToCopy, remoteTmpDir, machine)
         test.createPropertiesFiles()
 
     def collateAllPaths(self, test, remoteCopy):
         self.collatePaths(test, "copy_test_path", self.copyTestPath, remoteCopy)
         self.collatePaths(test, "copy_test_path_merge", self.copyTestPath, remoteCopy, mergeData=True)
         self.collatePaths(test, "partial_copy_test_path", self.partialCopyTestPath, remoteCopy)
-        self.collatePaths(test, "link_test_path", self.linkTestPath, remoteCopy)
+        self.collatePaths(test, "link_test_path", self.linkTestPath, remoteCopy, readOnly=True)
 
     def collatePaths(self, test, configListName, *args, **kwargs):
         for configName in test.getConfigValue(configListName, expandVars=False):
@@ -78,7 +83,7 @@ class PrepareWriteDirectory(plugins.Action):
             test.notify("RequiredTestData", sourcePaths)
             self.handledRequiredPaths.update(sourcePaths)
 
-    def collatePath(self, test, configName, collateMethod, remoteCopy, mergeData=False):
+    def collatePath(self, test, configName, collateMethod, remoteCopy, mergeData=False, readOnly=False):
         targetPath = self.getTargetPath(test, configName)
         sourceFileName = self.getSourceFileName(configName, test)
         if not targetPath or not sourceFileName:  # Can happen with e.g. empty environment
@@ -101,7 +106,7 @@ class PrepareWriteDirectory(plugins.Action):
             self.handleNoTestData(test, configName, sourcePaths)
 
         if remoteCopy and targetPath:
-            remoteCopy(targetPath)
+            remoteCopy(targetPath, readOnly=readOnly)
 
         envVarToSet = self.findDataEnvironment(test, configName)
         if envVarToSet and targetPath:
@@ -120,7 +125,7 @@ class PrepareWriteDirectory(plugins.Action):
             # Don't merge, just use the most specific data
             return sourcePaths[-1:]
 
-    def copyDataRemotely(self, sourcePath, test, machine, remoteTmpDir):
+    def copyDataRemotely(self, sourcePath, test, machine, remoteTmpDir, pathsToCopy, readOnly=False):
         if os.path.exists(sourcePath):
             copyScript = test.getCompositeConfigValue(
                 "copy_test_path_script", os.path.basename(sourcePath), expandVars=False)
@@ -131,7 +136,10 @@ class PrepareWriteDirectory(plugins.Action):
                                                        os.path.join(remoteTmpDir, os.path.basename(sourcePath))]
                 test.app.runCommandOn(machine, cmdArgs)
             else:
-                test.app.copyFileRemotely(sourcePath, "localhost", remoteTmpDir, machine)
+                # Data the test may change must not be linked to the cache
+                dataCache = RemoteDataCache.getForMachine(test.app, machine)
+                if not dataCache or not dataCache.copyPath(sourcePath, remoteTmpDir, link=readOnly):
+                    pathsToCopy.append(sourcePath)
 
     def getEnvironmentSourcePath(self, configName, test):
         pathName = self.getPathFromEnvironment(configName, test)
@@ -363,7 +371,9 @@ class PrepareWriteDirectory(plugins.Action):
             # If not absolute, assume it's an installed program
             # If it doesn't exist locally, it must already exist remotely or we'd have raised an error by now
             remotePath = os.path.join(fullTmpDir, os.path.basename(path))
-            app.copyFileRemotely(path, "localhost", remotePath, machine)
+            dataCache = RemoteDataCache.getForMachine(app, machine)
+            if not dataCache or not dataCache.copyPath(path, fullTmpDir, link=True):
+                app.copyFileRemotely(path, "localhost", remotePath, machine)
             self.diag.info("Copied " + path + " to " + remotePath)
             return remotePath
 
@@ -625,7 +635,8 @@ class TestEnvironmentCreator:
 class CollateFiles(plugins.Action):
     def __init__(self):
         self.filesPresentBefore = {}
-        self.collationProc = None
+        self.collationProcs = []
+        self.globCache = {}
         self.diag = logging.getLogger("Collate Files")
 
     def expandCollations(self, test):
@@ -690,6 +701,8 @@ class CollateFiles(plugins.Action):
         return matches
 
     def __call__(self, test):
+        # Directory contents will have changed since last time
+        self.globCache = {}
         if test not in self.filesPresentBefore:
             self.filesPresentBefore[test] = self.getFilesPresent(test)
         else:
@@ -738,13 +751,38 @@ class CollateFiles(plugins.Action):
         return editedFiles
 
     def collate(self, test):
+        maxProcesses = max(test.getConfigValue("collate_script_max_processes"), 1)
+        runningJobs = []
         for targetStem, sourcePatterns in self.expandCollations(test):
+            self.finishJobsWritingSources(test, sourcePatterns, runningJobs)
             sourceFiles = self.findEditedFiles(test, sourcePatterns)
             if sourceFiles:
                 targetFile = test.makeTmpFileName(targetStem)
                 collationErrFile = test.makeTmpFileName(targetStem + ".collate_errs", forFramework=1)
                 self.diag.info("Extracting " + ",".join(sourceFiles) + " to " + targetFile)
-                self.extract(test, sourceFiles, targetFile, collationErrFile)
+                job = self.extract(test, sourceFiles, targetFile, collationErrFile)
+                if job:
+                    runningJobs.append(job)
+                    if len(runningJobs) >= maxProcesses:
+                        self.finishExtract(test, *runningJobs.pop(0))
+        for job in runningJobs:
+            self.finishExtract(test, *job)
+
+    def finishJobsWritingSources(self, test, sourcePatterns, runningJobs):
+        # A collation may read what another one writes, so that one must finish first and we must look again
+        testDir = test.getDirectory(temporary=1)
+        for job in list(runningJobs):
+            targetFile = job[4]
+            relativeTarget = plugins.relpath(targetFile, testDir) or os.path.basename(targetFile)
+            if any((self.patternMatchesTarget(pattern, targetFile, relativeTarget) for pattern in sourcePatterns)):
+                self.diag.info("Waiting for collation to " + targetFile + " before reading it")
+                runningJobs.remove(job)
+                self.finishExtract(test, *job)
+
+    def patternMatchesTarget(self, pattern, targetFile, relativeTarget):
+        if pattern == "*":
+            return False  # means only files which aren't collated anyway
+        return pattern == targetFile or fnmatch(relativeTarget, pattern)
 
     def tryFetchRemoteFiles(self, test):
         machine, remoteTmpDir = test.app.getRemoteTestTmpDir(test)
@@ -790,12 +828,23 @@ class CollateFiles(plugins.Action):
                     return logDir, logDirFiles
         return localTestDir, localFiles
 
+    def targetChanged(self, targetFile):
+        # Patterns globbed from this directory or above it may now match differently
+        targetDir = os.path.dirname(targetFile)
+        for cacheKey in list(self.globCache.keys()):
+            testDir = cacheKey[0]
+            if targetDir == testDir or targetDir.startswith(os.path.join(testDir, "")):
+                del self.globCache[cacheKey]
+
     def globDir(self, testDir, sourcePattern):
-        origCwd = os.getcwd()
-        os.chdir(testDir)
-        result = glob.glob(sourcePattern)
-        os.chdir(origCwd)
-        return [os.path.join(testDir, f) for f in result]
+        cacheKey = testDir, sourcePattern
+        if cacheKey not in self.globCache:
+            origCwd = os.getcwd()
+            os.chdir(testDir)
+            result = glob.glob(sourcePattern)
+            os.chdir(origCwd)
+            self.globCache[cacheKey] = [os.path.join(testDir, f) for f in result]
+        return list(self.globCache[cacheKey])
 
     def findPaths(self, test, sourcePattern):
         self.diag.info("Looking for pattern " + sourcePattern + " for " + repr(test))
@@ -828,68 +877,90 @@ class CollateFiles(plugins.Action):
                 stderr.close()
 
     def kill(self, test, sig):
-        if self.collationProc:
-            proc = self.collationProc
-            self.collationProc = None
+        while self.collationProcs:
+            proc = self.collationProcs.pop()
             killProcessAndChildren(proc, cmd=test.getConfigValue("kill_command"))
 
+    def getCollatingFile(self, test, targetFile):
+        # Write somewhere else first, so nothing ever sees a half-written result file
+        return test.makeTmpFileName(os.path.basename(targetFile) + ".collating", forFramework=1)
+
     def extract(self, test, sourceFiles, targetFile, collationErrFile):
         stem = os.path.splitext(os.path.basename(targetFile))[0]
         scripts = test.getCompositeConfigValue("collate_script", stem)
-        sourceFilesStr = ",".join(sourceFiles)
         if len(scripts) == 0:
             if len(sourceFiles) > 1:
                 msg = "Multiple files are found for '" + stem + "' in " + \
                     repr(test) + ", but no collate_script is defined.\n"
                 sys.stderr.write(msg)
-            return shutil.copyfile(sourceFiles[0], targetFile)
+            collatingFile = self.getCollatingFile(test, targetFile)
+            shutil.copyfile(sourceFiles[0], collatingFile)
+            os.replace(collatingFile, targetFile)
+            self.targetChanged(targetFile)
+            return
 
-        self.collationProc = None
+        collationProc = None
         stdin = None
+        collatingFile = self.getCollatingFile(test, targetFile)
         for script in scripts:
             args = script.split()
-            if self.collationProc:
-                stdin = self.collationProc.stdout
+            if collationProc:
+                stdin = collationProc.stdout
             else:
                 args += sourceFiles
             self.diag.info("Opening extract process with args " + repr(args))
             if script is scripts[-1]:
-                stdout = open(targetFile, "w")
+                stdout = open(collatingFile, "w")
                 stderr = open(collationErrFile, "w")
             else:
                 stdout = subprocess.PIPE
                 stderr = subprocess.STDOUT
 
-            self.collationProc = self.runCollationScript(args, test, stdin, stdout, stderr)
-            if not self.collationProc:
-                if os.path.isfile(targetFile):
-                    os.remove(targetFile)
+            collationProc = self.runCollationScript(args, test, stdin, stdout, stderr)
+            if not collationProc:
+                for fileName in [collatingFile, targetFile]:
+                    if os.path.isfile(fileName):
+                        os.remove(fileName)
+                self.targetChanged(targetFile)
                 errorMsg = "Could not find extract script '" + script + \
-                    "', not extracting file(s) at\n" + sourceFilesStr + "\n"
+                    "', not extracting file(s) at\n" + ",".join(sourceFiles) + "\n"
                 stderr = open(collationErrFile, "w")
                 stderr.write(errorMsg)
                 plugins.printWarning(errorMsg.strip())
                 stderr.close()
                 return
 
-        if self.collationProc:
-            self.diag.info("Waiting for collation process to terminate...")
-            self.collationProc.wait()
-            if self.collationProc:
-                self.collationProc = None
-            else:
-                procName = args[0]
-                briefText = "KILLED (" + os.path.basename(procName) + ")"
-                freeText = "Killed collation script '" + procName + \
-                    "'\n while collating file(s) at " + sourceFilesStr + "\n"
-                test.changeState(Killed(briefText, freeText, test.state))
-            stdout.close()
-            stderr.close()
-
-        if len(sourceFiles) > 0 and any((os.path.getsize(fn) > 0 for fn in sourceFiles)) and os.path.getsize(targetFile) == 0 and os.path.getsize(collationErrFile) == 0:
+        self.collationProcs.append(collationProc)
+        return collationProc, args, scripts, sourceFiles, targetFile, collatingFile, collationErrFile, stdout, stderr
+
+    def finishExtract(self, test, collationProc, args, scripts, sourceFiles, targetFile, collatingFile, collationErrFile, stdout, stderr):
+        sourceFilesStr = ",".join(sourceFiles)
+        self.diag.info("Waiting for collation process to terminate...")
+        collationProc.wait()
+        stdout.close()
+        stderr.close()
+        if collationProc in self.collationProcs:
+            self.collationProcs.remove(collationProc)
+        else:
+            procName = args[0]
+            briefText = "KILLED (" + os.path.basename(procName) + ")"
+            freeText = "Killed collation script '" + procName + \
+                "'\n while collating file(s) at " + sourceFilesStr + "\n"
+            test.changeState(Killed(briefText, freeText, test.state))
+            os.remove(collatingFile)
+            return
+
+        if len(sourceFiles) > 0 and any((os.path.getsize(fn) > 0 for fn in sourceFiles)) and os.path.getsize(collatingFile) == 0 and os.path.getsize(collationErrFile) == 0:
             # Collation scripts that don't write anything shouldn't produce empty files...
             # If they write errors though, we might want to pick those up
-            os.remove(targetFile)
+            os.remove(collatingFile)
+            if os.path.isfile(targetFile):
+                os.remove(targetFile)
+        else:
+            # The exit status is ignored, as it always has been: e.g. grep exits with 1 when it finds nothing
+            # Any errors written are reported below
+            os.replace(collatingFile, targetFile)
+        self.targetChanged(targetFile)
 
         collateErrMsg = test.app.filterErrorText(collationErrFile)
         if collateErrMsg:
@@ -2,6 +2,7 @@
 """ All the standard scripts that come with the default configuration """
 
 from . import sandbox
+from .grepindex import TrigramIndex
 import operator
 import os
 import shutil
@@ -12,7 +13,6 @@ from texttestlib import plugins
 from collections import OrderedDict
 from configparser import RawConfigParser
 from functools import reduce
-from pprint import pformat
 
 
 class CountTest(plugins.Action):
@@ -157,6 +157,7 @@ class DocumentConfig(plugins.ScriptWithArgs):
                 print(key + "|" + self.interpretArgument(value) + "|" + docOutput)
 
     def interpretArgument(self, arg):
+        from pprint import pformat
         argStr = pformat(arg, width=1000) if isinstance(arg, dict) else str(arg)
         if os.sep == "\\":
             # in python strings get double backslashes, handle this
@@ -364,6 +365,41 @@ class ReplaceText(plugins.ScriptWithArgs):
                 self.stems.append(logFile)
 
 
+class UpdateGrepIndex(plugins.ScriptWithArgs):
+    scriptDoc = "Bring the index used when searching test files up to date for the files with the given stems"
+
+    def __init__(self, args=[]):
+        argDict = self.parseArguments(args, ["file"])
+        self.stems = plugins.commasplit(argDict.get("file", "*"))
+
+    def __repr__(self):
+        return "Indexing files for"
+
+    def setUpApplication(self, app):
+        if not TrigramIndex.getForApp(app):
+            plugins.printWarning("Not indexing files for " + app.description() + ": 'use_grep_index' is not set in its config file")
+
+    def __call__(self, test):
+        self.indexFiles(test)
+
+    def setUpSuite(self, suite):
+        self.indexFiles(suite)
+
+    def indexFiles(self, test):
+        grepIndex = TrigramIndex.getForApp(test.app)
+        if not grepIndex:
+            return
+        self.describe(test)
+        for stem in self.stems:
+            for fileName in test.getFileNamesMatching(stem):
+                if os.path.isfile(fileName):
+                    grepIndex.getFileTrigrams(fileName)
+
+    @classmethod
+    def finalise(cls):
+        TrigramIndex.saveAll()
+
+
 class ExportTests(plugins.ScriptWithArgs):
     scriptDoc = "Export the selected tests to a different test suite"
 
@@ -133,6 +133,7 @@ class Activator(plugins.Responder, plugins.Observable):
                     rejectionInfo[suite.app] = "no tests matching the selection criteria found."
             except plugins.TextTestError as e:
                 rejectionInfo[suite.app] = str(e)
+        self.diag.info("Read all test suites: " + testmodel.DirectoryCache.getSharingSummary())
 
         self.notify("AllRead", goodSuites)
 
@@ -157,6 +158,29 @@ class Activator(plugins.Responder, plugins.Observable):
                         sys.stderr.write(app.rejectionMessage(rejectionInfo.get(app)))
 
 
+class StartupProfile:
+    # Where the time goes before any test starts, for --startup-profile
+    def __init__(self):
+        self.phaseTimes = OrderedDict()
+        self.phaseTimes["Interpreter start and imports"] = time.time() - self.getProcessStartTime()
+
+    def getProcessStartTime(self):
+        try:
+            import psutil
+            return psutil.Process().create_time()
+        except Exception:
+            return time.time()
+
+    def addTime(self, phase, startTime):
+        self.phaseTimes[phase] = self.phaseTimes.get(phase, 0.0) + time.time() - startTime
+
+    def write(self):
+        print("Startup profile (" + str(len(sys.modules)) + " modules loaded):")
+        for phase, seconds in self.phaseTimes.items():
+            print("  " + phase.ljust(32) + ("%.3f" % seconds).rjust(8) + "s")
+        print("  " + "Total".ljust(32) + ("%.3f" % sum(self.phaseTimes.values())).rjust(8) + "s")
+
+
 class TextTest(plugins.Responder, plugins.Observable):
     def __init__(self):
         plugins.Responder.__init__(self)
@@ -166,6 +190,7 @@ class TextTest(plugins.Responder, plugins.Observable):
             signal.signal(signal.SIGQUIT, self.printStackTrace)
         self.setSignalHandlers(self.handleSignalWhileStarting)
         self.inputOptions = testmodel.OptionFinder()
+        self.startupProfile = StartupProfile() if "startup-profile" in self.inputOptions else None
         self.diag = logging.getLogger("Find Applications")
         self.appSuites = OrderedDict()
         self.exitCode = 0
@@ -238,7 +263,7 @@ class TextTest(plugins.Responder, plugins.Observable):
         appList = []
         raisedError = False
         self.diag.info("Selecting apps in " + dirName + " according to dictionary :" + repr(selectedAppDict))
-        dircache = testmodel.DirectoryCache(dirName)
+        dircache = testmodel.DirectoryCache.getShared(dirName)
         for f in dircache.findAllFiles("config"):
             if not os.path.isfile(f):
                 continue  # ignore broken links and directories
@@ -269,10 +294,17 @@ class TextTest(plugins.Responder, plugins.Observable):
         return raisedError, appList
 
     def createApplication(self, appName, dircache, versions):
+        startTime = time.time()
         try:
             return testmodel.Application(appName, dircache, versions, self.inputOptions)
         except (testmodel.BadConfigError, plugins.TextTestError) as e:
             sys.stderr.write("Unable to load application from file 'config." + appName + "' - " + str(e) + ".\n")
+        finally:
+            self.addStartupTime("Reading configuration", startTime)
+
+    def addStartupTime(self, phase, startTime):
+        if self.startupProfile:
+            self.startupProfile.addTime(phase, startTime)
 
     def addApplication(self, appName, dircache, appVersions, allVersions=[]):
         app = self.createApplication(appName, dircache, appVersions)
@@ -365,6 +397,15 @@ class TextTest(plugins.Responder, plugins.Observable):
                 sys.stdout.write(fullMsg)
         return raisedError, appSuites
 
+    def notifyStartRead(self):
+        self.readStartTime = time.time()
+
+    def notifyAllRead(self, *args):
+        # The Activator reads the test suites, and we're the first to hear when it's done
+        if self.startupProfile:
+            self.addStartupTime("Reading test suites", self.readStartTime)
+            self.startupProfile.write()
+
     def notifyExit(self):
         # Can get called several times, protect against this...
         if len(self.appSuites) > 0:
@@ -392,7 +433,12 @@ class TextTest(plugins.Responder, plugins.Observable):
             pass  # already written about this
 
     def _run(self):
+        startTime = time.time()
         appFindingWroteError, allApps = self.findApps()
+        if self.startupProfile:
+            # Configuration is read while finding applications, don't count it twice
+            configTime = self.startupProfile.phaseTimes.get("Reading configuration", 0.0)
+            self.addStartupTime("Finding applications", startTime + configTime)
         if self.inputOptions.helpMode():
             if len(allApps) > 0:
                 allApps[0].printHelpText()
@@ -429,8 +475,12 @@ class TextTest(plugins.Responder, plugins.Observable):
         return validOptions
 
     def createAndRunSuites(self, allApps):
+        startTime = time.time()
         self.createResponders(allApps)
+        self.addStartupTime("Creating responders", startTime)
+        startTime = time.time()
         raisedError, self.appSuites = self.createTestSuites(allApps)
+        self.addStartupTime("Creating test suites", startTime)
         if not raisedError or len(self.appSuites) > 0:
             self.addSuites(list(self.appSuites.values()), allApps)
 
@@ -497,11 +547,11 @@ class TextTest(plugins.Responder, plugins.Observable):
         for rootDir in self.inputOptions.rootDirectories:
             rootConfig = os.path.join(rootDir, configFile)
             if os.path.isfile(rootConfig):
-                return testmodel.DirectoryCache(rootDir)
+                return testmodel.DirectoryCache.getShared(rootDir)
             else:
                 allFiles = glob(os.path.join(rootDir, "*", configFile))
                 if len(allFiles) > 0:
-                    return testmodel.DirectoryCache(os.path.dirname(allFiles[0]))
+                    return testmodel.DirectoryCache.getShared(os.path.dirname(allFiles[0]))
 
     def notifyExtraTest(self, testPath, appName, versions):
         rootSuite = self.getRootSuite(appName, versions)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# Keeps a content-addressed cache of test data on a remote machine, so that TextTest need only copy each file
+# there once. Runs on the remote machine and has no access to the rest of TextTest.
+#
+# Usage: datacache.py <cache_dir> <target_path> <max_bytes> <link> [ <incoming_dir> ]
+#
+# The manifest of what is to be created at <target_path> is read from standard input. Each line is tab-separated,
+# either "D <path>" for a directory or "F <blob> <size> <path>" for a file, where the paths are relative to
+# <target_path> and <blob> is the file's content hash, with "x" appended if it is executable.
+#
+# Any blobs in <incoming_dir> are first moved into the cache. If any blobs in the manifest are then still missing,
+# they are written to standard output, one per line, and nothing else is done. Otherwise <target_path> is created,
+# with the files hard-linked from the cache if <link> is 1 and copied from it otherwise. The least recently used
+# blobs are then removed until the cache is no bigger than <max_bytes>.
+
+import os
+import sys
+import shutil
+import stat
+
+
+def getBlobPath(blobDir, blob):
+    return os.path.join(blobDir, blob[:2], blob)
+
+
+def addIncomingBlobs(blobDir, incomingDir):
+    added = False
+    for blob in os.listdir(incomingDir):
+        blobPath = getBlobPath(blobDir, blob)
+        os.makedirs(os.path.dirname(blobPath), exist_ok=True)
+        # Blobs are shared between sandboxes, make sure nobody can change them
+        mode = 0o555 if blob.endswith("x") else 0o444
+        os.chmod(os.path.join(incomingDir, blob), mode)
+        os.replace(os.path.join(incomingDir, blob), blobPath)
+        added = True
+    shutil.rmtree(incomingDir, ignore_errors=True)
+    return added
+
+
+def readManifest(manifestFile):
+    dirs, files = [], []
+    for line in manifestFile:
+        parts = line.rstrip("\n").split("\t")
+        if parts[0] == "D":
+            dirs.append(parts[1])
+        elif parts[0] == "F":
+            files.append((parts[1], int(parts[2]), parts[3]))
+    return dirs, files
+
+
+def findMissingBlobs(blobDir, files):
+    missing = []
+    for blob, size, _ in files:
+        blobPath = getBlobPath(blobDir, blob)
+        try:
+            if os.stat(blobPath).st_size == size:
+                # Mark it as recently used, so it won't be evicted
+                os.utime(blobPath)
+                continue
+            # Someone has changed it anyway, don't trust it
+            os.remove(blobPath)
+        except OSError:
+            pass
+        if blob not in missing:
+            missing.append(blob)
+    return missing
+
+
+def removePath(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def populate(blobDir, targetPath, dirs, files, link):
+    removePath(targetPath)
+    for relPath in dirs:
+        os.makedirs(os.path.normpath(os.path.join(targetPath, relPath)), exist_ok=True)
+    for blob, _, relPath in files:
+        blobPath = getBlobPath(blobDir, blob)
+        path = os.path.normpath(os.path.join(targetPath, relPath))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if link:
+            try:
+                os.link(blobPath, path)
+                continue
+            except OSError:
+                pass  # e.g. the cache is on a different file system
+        shutil.copyfile(blobPath, path)
+        if blob.endswith("x"):
+            os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def evict(blobDir, maxBytes):
+    blobs = []
+    totalSize = 0
+    for subDir in os.listdir(blobDir):
+        for entry in os.scandir(os.path.join(blobDir, subDir)):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue  # someone else has evicted it
+            blobs.append((st.st_mtime, st.st_size, entry.path))
+            totalSize += st.st_size
+    blobs.sort()
+    for _, size, path in blobs:
+        if totalSize <= maxBytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        totalSize -= size
+
+
+def main(cacheDir, targetPath, maxBytes, link, incomingDir=None):
+    blobDir = os.path.join(cacheDir, "blobs")
+    os.makedirs(os.path.join(cacheDir, "incoming"), exist_ok=True)
+    os.makedirs(blobDir, exist_ok=True)
+    added = addIncomingBlobs(blobDir, incomingDir) if incomingDir else False
+    dirs, files = readManifest(sys.stdin)
+    missing = findMissingBlobs(blobDir, files)
+    if missing:
+        sys.stdout.write("".join((blob + "\n" for blob in missing)))
+        return
+    populate(blobDir, targetPath, dirs, files, link)
+    if added:
+        evict(blobDir, maxBytes)
+
+
+if __name__ == "__main__":
+    args = [os.path.expandvars(arg) for arg in sys.argv[1:]]
+    main(args[0], args[1], int(args[2]), args[3] == "1", *args[4:])
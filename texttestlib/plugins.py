@@ -1,7 +1,7 @@
 
 import sys
 import os
-import logging.config
+import logging
 import string
 import shutil
 import socket
@@ -11,14 +11,19 @@ import stat
 import shlex
 import types
 import fnmatch
+import itertools
 import subprocess
+import zlib
+import pickle
+import weakref
 from collections import OrderedDict
 from traceback import format_exception
 from threading import currentThread, RLock
 from queue import Queue, Empty
 from glob import glob
 from datetime import datetime
-from pickle import Unpickler, UnpicklingError
+from io import BytesIO
+from pickle import Pickler, Unpickler, UnpicklingError
 from locale import getpreferredencoding
 
 
@@ -369,9 +374,17 @@ class TextTriggerGroup:
     def __init__(self, texts):
         self.texts = texts
         self.textTriggers = [TextTrigger(text) for text in self.texts]
+        self.combinedRegex, self.uncombinedTriggers = self.combineTriggers()
+
+    def combineTriggers(self):
+        if len(self.textTriggers) < 2:
+            return None, self.textTriggers
+        return combineTextTriggers(self.textTriggers)
 
     def stringContainsText(self, searchString):
-        for trigger in self.textTriggers:
+        if self.combinedRegex is not None and self.combinedRegex.search(searchString):
+            return True
+        for trigger in self.uncombinedTriggers:
             if trigger.matches(searchString):
                 return True
         return False
@@ -406,8 +419,19 @@ class TestSelectionFilter(TextFilter):
 
     def __init__(self, *args):
         self.diag = logging.getLogger("TestSelectionFilter")
-        self.fullSuites = []
+        self.fullSuites = set()
         TextFilter.__init__(self, *args)
+        # Selection files can list many thousands of tests, so look them up by hash rather than scanning
+        self.selectedPaths = set(self.texts)
+        self.selectedAncestors = self.findAncestorPaths(self.selectedPaths)
+
+    def findAncestorPaths(self, relPaths):
+        ancestors = set()
+        for relPath in relPaths:
+            parts = relPath.split(os.sep)
+            for i in range(1, len(parts)):
+                ancestors.add(os.sep.join(parts[:i]))
+        return ancestors
 
     def parseInput(self, filterText, app, suites):
         allEntries = TextFilter.parseInput(self, filterText, app, suites)
@@ -479,7 +503,7 @@ class TestSelectionFilter(TextFilter):
         return max(allApps, key=matchKey)
 
     def acceptsTestCase(self, test):
-        return test.getRelPath() in self.texts or self.hasFullSuiteAncestor(test.parent)
+        return test.getRelPath() in self.selectedPaths or self.hasFullSuiteAncestor(test.parent)
 
     def hasFullSuiteAncestor(self, suite):
         return suite in self.fullSuites or (suite.parent and self.hasFullSuiteAncestor(suite.parent))
@@ -490,14 +514,11 @@ class TestSelectionFilter(TextFilter):
     def suiteInTexts(self, suite):
         if suite.parent is None:
             return True  # don't eliminate the root suite :)
-        for relPath in self.texts:
-            suitePath = suite.getRelPath()
-            if relPath == suitePath:
-                self.fullSuites.append(suite)
-                return True
-            elif relPath.startswith(suitePath + os.sep):
-                return True
-        return False
+        suitePath = suite.getRelPath()
+        if suitePath in self.selectedPaths:
+            self.fullSuites.add(suite)
+            return True
+        return suitePath in self.selectedAncestors
 
 
 # Generic action to be performed: all actions need to provide these methods
@@ -563,6 +584,9 @@ def addCategory(name, briefDesc, longDesc=""):
 
 
 class ThreadedNotificationHandler:
+    # How long one idle callback may spend passing on queued notifications
+    maxPollTime = 0.05
+
     def __init__(self):
         self.workQueue = Queue()
         self.mutex = RLock()
@@ -586,16 +610,20 @@ class ThreadedNotificationHandler:
             self.idleHandler = None
 
     def pollQueue(self):
+        # Pass on as many notifications as fit in the time allowed, rather than going back to the event loop for each
         with self.mutex:
-            try:
-                observable, args, kwargs = self.workQueue.get_nowait()
+            deadline = time.time() + self.maxPollTime
+            while True:
+                try:
+                    observable, args, kwargs = self.workQueue.get_nowait()
+                except Empty:
+                    self.source = None
+                    return False
                 if len(self.allowedEvents) == 0 or args[0] in self.allowedEvents:
                     observable.diagnoseObs("From work queue", *args, **kwargs)
                     observable.performNotify(*args, **kwargs)
-            except Empty:
-                self.source = None
-                return False
-            return True
+                if time.time() >= deadline:
+                    return True
 
     def transfer(self, observable, *args, **kwargs):
         with self.mutex:
@@ -604,8 +632,18 @@ class ThreadedNotificationHandler:
                 self.source = self.idleHandler()
 
 
+class DispatchTable(dict):
+    # Which observers handle each notification, shared by observables with the same observers.
+    # Holds the observers, so that their ids cannot be reused while anyone can look the table up by them
+    def __init__(self, observers):
+        dict.__init__(self)
+        self.observers = observers
+
+
 class Observable:
     threadedNotificationHandler = ThreadedNotificationHandler()
+    # Weak references: a table goes when the last observable using it does
+    sharedDispatchTables = weakref.WeakValueDictionary()
     obsDiag = None
     LAST_OBSERVER = "last observer"
 
@@ -613,11 +651,19 @@ class Observable:
     def diagnoseObs(klass, message, *args, **kwargs):
         if not klass.obsDiag:
             klass.obsDiag = logging.getLogger("Observable")
-        klass.obsDiag.info(message + " " + str(klass) + " " + repr(args) + repr(kwargs))
+        if klass.obsDiag.isEnabledFor(logging.INFO):
+            klass.obsDiag.info(message + " " + str(klass) + " " + repr(args) + repr(kwargs))
 
     def __init__(self, passSelf=False):
         self.observers = []
         self.passSelf = passSelf
+        self.dispatchTable = {}
+        self.dispatchObservers = None
+        self.dispatchObserverCount = 0
+
+    def __getstate__(self):
+        # The dispatch table holds methods of the observers, and is recalculated anyway
+        return {var: value for var, value in self.__dict__.items() if not var.startswith("dispatch")}
 
     def addObserver(self, observer):
         self.observers.append(observer)
@@ -652,30 +698,44 @@ class Observable:
             self.diagnoseObs("Perform directly", *args, **kwargs)
             self.performNotify(*args, **kwargs)
 
+    def getInterestedObservers(self, methodName):
+        # Which observers handle each notification is worked out once per set of observers, not on every notify.
+        # Unpickled objects have not called __init__, and the observer list may be replaced or appended to directly
+        if getattr(self, "dispatchObservers", None) is not self.observers or self.dispatchObserverCount != len(self.observers):
+            # Tests are given copies of the same observers, so share the tables between them
+            key = tuple(map(id, self.observers))
+            table = self.sharedDispatchTables.get(key)
+            if table is None:
+                table = self.sharedDispatchTables[key] = DispatchTable(list(self.observers))
+            self.dispatchTable = table
+            self.dispatchObservers = self.observers
+            self.dispatchObserverCount = len(self.observers)
+        observers = self.dispatchTable.get(methodName)
+        if observers is None:
+            observers = [(o, getattr(o, methodName)) for o in self.observers if hasattr(o, methodName)]
+            self.dispatchTable[methodName] = observers
+        return observers
+
     def performNotify(self, name, *args, **kwargs):
         methodName = "notify" + name
+        # unpickled objects have not called __init__, and
+        # hence do not have self.passSelf ...
+        if getattr(self, "passSelf", False):
+            args = (self,) + args
         lastObserver = None
-        for observer in self.observers:
-            if hasattr(observer, methodName):
-                self.diagnoseObs("Notify observer " + name + " " + str(observer.__class__))
-                answer = self.notifyObserver(observer, methodName, *args, **kwargs)
-                if answer == self.LAST_OBSERVER:
-                    self.diagnoseObs("Setting as last observer", *args, **kwargs)
-                    lastObserver = observer
+        for observer, method in self.getInterestedObservers(methodName):
+            self.diagnoseObs("Notify observer", name, observer.__class__)
+            answer = self.notifyObserver(method, methodName, *args, **kwargs)
+            if answer == self.LAST_OBSERVER:
+                self.diagnoseObs("Setting as last observer", *args, **kwargs)
+                lastObserver = observer
         if lastObserver:
             self.diagnoseObs("Notify last observer", *args, **kwargs)
             lastObserver.notifyLastObserver(methodName)
 
-    def notifyObserver(self, observer, methodName, *args, **kwargs):
-        # doesn't matter if only some of the observers have the method
-        method = getattr(observer, methodName)
-        # unpickled objects have not called __init__, and
-        # hence do not have self.passSelf ...
+    def notifyObserver(self, method, methodName, *args, **kwargs):
         try:
-            if hasattr(self, "passSelf") and self.passSelf:
-                return method(self, *args, **kwargs)
-            else:
-                return method(*args, **kwargs)
+            return method(*args, **kwargs)
         except TextTestException:
             raise
         except Exception:
@@ -868,7 +928,39 @@ class MarkedTestState(TestState):
         return MarkedTestState(self.myFreeText, self.briefText, newOldState, self.executionHosts)
 
 
+# Big test states are written with this header, then a pickle of the compressed big texts and the pickled state itself.
+# Anything else is taken to be a plain pickle, as written by older versions and for smaller states.
+testStateHeader = b"TEXTTEST_STATE 1\n"
+# Below this size, plain pickles are written: compressing costs more than it saves, and older versions can read them
+compactTestStateSize = 256 * 1024
+
+
+class TestStatePickler(Pickler):
+    # Big texts, like the previews of file differences, are stored once and compressed together.
+    minTextSize = 4096
+
+    def __init__(self, file):
+        Pickler.__init__(self, file, protocol=5)
+        self.texts = []
+        self.textIndices = {}
+
+    def persistent_id(self, obj):
+        if type(obj) is str and len(obj) >= self.minTextSize:
+            index = self.textIndices.get(obj)
+            if index is None:
+                index = self.textIndices[obj] = len(self.texts)
+                self.texts.append(obj)
+            return index
+
+
 class TestStateUnpickler(Unpickler):
+    def __init__(self, file, texts=[], **kw):
+        Unpickler.__init__(self, file, **kw)
+        self.texts = texts
+
+    def persistent_load(self, pid):
+        return self.texts[pid]
+
     def find_class(self, modName, className):
         try:
             namespace = {}
@@ -884,17 +976,57 @@ class TestStateUnpickler(Unpickler):
                 raise e
 
 
+def serialiseTestState(state):
+    diag = logging.getLogger("Test State")
+    startTime = time.time()
+    stateFile = BytesIO()
+    pickler = TestStatePickler(stateFile)
+    pickler.dump(state)
+    textSize = sum((len(text) for text in pickler.texts))
+    # Roughly what a plain pickle would take: only small states are pickled again
+    if len(stateFile.getvalue()) + textSize < compactTestStateSize:
+        plainData = pickle.dumps(state, protocol=2)
+        diag.info("Encoded plain test state of " + str(len(plainData)) + " bytes in %.3fs" % (time.time() - startTime))
+        return plainData
+
+    textData = zlib.compress(pickle.dumps(pickler.texts, protocol=5), 1) if pickler.texts else b""
+    data = testStateHeader + pickle.dumps((textData, stateFile.getvalue()), protocol=5)
+    diag.info("Encoded compact test state of " + str(len(data)) + " bytes in %.3fs, " % (time.time() - startTime) +
+              str(len(pickler.texts)) + " big texts of " + str(textSize) + " characters compressed to " +
+              str(len(textData)) + " bytes")
+    return data
+
+
+def writeTestStateToFile(state, file):
+    file.write(serialiseTestState(state))
+
+
 def getNewTestStateFromFile(file):
-    unpickler = TestStateUnpickler(file)
+    diag = logging.getLogger("Test State")
+    startTime = time.time()
+    header = file.read(len(testStateHeader))
+    if header == testStateHeader:
+        textData, stateData = pickle.load(file)
+        try:
+            texts = pickle.loads(zlib.decompress(textData)) if textData else []
+        except zlib.error as e:
+            raise UnpicklingError("Could not decompress texts in test state : " + str(e))
+        state = TestStateUnpickler(BytesIO(stateData), texts).load()
+        diag.info("Decoded compact test state of " + str(len(textData) + len(stateData)) + " bytes in %.3fs, " %
+                  (time.time() - startTime) + str(len(texts)) + " big texts")
+        return state
+
+    data = header + file.read()
+    unpickler = TestStateUnpickler(BytesIO(data))
     try:
-        return unpickler.load()
+        state = unpickler.load()
     except Exception:
         encoding = getpreferredencoding()
-        from io import BytesIO
-        file.seek(0)
-        unpickler = TestStateUnpickler(BytesIO(file.read().replace(b"\r\n", b"\n")), encoding=encoding, errors="replace")
-        return unpickler.load()
-    
+        unpickler = TestStateUnpickler(BytesIO(data.replace(b"\r\n", b"\n")), encoding=encoding, errors="replace")
+        state = unpickler.load()
+    diag.info("Decoded plain test state of " + str(len(data)) + " bytes in %.3fs" % (time.time() - startTime))
+    return state
+
 
 log = None
 
@@ -904,12 +1036,13 @@ def configureLogging(configFile=None):
     global log
     if not log:
         if configFile:
+            from logging.config import fileConfig
             # First is for TextTest troubleshooting
             # Second is for self-tests
             # There appears to be a bug on Windows here, along the lines of https://bugs.python.org/issue19528. All backslashes double up!
             defaults = {"TEXTTEST_PERSONAL_LOG": getPersonalDir("log").replace("\\", "\\\\"),
                         "TEXTTEST_LOG_DIR": os.getenv("TEXTTEST_LOG_DIR", "").replace("\\", "\\\\")}
-            logging.config.fileConfig(configFile.replace("\\", "\\\\"), defaults)
+            fileConfig(configFile.replace("\\", "\\\\"), defaults)
         log = logging.getLogger("standard log")
 
 
@@ -1345,7 +1478,8 @@ class PreviewGenerator:
         return self.getPreviewFromLines(fileLines)
 
     def getFileLines(self, file):
-        lines = file.readlines()
+        # Don't read more than we can show: getCutLines truncates anything of maxLength lines or more
+        lines = list(itertools.islice(file, self.maxLength))
         file.close()
         return lines
 
@@ -1486,6 +1620,26 @@ class MatchAggregator:
         return getattr(self.match, name)
 
 
+def combineTextTriggers(textTriggers):
+    """ Returns one regular expression which matches wherever any of the given triggers that can be combined would,
+    and a list of those that can't """
+    # One search with an alternation instead of one per trigger, which matters with thousands of them
+    patterns, uncombined = [], []
+    for trigger in textTriggers:
+        if trigger.regex is None and trigger.matchEmptyString:
+            patterns.append(re.escape(trigger.text))
+        elif trigger.regex is not None and trigger.regex.groups == 0 and trigger.regex.flags == re.UNICODE:
+            patterns.append("(?:" + trigger.text + ")")
+        else:  # Group numbering and inline flags would change meaning in a combined expression
+            uncombined.append(trigger)
+    if not patterns:
+        return None, uncombined
+    try:
+        return re.compile("|".join(patterns)), uncombined
+    except re.error:  # e.g. global flags inside the patterns
+        return None, list(textTriggers)
+
+
 class MultilineTextTrigger(TextTrigger):
     def __init__(self, text, tryAsRegexp, matchEmptyString=True):
         TextTrigger.__init__(self, text, False, matchEmptyString)
@@ -1560,6 +1714,7 @@ class MultiEntryDictionary(OrderedDict):
         self.importFileFinder = importFileFinder
         self.allowSectionHeaders = allowSectionHeaders
         self.fileTrackSections = fileTrackSections
+        self.filesRead = []
 
     def __reduce__(self):
         # Need this because of __reduce__ in OrderedDict
@@ -1590,6 +1745,7 @@ class MultiEntryDictionary(OrderedDict):
 
     def readFromFile(self, filename, *args, **kwargs):
         self.diag.info("Reading file " + filename)
+        self.filesRead.append(filename)
         currSectionName = ""
         for line in readList(filename):
             if self.allowSectionHeaders and self.isSectionHeader(line):
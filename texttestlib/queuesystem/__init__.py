@@ -89,6 +89,7 @@ class QueueSystemConfig(default.Config):
             elif group.name.startswith("Invisible"):
                 group.addOption("slave", "Private: used to submit slave runs remotely")
                 group.addOption("servaddr", "Private: used to submit slave runs remotely")
+                group.addOption("arraytasks", "Private: used to submit slave runs as grid array jobs")
                 group.addOption(
                     "home", "Private: used to communicate local home directory to environments that run as a different user")
 
@@ -106,6 +107,14 @@ class QueueSystemConfig(default.Config):
         return default.Config.getReconnFullOptions(self) + [
             "Use raw data from the original run and recompute as above, but use the grid for computations"]
 
+    def getFiltersFromMap(self, optionMap, app, suites, **kw):
+        filters = default.Config.getFiltersFromMap(self, optionMap, app, suites, **kw)
+        taskFile = optionMap.get("arraytasks")
+        if taskFile:
+            # Slaves in an array job are all started the same way, the grid tells each one which test is its own
+            filters.append(plugins.TestSelectionFilter(slavejobs.getArrayTaskTestPath(app, taskFile), app, suites))
+        return filters
+
     def getMachineNameForDisplay(self, machine):
         # Don't display localhost, as it's not true when using the grid
         # Should really be something like "whatever grid gives us" but blank space will do for now...
@@ -373,13 +382,18 @@ class QueueSystemConfig(default.Config):
         app.setConfigDefault("min_time_for_performance_force", -1,
                              "Minimum CPU time for test to always run on performance machines")
         app.setConfigDefault("queue_system_module", "local",
-                             "Which queue system (grid engine) set-up to use. (\"local\", \"SGE\" or \"LSF\")")
+                             "Which queue system (grid engine) set-up to use. (\"local\", \"SGE\", \"LSF\", or \"fakegrid\" " +
+                             "to simulate a large grid locally)")
         app.setConfigDefault("performance_test_resource", {"default": []},
                              "Resources to request from queue system for performance testing")
         app.setConfigDefault("parallel_environment_name", "*",
                              "(SGE) Which SGE parallel environment to use when SUT is parallel")
         app.setConfigDefault("queue_system_max_capacity", self.defaultMaxCapacity,
                              "Maximum possible number of parallel tests to run")
+        app.setConfigDefault("queue_system_batch_time", 2,
+                             "Slaves running short tests claim enough to keep them busy for this many seconds at once")
+        app.setConfigDefault("queue_system_max_array_size", 1000,
+                             "Most tests to submit together as one array job, for grid engines that support them")
         app.setConfigDefault("queue_system_max_reruns", {
                              "default": self.defaultMaxReruns}, "Maximum number of times to rerun tests due to known bugs")
         app.setConfigDefault("queue_system_min_test_count", 0,
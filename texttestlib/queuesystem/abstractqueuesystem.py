@@ -28,9 +28,31 @@ class QueueSystem(object):
         else:
             return self.findJobId(stdout), None
 
+    def supportsArrayJobs(self):
+        return False
+
+    def submitSlaveArrayJob(self, cmdArgs, taskCount, *args):
+        # Returns ids for each task, which are then treated just like job ids
+        jobId, errorMessage = self.submitSlaveJob(self.getArraySubmitCmdArgs(cmdArgs, taskCount), *args)
+        if jobId is None:
+            return None, errorMessage
+        else:
+            return self.getArrayTaskIds(jobId, taskCount), None
+
+    def getArrayTaskJobName(self, jobName, taskIndex):
+        # The name of the task's own log files in the slave log directory, if it has any
+        pass
+
     def supportsPolling(self):
         return True
 
+    def getStatusForJobs(self, jobIds):
+        # Override if the queue system can be asked about just these jobs
+        return self.getStatusForAllJobs()
+
+    def setJobExitCallback(self, callback):
+        pass  # only the local queue system finds out when jobs exit
+
     def findErrorMessage(self, stderr, *args):
         if len(stderr) > 0:
             basicError = self.findSubmitError(stderr)
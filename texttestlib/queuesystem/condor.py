@@ -2,6 +2,7 @@
 import os
 import subprocess
 from . import abstractqueuesystem
+from locale import getpreferredencoding
 from texttestlib.plugins import log
 
 # Used by the master to submit, monitor and delete jobs...
@@ -20,27 +21,46 @@ class QueueSystem(abstractqueuesystem.QueueSystem):
     def getSubmitCmdArgs(self, submissionRules, commandArgs=[], slaveEnv={}):
         return commandArgs  # These really aren't very interesting, as all the stuff is in the command file
 
-    def submitSlaveJob(self, cmdArgs, slaveEnv, logDir, submissionRules, jobType):
-        submitScript = self.writeSubmitScript(submissionRules, logDir, cmdArgs, slaveEnv)
+    def submitSlaveJob(self, cmdArgs, slaveEnv, logDir, submissionRules, jobType, taskCount=1):
+        submitScript = self.writeSubmitScript(submissionRules, logDir, cmdArgs, slaveEnv, taskCount)
         realArgs = ["condor_submit", submitScript]
         return abstractqueuesystem.QueueSystem.submitSlaveJob(self, realArgs, slaveEnv, logDir, submissionRules, jobType)
 
-    def writeSubmitScript(self, submissionRules, directory, cmdArgs, slaveEnv):
+    def supportsArrayJobs(self):
+        return True
+
+    def submitSlaveArrayJob(self, cmdArgs, taskCount, *args):
+        # One cluster with many processes: the submit file does it all
+        jobId, errorMessage = self.submitSlaveJob(cmdArgs, *args, taskCount=taskCount)
+        if jobId is None:
+            return None, errorMessage
+        else:
+            return [jobId + "." + str(procId) for procId in range(taskCount)], None
+
+    def getArrayTaskJobName(self, jobName, taskIndex):
+        # Each process writes its own files, see below
+        return jobName + "." + str(taskIndex)
+
+    def writeSubmitScript(self, submissionRules, directory, cmdArgs, slaveEnv, taskCount=1):
         jobName = submissionRules.getJobName()
         submitFileName = jobName + ".sub"
         resources = " && ".join(submissionRules.findResourceList())
+        filePrefix = jobName + ".$(Process)" if taskCount > 1 else jobName
+        envStr = [var + "=" + value for var, value in list(slaveEnv.items())]
+        if taskCount > 1:
+            envStr.append("TEXTTEST_ARRAY_TASK_ID=$(Process)")
         with open(os.path.join(directory, submitFileName), "w") as submitFile:
             submitFile.writelines(['universe = vanilla\n',
                                    'executable = ' + cmdArgs[0] + '\n',
                                    'arguments = ' + " ".join(cmdArgs[1:]) + '\n',
                                    'requirements = ' + resources + '\n',
-                                   'output = ' + jobName + '.out\n',
-                                   'error = ' + jobName + '.errors\n',
-                                   'log = ' + jobName + '.log\n',
-                                   'queue' + '\n'])
-            if slaveEnv:
-                envStr = [var + "=" + value for var, value in list(slaveEnv.items())]
+                                   'output = ' + filePrefix + '.out\n',
+                                   'error = ' + filePrefix + '.errors\n',
+                                   'log = ' + jobName + '.log\n'])
+            # Must come before 'queue', which submits with the settings so far
+            if envStr:
                 submitFile.write("environment = " + "|".join(envStr) + "\n")
+            submitFile.write("queue " + str(taskCount) + "\n")
 
         return submitFileName
 
@@ -55,16 +75,23 @@ class QueueSystem(abstractqueuesystem.QueueSystem):
             return resultOutput
 
     def getStatusForAllJobs(self):
+        return self.getStatusForJobs([])
+
+    def getStatusForJobs(self, jobIds):
         statusDict = {}
-        proc = subprocess.Popen(['condor_q', '-format', '%s ', 'ClusterId', '-format', '%s\\n',
-                                 'JobStatus'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        proc = subprocess.Popen(['condor_q'] + list(jobIds) + ['-format', '%s ', 'ClusterId', '-format', '%s ', 'ProcId',
+                                 '-format', '%s\\n', 'JobStatus'], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                encoding=getpreferredencoding())
         outMsg = proc.communicate()[0]
         for line in outMsg.splitlines():
             words = line.split()
-            statusLetter = words[1]
+            statusLetter = words[2]
             status = self.allStatuses.get(statusLetter)
             if status:
-                statusDict[words[0]] = status
+                # Array job tasks are processes in the same cluster. Other jobs are known by the cluster alone
+                statusDict[words[0] + "." + words[1]] = status
+                if words[1] == "0":
+                    statusDict[words[0]] = status
         return statusDict
 
     def killJob(self, jobId):
@@ -119,6 +146,12 @@ class MachineInfo:
 def getUserSignalKillInfo(userSignalNumber, explicitKillMethod):
     return explicitKillMethod()
 
+# Used by slave to find which test it should run, when submitted as part of an array job
+
+
+def getArrayTaskIndex():
+    return int(os.getenv("TEXTTEST_ARRAY_TASK_ID"))
+
 # Used by slave to find all execution machines    - basically same code as MachineInfo.findActualMachines
 
 
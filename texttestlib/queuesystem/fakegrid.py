@@ -0,0 +1,418 @@
+"""
+A simulated grid engine, for seeing how the master process copes with many more slaves than we can get hold of
+on a developer's machine. The slaves are local processes, forked from a server process which has already imported
+everything they need, so that they share most of their memory.
+
+By default the slaves don't run TextTest at all: they tell the master they have run each test they are given,
+taking TEXTTEST_FAKEGRID_TEST_TIME seconds (default 0.1) each, and that it succeeded. Set TEXTTEST_FAKEGRID_SIMULATE=0
+to run real slaves instead. The grid itself is set up with these environment variables:
+
+TEXTTEST_FAKEGRID_NODES          number of execution nodes (default 100)
+TEXTTEST_FAKEGRID_SLOTS          jobs each node can run at once (default 1)
+TEXTTEST_FAKEGRID_LATENCY        average seconds a job is pending before it can start (default 1)
+TEXTTEST_FAKEGRID_SUBMIT_RATE    most submissions accepted per second, 0 for no limit (default 0)
+TEXTTEST_FAKEGRID_FAILURE_RATE   proportion of jobs that fail before starting (default 0)
+TEXTTEST_FAKEGRID_KILL_RATE      proportion of jobs killed at some point in their first 10 seconds (default 0)
+TEXTTEST_FAKEGRID_SEED           seed for the random choices above, so runs can be repeated
+"""
+
+import os
+import sys
+import time
+import signal
+import random
+import select
+import pickle
+import logging
+import subprocess
+from collections import OrderedDict, deque
+from threading import Thread, Lock, Event
+from . import abstractqueuesystem, local
+from .utils import frameHeader, readExactly
+from .slavejobs import SocketResponder
+from texttestlib import plugins
+from texttestlib.default.runtest import Running, Killed
+from texttestlib.default.actionrunner import Cancelled
+
+# Looked up on this module by importAndCallFromQueueSystem: the nodes are all this machine, as with local
+MachineInfo = local.MachineInfo
+getUserSignalKillInfo = local.getUserSignalKillInfo
+
+
+class FakeJob:
+    def __init__(self, jobId, cmdArgs, slaveEnv, jobFiles, startTime):
+        self.jobId = jobId
+        self.cmdArgs = cmdArgs
+        self.slaveEnv = slaveEnv
+        self.jobFiles = jobFiles
+        self.startTime = startTime
+        self.node = None
+        self.pid = None
+        self.killTime = None
+        self.killRequested = False
+        self.exitCode = None
+        self.failureText = ""
+
+    def getStatus(self):
+        if self.node is None:
+            return "PEND", "Pending in fake grid"
+        else:
+            return "RUN", "Running on " + self.node
+
+
+class QueueSystem(abstractqueuesystem.QueueSystem):
+    killWindow = 10
+    schedulerInterval = 0.05
+
+    def __init__(self, test):
+        self.simulation = self.getSimulationArgs(test)
+        nodeCount = int(os.getenv("TEXTTEST_FAKEGRID_NODES", "100"))
+        slotCount = int(os.getenv("TEXTTEST_FAKEGRID_SLOTS", "1"))
+        self.freeSlots = deque(("fakenode" + str(i).zfill(3) for i in range(1, nodeCount + 1) for _ in range(slotCount)))
+        self.capacity = len(self.freeSlots)
+        self.latency = float(os.getenv("TEXTTEST_FAKEGRID_LATENCY", "1"))
+        submitRate = float(os.getenv("TEXTTEST_FAKEGRID_SUBMIT_RATE", "0"))
+        self.submitInterval = 1.0 / submitRate if submitRate > 0 else 0
+        self.nextSubmitTime = 0
+        self.failureRate = float(os.getenv("TEXTTEST_FAKEGRID_FAILURE_RATE", "0"))
+        self.killRate = float(os.getenv("TEXTTEST_FAKEGRID_KILL_RATE", "0"))
+        self.random = random.Random(os.getenv("TEXTTEST_FAKEGRID_SEED"))
+        self.jobs = OrderedDict()
+        self.pendingJobs = []
+        self.runningJobs = OrderedDict()
+        self.lock = Lock()
+        self.nodeServer = None
+        self.nodeServerLock = Lock()
+        self.finished = Event()
+        self.diag = logging.getLogger("Fake Grid")
+
+    def getSimulationArgs(self, test):
+        if os.getenv("TEXTTEST_FAKEGRID_SIMULATE", "1") != "0":
+            testTime = float(os.getenv("TEXTTEST_FAKEGRID_TEST_TIME", "0.1"))
+            return testTime, test.getConfigValue("queue_system_batch_time")
+
+    def getCapacity(self):
+        return self.capacity
+
+    def getQueueSystemName(self):
+        return "fake grid"
+
+    def formatCommand(self, cmdArgs):
+        return " ".join(cmdArgs)
+
+    def submitSlaveJob(self, cmdArgs, slaveEnv, logDir, submissionRules, jobType):
+        # Real schedulers make us wait if we submit too quickly
+        if self.submitInterval:
+            now = time.time()
+            if self.nextSubmitTime > now:
+                time.sleep(self.nextSubmitTime - now)
+            self.nextSubmitTime = max(now, self.nextSubmitTime) + self.submitInterval
+        self.ensureRunning()
+        jobFiles = [os.path.join(logDir, fileName) for fileName in submissionRules.getJobFiles()]
+        env = None if self.simulation else self.getSlaveEnvironment(slaveEnv)
+        with self.lock:
+            jobId = str(len(self.jobs) + 1)
+            startTime = time.time() + self.latency * self.random.uniform(0.5, 1.5)
+            job = FakeJob(jobId, cmdArgs, env, jobFiles, startTime)
+            self.jobs[jobId] = job
+            self.pendingJobs.append(job)
+        self.diag.info("Job " + jobId + " submitted, can start in " + str(round(startTime - time.time(), 2)) + " seconds")
+        return jobId, None
+
+    def ensureRunning(self):
+        with self.nodeServerLock:
+            if self.nodeServer is None:
+                # Make sure the server can find this TextTest installation
+                libDir = os.path.dirname(os.path.dirname(plugins.__file__))
+                env = plugins.copyEnvironment()
+                env["PYTHONPATH"] = os.pathsep.join(filter(None, [libDir, env.get("PYTHONPATH")]))
+                cmdArgs = [sys.executable, "-c", "from texttestlib.queuesystem.fakegrid import serveNodes; serveNodes()"]
+                self.nodeServer = subprocess.Popen(cmdArgs, stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+                Thread(target=self.readNodeEvents, daemon=True, name="FakeGridEvents").start()
+                Thread(target=self.runScheduler, daemon=True, name="FakeGridScheduler").start()
+
+    def runScheduler(self):
+        while not self.finished.wait(self.schedulerInterval):
+            now = time.time()
+            with self.lock:
+                readyJobs = [job for job in self.pendingJobs if job.startTime <= now][:len(self.freeSlots)]
+                requests = []
+                for job in readyJobs:
+                    self.pendingJobs.remove(job)
+                    request = self.startJob(job)
+                    if request:
+                        requests.append(request)
+                killJobs = [job for job in self.runningJobs.values() if job.killTime and job.killTime <= now and job.pid]
+            # The node server may be blocked telling us about jobs, which needs the lock, so don't write to it holding it
+            for request in requests:
+                self.writeToNodeServer(request)
+            for job in killJobs:
+                job.killTime = None
+                job.failureText = "Killed by the fake grid on " + job.node
+                self.sendSignal(job, signal.SIGKILL)
+
+    def startJob(self, job):
+        job.node = self.freeSlots.popleft()
+        if self.random.random() < self.failureRate:
+            job.failureText = "Failed on " + job.node + " before starting"
+            with open(job.jobFiles[1], "w") as f:
+                f.write("Fake grid job " + job.jobId + " failed on " + job.node + "\n")
+            self.finishJob(job, 1)
+            return
+        if self.random.random() < self.killRate:
+            job.killTime = time.time() + self.random.uniform(0, self.killWindow)
+        self.runningJobs[job.jobId] = job
+        return job.jobId, job.cmdArgs, job.slaveEnv, os.path.dirname(job.jobFiles[0]), job.jobFiles, job.node, self.simulation
+
+    def writeToNodeServer(self, request):
+        data = pickle.dumps(request)
+        try:
+            self.nodeServer.stdin.write(frameHeader.pack(len(data)) + data)
+            self.nodeServer.stdin.flush()
+        except OSError as e:
+            sys.stderr.write("Failed to start fake grid job " + request[0] + " : " + str(e) + "\n")
+
+    def readNodeEvents(self):
+        try:
+            while True:
+                size = frameHeader.unpack(readExactly(self.nodeServer.stdout, frameHeader.size))[0]
+                event, jobId, value = pickle.loads(readExactly(self.nodeServer.stdout, size))
+                with self.lock:
+                    job = self.jobs[jobId]
+                    if event == "started":
+                        job.pid = value
+                        if job.killRequested:
+                            self.sendSignal(job, signal.SIGUSR2)
+                    else:
+                        self.finishJob(job, value)
+        except EOFError:
+            pass
+
+    def finishJob(self, job, exitCode):
+        self.diag.info("Job " + job.jobId + " finished on " + job.node + " with exit code " + str(exitCode))
+        job.exitCode = exitCode
+        self.runningJobs.pop(job.jobId, None)
+        self.freeSlots.append(job.node)
+
+    def sendSignal(self, job, sig):
+        try:
+            os.kill(job.pid, sig)
+        except OSError:
+            pass  # already gone
+
+    def killJob(self, jobId):
+        with self.lock:
+            job = self.jobs[jobId]
+            if job in self.pendingJobs:
+                self.pendingJobs.remove(job)
+                job.exitCode = -signal.SIGKILL
+                return True
+            elif job.exitCode is not None:
+                return False
+            elif job.pid is None:
+                job.killRequested = True
+                return True
+        self.sendSignal(job, signal.SIGUSR2)
+        return True
+
+    def getStatusForAllJobs(self):
+        with self.lock:
+            return {jobId: job.getStatus() for jobId, job in self.jobs.items() if job.exitCode is None}
+
+    def _getJobFailureInfo(self, jobId):
+        job = self.jobs.get(jobId)
+        if job is None:
+            return "No such job " + jobId
+        elif job.exitCode is None:
+            return "Job " + jobId + " is still " + job.getStatus()[1].lower()
+        else:
+            text = "Job " + jobId + " exited with code " + str(job.exitCode)
+            return text + "\n" + job.failureText if job.failureText else text
+
+    def cleanup(self, final=False):
+        if final and self.nodeServer is not None:
+            self.finished.set()
+            self.nodeServer.stdin.close()
+            self.nodeServer.wait()
+        return True
+
+
+class NodeServer:
+    """ Forks the slave processes, and tells the master when they start and exit. Runs in its own process,
+    which is single-threaded so that forking is safe """
+    def __init__(self):
+        self.requestFd = sys.stdin.fileno()
+        self.events = sys.stdout.buffer
+        self.buffer = bytearray()
+        self.children = {}
+
+    def run(self):
+        while True:
+            ready, _, _ = select.select([self.requestFd], [], [], 0.1)
+            if ready:
+                data = os.read(self.requestFd, 65536)
+                if not data:
+                    break
+                self.buffer += data
+                self.startRequestedJobs()
+            self.reapChildren()
+        # The master has gone, don't leave anything behind
+        for pid in self.children:
+            os.kill(pid, signal.SIGKILL)
+
+    def startRequestedJobs(self):
+        while len(self.buffer) >= frameHeader.size:
+            size = frameHeader.unpack_from(self.buffer)[0]
+            if len(self.buffer) < frameHeader.size + size:
+                return
+            request = pickle.loads(self.buffer[frameHeader.size:frameHeader.size + size])
+            del self.buffer[:frameHeader.size + size]
+            pid = os.fork()
+            if pid == 0:
+                self.runChild(*request)
+            self.children[pid] = request[0]
+            self.sendEvent("started", request[0], pid)
+
+    def runChild(self, jobId, cmdArgs, env, logDir, jobFiles, node, simulation):
+        exitCode = 1
+        try:
+            os.chdir(logDir)
+            os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+            for fd, fileName in enumerate(jobFiles, start=1):
+                os.dup2(os.open(fileName, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644), fd)
+            if simulation:
+                SimulatedSlave(cmdArgs, node, *simulation).run()
+                exitCode = 0
+            else:
+                env["TEXTTEST_FAKEGRID_NODE"] = node
+                os.execvpe(cmdArgs[0], cmdArgs, env)
+        except BaseException:
+            plugins.printException()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exitCode)
+
+    def reapChildren(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            jobId = self.children.pop(pid, None)
+            if jobId is not None:
+                self.sendEvent("exited", jobId, os.waitstatus_to_exitcode(status))
+
+    def sendEvent(self, *event):
+        data = pickle.dumps(event)
+        self.events.write(frameHeader.pack(len(data)) + data)
+        self.events.flush()
+
+
+def serveNodes():
+    # Anything imported by now is shared with all the slaves. Stop the garbage collector making them copy it
+    import gc
+    gc.freeze()
+    NodeServer().run()
+
+
+class SimulatedResult(plugins.TestState):
+    def __init__(self, executionHosts):
+        plugins.TestState.__init__(self, "success", freeText="Simulated by the fake grid", started=1, completed=1,
+                                   executionHosts=executionHosts, lifecycleChange="complete")
+
+    def hasSucceeded(self):
+        return True
+
+    def description(self):
+        return repr(self)
+
+
+class SimulatedApp:
+    def __init__(self, appDesc):
+        self.name, _, versions = appDesc.partition(".")
+        self.versionText = "." + versions if versions else ""
+
+    def versionSuffix(self):
+        return self.versionText
+
+
+class SimulatedTest:
+    """ Just enough of a test for the SocketResponder to report on it """
+    def __init__(self, appDesc, relPath, batchTime):
+        self.app = SimulatedApp(appDesc)
+        self.relPath = relPath
+        self.batchTime = batchTime
+        self.state = plugins.TestState("not_started")
+
+    def getRelPath(self):
+        return self.relPath
+
+    def getConfigValue(self, name):
+        if name == "queue_system_batch_time":
+            return self.batchTime
+
+
+class SimulatedSocketResponder(SocketResponder):
+    def __init__(self, *args):
+        SocketResponder.__init__(self, *args)
+        self.roundTripTimes = []
+
+    def sendData(self, fullData):
+        startTime = time.time()
+        response = SocketResponder.sendData(self, fullData)
+        self.roundTripTimes.append(time.time() - startTime)
+        return response
+
+
+class SimulatedSlave:
+    """ Reports running the tests it's given, as a real slave would, but doesn't run anything """
+    def __init__(self, cmdArgs, node, testTime, batchTime):
+        self.node = node
+        self.testTime = testTime
+        self.responder = SimulatedSocketResponder({"servaddr": self.findArg(cmdArgs, "-servaddr")})
+        self.responder.addObserver(self)
+        self.tests = deque([SimulatedTest(self.findArg(cmdArgs, "-a"), self.findArg(cmdArgs, "-tp"), batchTime)])
+        self.batchTime = batchTime
+        self.killed = False
+        signal.signal(signal.SIGUSR2, self.handleKill)
+
+    @staticmethod
+    def findArg(cmdArgs, flag):
+        return cmdArgs[cmdArgs.index(flag) + 1]
+
+    def handleKill(self, *args):
+        self.killed = True
+
+    def notifyExtraTest(self, testPath, appName, versions):
+        self.tests.append(SimulatedTest(".".join([appName] + versions), testPath, self.batchTime))
+
+    def run(self):
+        while self.tests:
+            test = self.tests.popleft()
+            if self.killed:
+                self.changeState(test, Cancelled("cancelled", "Test run was cancelled before it had started"))
+                continue
+            self.changeState(test, Running([self.node], briefText="RUN (" + self.node + ")", freeText="Running on " + self.node))
+            endTime = time.time() + self.testTime
+            while not self.killed and time.time() < endTime:
+                time.sleep(min(0.05, endTime - time.time()))
+            if self.killed:
+                self.responder.notifyKillProcesses()
+                self.changeState(test, Killed("killed", "Test killed by the fake grid", test.state))
+            else:
+                self.changeState(test, SimulatedResult([self.node]))
+        times = self.responder.roundTripTimes
+        print("Message round trip times: " + " ".join(("%.4f" % t for t in times)))
+
+    def changeState(self, test, state):
+        if state.isComplete():
+            state.lifecycleChange = "complete"
+        test.state = state
+        self.responder.notifyLifecycleChange(test, state, state.lifecycleChange)
+
+
+def getExecutionMachines():
+    return [os.getenv("TEXTTEST_FAKEGRID_NODE", plugins.gethostname())]
@@ -4,6 +4,7 @@
 import subprocess
 import os
 import signal
+from threading import Thread
 from . import abstractqueuesystem
 from multiprocessing import cpu_count
 from texttestlib import plugins
@@ -12,6 +13,14 @@ from texttestlib import plugins
 class QueueSystem(abstractqueuesystem.QueueSystem):
     def __init__(self, *args):
         self.processes = {}
+        self.jobExitCallback = None
+
+    def setJobExitCallback(self, callback):
+        self.jobExitCallback = callback
+
+    def waitForExit(self, jobId, process):
+        process.wait()
+        self.jobExitCallback(jobId)
 
     def submitSlaveJob(self, cmdArgs, slaveEnv, logDir, submissionRules, jobType):
         outputFile, errorsFile = submissionRules.getJobFiles()
@@ -33,6 +42,8 @@ class QueueSystem(abstractqueuesystem.QueueSystem):
         else:
             jobId = str(process.pid)
             self.processes[jobId] = process
+            if self.jobExitCallback:
+                Thread(target=self.waitForExit, args=(jobId, process), daemon=True).start()
             return jobId, None
 
     def getCapacity(self):
@@ -23,6 +23,16 @@ class QueueSystem(gridqueuesystem.QueueSystem):
         bsubArgs += ["-u", "nobody", "-o", os.devnull, "-e", os.devnull]
         return self.addExtraAndCommand(bsubArgs, submissionRules, commandArgs)
 
+    def supportsArrayJobs(self):
+        return True
+
+    def getArraySubmitCmdArgs(self, cmdArgs, taskCount):
+        nameIndex = cmdArgs.index("-J") + 1
+        return cmdArgs[:nameIndex] + [cmdArgs[nameIndex] + "[1-" + str(taskCount) + "]"] + cmdArgs[nameIndex + 1:]
+
+    def getArrayTaskIds(self, jobId, taskCount):
+        return [jobId + "[" + str(taskId) + "]" for taskId in range(1, taskCount + 1)]
+
     def getSlaveVarsToBlock(self):
         """Make sure we clear out the master scripts so the slave doesn't use them too,
         otherwise just use the environment as is.
@@ -52,7 +62,7 @@ class QueueSystem(gridqueuesystem.QueueSystem):
         return 1
 
     def _getJobFailureInfo(self, jobId):
-        resultOutput = os.popen("bjobs -a -l " + jobId + " 2>&1").read()
+        resultOutput = os.popen("bjobs -a -l '" + jobId + "' 2>&1").read()
         if resultOutput.find("is not found") != -1:
             return "LSF lost job:" + jobId
         else:
@@ -63,7 +73,7 @@ class QueueSystem(gridqueuesystem.QueueSystem):
         return False
 
     def killJob(self, jobId):
-        resultOutput = os.popen("bkill -s USR1 " + jobId + " 2>&1").read()
+        resultOutput = os.popen("bkill -s USR1 '" + jobId + "' 2>&1").read()
         return resultOutput.find("is being terminated") != -1 or resultOutput.find("is being signaled") != -1
 
     def getJobId(self, line):
@@ -148,6 +158,12 @@ def getUserSignalKillInfo(userSignalNumber, explicitKillMethod):
     else:
         return explicitKillMethod()
 
+# Used by slave to find which test it should run, when submitted as part of an array job
+
+
+def getArrayTaskIndex():
+    return int(os.getenv("LSB_JOBINDEX")) - 1
+
 # Need to get all hosts for parallel
 
 
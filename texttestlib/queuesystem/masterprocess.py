@@ -2,6 +2,7 @@
 Code to do with the grid engine master process, i.e. submitting slave jobs and waiting for them to report back
 """
 
+import io
 import os
 import sys
 import socket
@@ -10,9 +11,11 @@ import logging
 import time
 from .utils import *
 from queue import Queue
-from socketserver import ThreadingTCPServer, StreamRequestHandler
-from threading import RLock, Lock
-from collections import OrderedDict
+import selectors
+from tempfile import SpooledTemporaryFile
+from concurrent.futures import ThreadPoolExecutor
+from threading import RLock, Lock, Event
+from collections import OrderedDict, deque
 from texttestlib import plugins
 from texttestlib.default.console import TextDisplayResponder, InteractiveResponder
 from texttestlib.default.knownbugs import CheckForBugs
@@ -61,13 +64,23 @@ class QueueSystemServer(BaseActionRunner):
         self.killedJobs = {}
         self.queueSystems = {}
         self.reusedTests = {}
+        self.queuedOnSlaves = set()
+        self.redistributedTests = set()
         self.reuseOnly = False
         self.allRead = False
         self.submitAddress = None
         self.createDirectories = False
         self.slaveLogDirs = set()
+        self.arrayJobCount = 0
+        self.arrayTaskJobNames = {}
         self.delayedTestsForAdd = []
         self.remainingForApp = OrderedDict()
+        # For waking the polling when local jobs exit or we're done
+        self.pollEvent = Event()
+        self.pollLock = Lock()
+        self.exitedJobs = set()
+        self.slaveContactTimes = {}
+        self.slaveActivity = False
         appCapacities = []
         for app in allApps:
             appCapacity = self.maxCapacity
@@ -158,52 +171,114 @@ class QueueSystemServer(BaseActionRunner):
             plugins.printException()
 
     def pollQueueSystem(self):
-        # Start by polling after 5 seconds, ever after try every 15
-        interval = float(os.getenv("TEXTTEST_QS_POLL_INTERVAL", "0.5"))         # Amount of time to wait between checks for exit/completion when polling grid/cloud
-        attempts = int(float(os.getenv("TEXTTEST_QS_POLL_WAIT", "5")) / interval) # Amount of time to wait before initiating polling of grid/cloud
-        subsequentAttempts = int(float(os.getenv("TEXTTEST_QS_POLL_SUBSEQUENT_WAIT", "15")) / interval) # Amount of time to wait before subsequent polling of grid/cloud
-        if attempts >= 0:
-            while True:
-                for _ in range(attempts):
-                    time.sleep(interval)
-                    if self.allComplete:
-                        return
-                    if self.exited:
-                        break
+        # Start by polling after 5 seconds, then every 15, less often while nothing seems to be happening.
+        # Local jobs tell us when they exit, so we check those at once.
+        wait = float(os.getenv("TEXTTEST_QS_POLL_WAIT", "5"))  # Amount of time to wait before initiating polling of grid/cloud
+        subsequentWait = float(os.getenv("TEXTTEST_QS_POLL_SUBSEQUENT_WAIT", "15"))  # Amount of time to wait before subsequent polling of grid/cloud
+        maxWait = float(os.getenv("TEXTTEST_QS_POLL_MAX_WAIT", str(subsequentWait * 8)))  # Longest we back off to if nothing changes
+        if wait < 0:
+            return
+        while True:
+            woken = self.pollEvent.wait(wait)
+            self.pollEvent.clear()
+            if self.allComplete:
+                return
+            if woken:
                 if not self.exited:
-                    self.updateJobStatus()
-                attempts = subsequentAttempts
-                self.diag.info("Trying to rerun queues " + repr(self.testsSubmitted) +
-                               " out of " + repr(self.maxCapacity) + " tests submitted")
-                # In case any tests have had reruns triggered since we stopped submitting
-                self.runQueue(self.getTestForRun, self.runTest, "rerunning", block=False)
+                    self.updateJobStatus(self.takeExitedJobs())
+            else:
+                changed = not self.exited and self.updateJobStatus(minSilence=wait)
+                wait = subsequentWait if changed or self.takeSlaveActivity() else min(wait * 2, maxWait)
+                self.diag.info("Next poll of queue system in " + str(wait) + " seconds")
+            self.diag.info("Trying to rerun queues " + repr(self.testsSubmitted) +
+                           " out of " + repr(self.maxCapacity) + " tests submitted")
+            # In case any tests have had reruns triggered since we stopped submitting
+            self.runQueue(self.getTestForRun, self.runTest, "rerunning", block=False)
+
+    def jobExited(self, jobId):
+        with self.pollLock:
+            self.exitedJobs.add(jobId)
+        self.pollEvent.set()
+
+    def takeExitedJobs(self):
+        with self.pollLock:
+            exitedJobs, self.exitedJobs = self.exitedJobs, set()
+        return exitedJobs
+
+    def noteSlaveContact(self, test):
+        # Tests claimed in batches share their slave's job
+        contactTime = time.time()
+        for jobId, _ in self.getJobInfo(test):
+            self.slaveContactTimes[jobId] = contactTime
+        self.slaveActivity = True
+
+    def takeSlaveActivity(self):
+        activity, self.slaveActivity = self.slaveActivity, False
+        return activity
 
     def canPoll(self):
         queueSystem = self.getQueueSystem(list(self.jobs.keys())[0])
         return queueSystem.supportsPolling()
 
-    def updateJobStatus(self):
+    def findJobsToCheck(self, exitedJobIds, minSilence):
+        # Don't ask about the jobs we know about already: tests whose slaves have just been in touch
+        jobsToCheck = []
+        now = time.time()
+        for test, jobs in list(self.jobs.items()):
+            if not test.state.isComplete():
+                for jobId, jobName in jobs:
+                    recentContact = now - self.slaveContactTimes.get(jobId, 0) < minSilence
+                    if (jobId in exitedJobIds) if exitedJobIds is not None else not recentContact:
+                        jobsToCheck.append((test, jobId, jobName))
+        return jobsToCheck
+
+    def updateJobStatus(self, exitedJobIds=None, minSilence=0):
+        # Returns whether anything changed
+        jobsToCheck = self.findJobsToCheck(exitedJobIds, minSilence)
+        if not jobsToCheck:
+            self.diag.info("No jobs with unknown status, not asking the queue system")
+            return False
         queueSystem = self.getQueueSystem(list(self.jobs.keys())[0])
-        statusInfo = queueSystem.getStatusForAllJobs()
-        self.diag.info("Got status for all jobs : " + repr(statusInfo))
+        statusInfo = queueSystem.getStatusForJobs([jobId for _, jobId, _ in jobsToCheck])
+        self.diag.info("Got status for jobs : " + repr(statusInfo))
+        changed = False
         if statusInfo is not None:  # queue system not available for some reason
-            for test, jobs in list(self.jobs.items()):
+            failedJobs = []
+            for test, jobId, jobName in jobsToCheck:
                 if not test.state.isComplete():
-                    for jobId, jobName in jobs:
-                        status = statusInfo.get(jobId)
-                        if status:
-                            # Only do this to test jobs (might make a difference for derived configurations)
-                            # Ignore filtering states for now, which have empty 'briefText'.
-                            self.updateRunStatus(test, status)
-                        elif not status and not self.jobCompleted(test, jobName):
-                            # Do this to any jobs
-                            self.setSlaveFailed(test, self.jobStarted(test, jobName), True, jobId)
+                    status = statusInfo.get(jobId)
+                    if status:
+                        # Only do this to test jobs (might make a difference for derived configurations)
+                        # Ignore filtering states for now, which have empty 'briefText'.
+                        changed |= self.updateRunStatus(test, status)
+                    elif not self.jobCompleted(test, jobName):
+                        failedJobs.append((test, jobId, jobName))
+            # Give away anything the slaves were holding for later first, in case failing the others makes us terminate
+            redistributeJobs = [job for job in failedJobs if self.canRedistribute(*job)]
+            for test, jobId, _ in redistributeJobs:
+                self.redistributeTest(test, jobId)
+            for test, jobId, jobName in failedJobs:
+                if (test, jobId, jobName) not in redistributeJobs and not self.jobCompleted(test, jobName):
+                    # Do this to any jobs
+                    self.setSlaveFailed(test, self.jobStarted(test, jobName), True, jobId)
+            changed |= len(failedJobs) > 0
+        return changed
+
+    def canRedistribute(self, test, jobId, jobName):
+        return test in self.queuedOnSlaves and not self.jobStarted(test, jobName) and not self.exited
+
+    def redistributeTest(self, test, jobId):
+        self.queuedOnSlaves.discard(test)
+        self.redistributedTests.add(test)
+        plugins.log.info("Q: Resubmitting " + repr(test) + ", which was waiting for a slave job (" + jobId + ") that has gone")
+        self.queueTestForRerun(test)
 
     def updateRunStatus(self, test, status):
         newRunStatus, newExplanation = status
         newState = test.state.makeModifiedState(newRunStatus, newExplanation, "grid status update")
         if newState:
             test.changeState(newState)
+        return newState is not None
 
     def findQueueForTest(self, test):
         # If we've gone into reuse mode and there are no active tests for reuse, use the "reuse failure queue"
@@ -235,31 +310,24 @@ class QueueSystemServer(BaseActionRunner):
                 postText = ": submitting terminators as final test" # Don't allow test count to drop to 0 here, can cause race conditions
         self.diag.info("Reusing slave from " + test.uniqueName + " for " + newTest.uniqueName + postText)
 
-    def getTestForReuse(self, test, state, tryReuse, doneRerun):
-        # Pick up any test that matches the current one's resource requirements
+    def getTestsForReuse(self, test, state, tryReuse, doneRerun, claimCount=1):
+        # Pick up any tests that match the current one's resource requirements
         if not self.exited:
             if test in self.reusedTests:
-                newTest = self.reusedTests.get(test)
-                newTestName = newTest.uniqueName if newTest else " no test."
-                self.diag.info("Repeating answer: using slave from " + test.uniqueName + " for " + newTestName)
-                if newTest:
-                    self.markTestReuse(test, newTest)
-                    return newTest
+                newTests = self.reusedTests.get(test)
+                newTestNames = ", ".join((newTest.uniqueName for newTest in newTests)) if newTests else " no test."
+                self.diag.info("Repeating answer: using slave from " + test.uniqueName + " for " + newTestNames)
+                if newTests:
+                    self.markTestsReuse(test, newTests)
+                    return newTests
             else:
-                # Don't allow this to use up the terminator
-                newTest = self.getTest(block=False, replaceTerminators=True)
-                if newTest:
-                    if tryReuse and self.allowReuse(test, state, newTest):
-                        if not doneRerun:
-                            self.reusedTests[test] = newTest
-                        self.markTestReuse(test, newTest)
-                        return newTest
-                    else:
-                        self.diag.info("Adding to reuse failure queue : " + newTest.uniqueName)
-                        self.reuseFailureQueue.put(newTest)
-                else:
-                    self.diag.info("No tests available for reuse : " + test.uniqueName)
-                self.reusedTests[test] = None
+                newTests = self.findTestsForReuse(test, state, tryReuse, claimCount)
+                if newTests:
+                    if not doneRerun:
+                        self.reusedTests[test] = newTests
+                    self.markTestsReuse(test, newTests)
+                    return newTests
+                self.reusedTests[test] = []
 
         # Allowed a submitted job to terminate
         with self.counterLock:
@@ -269,6 +337,38 @@ class QueueSystemServer(BaseActionRunner):
             if self.exited and self.testsSubmitted == 0:
                 self.diag.info("Forcing termination")
                 self.submitTerminators()
+        return []
+
+    def findTestsForReuse(self, test, state, tryReuse, claimCount):
+        newTests = []
+        batchSize = self.getBatchSize(claimCount)
+        while len(newTests) < batchSize:
+            # Don't allow this to use up the terminator
+            newTest = self.getTest(block=False, replaceTerminators=True)
+            if not newTest:
+                self.diag.info("No more tests available for reuse : " + test.uniqueName)
+                break
+            elif tryReuse and self.allowReuse(test, state, newTest):
+                newTests.append(newTest)
+            else:
+                self.diag.info("Adding to reuse failure queue : " + newTest.uniqueName)
+                self.reuseFailureQueue.put(newTest)
+                break
+        return newTests
+
+    def getBatchSize(self, claimCount):
+        # Slaves can claim several tests at once. Make sure there are enough left for all the slaves we can submit,
+        # so we don't end up waiting for one slave with a long list of tests at the end
+        with self.counterLock:
+            slaveCount = max(self.testsSubmitted, min(self.maxCapacity, self.testCount), 1)
+            return max(1, min(claimCount, self.testCount // slaveCount))
+
+    def markTestsReuse(self, test, newTests):
+        for newTest in newTests:
+            self.markTestReuse(test, newTest)
+        # Any beyond the first wait on the slave until it's finished the others.
+        # Only give those away once if the slave goes, in case it's the test itself that's killing them
+        self.queuedOnSlaves.update((newTest for newTest in newTests[1:] if newTest not in self.redistributedTests))
 
     def allowReuse(self, oldTest, oldState, newTest):
         # Don't reuse jobs that have been killed
@@ -361,8 +461,13 @@ class QueueSystemServer(BaseActionRunner):
     def reuseCanFail(self):
         return any((not qs.slavesOnRemoteSystem() for qs in list(self.queueSystems.values())))
 
+    def notifyKillProcesses(self, *args):
+        BaseActionRunner.notifyKillProcesses(self, *args)
+        self.pollEvent.set()
+
     def notifyAllComplete(self):
         BaseActionRunner.notifyAllComplete(self)
+        self.pollEvent.set()
         self.cleanup(final=True)
         if self.reuseOnly: # could still be hanging waiting for this, make sure we terminate
             self.submitTerminators()
@@ -401,23 +506,65 @@ class QueueSystemServer(BaseActionRunner):
 
     def runTest(self, test):
         submissionRules = self.getSubmissionRules(test)
-        commandArgs = self.getSlaveCommandArgs(test, submissionRules)
-        plugins.log.info("Q: Submitting " + repr(test) + submissionRules.getSubmitSuffix())
+        tests = [test] + self.findTestsForArray(test)
+        for currTest in tests:
+            plugins.log.info("Q: Submitting " + repr(currTest) + self.getSubmissionRules(currTest).getSubmitSuffix())
+            self.jobs[currTest] = []  # Preliminary jobs aren't interesting any more
         sys.stdout.flush()
-        self.jobs[test] = []  # Preliminary jobs aren't interesting any more
         slaveEnv = OrderedDict()
-        if not self.submitJob(test, submissionRules, commandArgs, slaveEnv):
-            return
+        if len(tests) > 1:
+            submittedTests = self.submitArrayJob(tests, submissionRules, slaveEnv)
+        else:
+            commandArgs = self.getSlaveCommandArgs(test, submissionRules)
+            submittedTests = tests if self.submitJob(test, submissionRules, commandArgs, slaveEnv) else []
 
-        with self.counterLock:
-            self.testCount -= 1
-            self.testsSubmitted += 1
-            self.diag.info("Submission successful" + self.remainStr())
-        if not test.state.hasStarted():
-            test.changeState(self.getPendingState(test))
-        if self.testsSubmitted == self.maxCapacity:
+        for submittedTest in submittedTests:
+            with self.counterLock:
+                self.testCount -= 1
+                self.testsSubmitted += 1
+                self.diag.info("Submission successful" + self.remainStr())
+            if not submittedTest.state.hasStarted():
+                submittedTest.changeState(self.getPendingState(submittedTest))
+        if submittedTests and self.testsSubmitted == self.maxCapacity:
             self.sendServerState("Completed submission of tests up to capacity")
 
+    def findTestsForArray(self, test):
+        # Grid engines throttle lots of separate submissions, so send whatever else is waiting along with this test
+        if not self.canSubmitArray(test):
+            return []
+        with self.counterLock:
+            arraySize = min(test.getConfigValue("queue_system_max_array_size"), self.maxCapacity - self.testsSubmitted)
+        arrayKey = self.getArrayKey(test)
+        newTests = []
+        while len(newTests) + 1 < arraySize:
+            # Don't allow this to use up the terminator
+            newTest = self.getTest(block=False, replaceTerminators=True)
+            if not newTest:
+                break
+            elif newTest.state.isComplete():
+                continue
+            elif self.canSubmitArray(newTest) and self.getArrayKey(newTest) == arrayKey:
+                newTests.append(newTest)
+            else:
+                # Submitted next time round, in its own array
+                self.diag.info("Not adding " + newTest.uniqueName + " to array job with " + test.uniqueName)
+                self.reuseFailureQueue.put(newTest)
+                break
+        return newTests
+
+    def canSubmitArray(self, test):
+        # Self-diagnostics and proxies need a different command for each test
+        return self.getQueueSystem(test).supportsArrayJobs() and "xs" not in self.optionMap and \
+            not test.getConfigValue("queue_system_proxy_executable")
+
+    def getArrayKey(self, test):
+        # Tests can share an array job if they would be submitted the same way
+        submissionRules = self.getSubmissionRules(test)
+        return submissionRules.processesNeeded, submissionRules.findQueue(), submissionRules.findPriority(), \
+            sorted(submissionRules.findResourceList()), submissionRules.findMachineList(), \
+            submissionRules.getExtraSubmitArgs(), test.getConfigValue("queue_system_environment"), \
+            self.getSlaveCommandArgs(test, submissionRules, selectArgs=[])
+
     def fixConfigEnv(self, env, test):
         for envVar in test.getConfigValue("queue_system_environment"):
             val = os.getenv(envVar)
@@ -431,14 +578,15 @@ class QueueSystemServer(BaseActionRunner):
     def getPendingState(self, test):
         return Pending(freeText="Job pending in " + queueSystemName(test.app))
 
-    def getSlaveCommandArgs(self, test, submissionRules):
+    def getSlaveCommandArgs(self, test, submissionRules, selectArgs=None):
         queueSystem = self.getQueueSystem(test)
         args = queueSystem.getTextTestArgs()
         if queueSystem.slavesOnRemoteSystem():
             args += ["-home", os.path.expanduser("~")]
+        if selectArgs is None:
+            selectArgs = ["-tp", test.getRelPath()]
         return args + ["-d", ":".join(self.optionMap.rootDirectories),
-                       "-a", test.app.name + test.app.versionSuffix(),
-                       "-l", "-tp", test.getRelPath()] + \
+                       "-a", test.app.name + test.app.versionSuffix(), "-l"] + selectArgs + \
             self.getSlaveArgs(test) + self.getRunOptions(test.app, submissionRules)
 
     def getSlaveArgs(self, test):
@@ -554,6 +702,47 @@ class QueueSystemServer(BaseActionRunner):
                 self.handleErrorState(test)
                 return False
 
+    def submitArrayJob(self, tests, submissionRules, slaveEnv):
+        test = tests[0]
+        self.fixConfigEnv(slaveEnv, test)
+        queueSystem = self.getQueueSystem(test)
+        queueSystem.prepareEnvForSubmit(slaveEnv)
+        # Each slave finds its test in this file, using its task number. Pending tasks may still need earlier ones
+        self.arrayJobCount += 1
+        logDir = self.getSlaveLogDir(test)
+        taskFile = os.path.join(logDir, "Array-" + str(self.arrayJobCount) + ".tasks")
+        with open(taskFile, "w") as f:
+            f.write("".join((currTest.getRelPath() + "\n" for currTest in tests)))
+        commandArgs = self.getSlaveCommandArgs(test, submissionRules, selectArgs=["-arraytasks", taskFile])
+        cmdArgs = self.getSubmitCmdArgs(test, submissionRules, commandArgs, slaveEnv)
+        self.diag.info("Creating array job for " + str(len(tests)) + " tests with command arguments : " + " ".join(cmdArgs))
+        with self.lock:
+            if self.exited:
+                for currTest in tests:
+                    self.cancel(currTest)
+                    plugins.log.info("Q: Submission cancelled for " + repr(currTest) + " - exit underway")
+                return []
+
+            self.lockDiag.info("Got lock for array submission")
+            taskIds, errorMessage = queueSystem.submitSlaveArrayJob(cmdArgs, len(tests), slaveEnv, logDir, submissionRules, "")
+            if taskIds is not None:
+                self.diag.info("Array job created with task ids " + repr(taskIds))
+                arrayJobName = submissionRules.getJobName()
+                for taskIndex, (currTest, taskId) in enumerate(zip(tests, taskIds)):
+                    jobName = self.getSubmissionRules(currTest).getJobName()
+                    self.jobs.setdefault(currTest, []).append((taskId, jobName))
+                    taskJobName = queueSystem.getArrayTaskJobName(arrayJobName, taskIndex)
+                    if taskJobName:
+                        self.arrayTaskJobNames[taskId] = taskJobName
+                self.lockDiag.info("Releasing lock for array submission...")
+                return tests
+            else:
+                self.diag.info("Array job not created : " + errorMessage)
+                for currTest in tests:
+                    currTest.changeState(plugins.Unrunnable(errorMessage, "NOT SUBMITTED"))
+                    self.handleErrorState(currTest)
+                return []
+
     def checkQueueCapacity(self, queueSystem):
         queueCapacity = queueSystem.getCapacity()
         if queueCapacity:
@@ -594,8 +783,9 @@ class QueueSystemServer(BaseActionRunner):
 
     def getErrorJobNames(self, test, name):
         jobNames = []
-        for _, jobName in self.getJobInfo(test):
-            jobNames.append((jobName, name))
+        for jobId, jobName in self.getJobInfo(test):
+            # Array tasks may write their errors under the array's name
+            jobNames.append((self.arrayTaskJobNames.get(jobId, jobName), name))
             if jobName.startswith("Test-"):
                 jobNames.append(("Proxy-" + jobName[5:], name + " Proxy"))
         return jobNames
@@ -636,6 +826,7 @@ class QueueSystemServer(BaseActionRunner):
         command = "from ." + queueModule + " import QueueSystem as _QueueSystem"
         exec(command, globals(), namespace)
         system = namespace["_QueueSystem"](test)
+        system.setJobExitCallback(self.jobExited)
         self.queueSystems[queueModule] = system
         return system
 
@@ -952,21 +1143,27 @@ class TestSubmissionRules(SubmissionRules):
                 self.processesNeeded == newRules.processesNeeded
 
 
-class SlaveRequestHandler(StreamRequestHandler):
+class SlaveRequestHandler:
+    """ Handles one complete message from a slave, run in the slave server's worker pool """
+    def __init__(self, rfile, clientAddress, server):
+        self.rfile = rfile
+        self.wfile = io.BytesIO()
+        self.clientAddress = clientAddress
+        self.server = server
+
     def handle(self):
         identifier = str(self.rfile.readline().strip(), getpreferredencoding())
-        if identifier == "TERMINATE_SERVER":
-            return
-
-        self.handleMessage(identifier)
+        if identifier:
+            self.handleMessage(identifier)
+        return self.wfile.getvalue()
 
     def handleMessage(self, identifier):
         # Don't use port, it changes all the time
-        identifier, sendFiles, getFiles, tryReuse, rerun = parseIdentifier(identifier)
+        identifier, sendFiles, getFiles, tryReuse, rerun, claimCount = parseIdentifier(identifier)
         testString = str(self.rfile.readline().strip(), getpreferredencoding())
         test = self.server.getTest(testString)
         if test is None:
-            clientHost = self.client_address[0]
+            clientHost = self.clientAddress[0]
             sys.stderr.write("WARNING: Received request from hostname " + self.getHostName(clientHost) +
                              " (process " + identifier + ")\nwhich could not be parsed:\n'" + testString + "'\n")
         elif getFiles:
@@ -977,15 +1174,10 @@ class SlaveRequestHandler(StreamRequestHandler):
                                       " - receiving files sent from slave to sandbox directory")
                 directoryUnserialise(test.writeDirectory, self.rfile)
             # Don't use port, it changes all the time
-            self.handleRequestFromHost(test, identifier, tryReuse, rerun)
+            self.handleRequestFromHost(test, identifier, tryReuse, rerun, claimCount)
         else:
             self.server.diag.info("Test " + test.uniqueName + " already complete, ignoring new results")
-            self.sendReuseResponse(test, test.state, tryReuse, False)
-        try:
-            self.connection.shutdown(socket.SHUT_RDWR)
-        except socket.error:
-            # This only occurs on a mac, and doesn't affect functionality.
-            pass
+            self.sendReuseResponse(test, test.state, tryReuse, False, claimCount)
 
     def getHostName(self, ipAddress):
         try:
@@ -1001,39 +1193,116 @@ class SlaveRequestHandler(StreamRequestHandler):
             paths.append(str(line.strip(), encoding))
         self.server.pushFiles(test, userAndHost, paths)
 
-    def sendReuseResponse(self, *args):
-        newTest = QueueSystemServer.instance.getTestForReuse(*args)
-        if newTest:
-            response = socketSerialise(newTest)
+    def sendReuseResponse(self, test, state, tryReuse, doneRerun, claimCount):
+        if claimCount == 0:
+            self.server.diag.info("Slave for " + test.uniqueName + " still has tests to run, not sending any more")
+            return
+        newTests = QueueSystemServer.instance.getTestsForReuse(test, state, tryReuse, doneRerun, claimCount)
+        if newTests:
+            response = "\n".join(map(socketSerialise, newTests))
             self.server.diag.info("Sending reuse response " + response)
             self.wfile.write(response.encode(getpreferredencoding()))
 
-    def handleRequestFromHost(self, test, pid, tryReuse, rerun):
+    def handleRequestFromHost(self, test, pid, tryReuse, rerun, claimCount):
         # The updates are only for testing against old slave traffic,
         # a bit sad we can't disable them when not testing...
+        QueueSystemServer.instance.noteSlaveContact(test)
         _, state = test.getNewState(self.rfile, updatePaths=True)
         if test.state.isComplete():
             state.lifecycleChange = "recalculated"
         doneRerun = self.server.changeStateOrRerun(test, state, rerun)
-        try:
-            self.connection.shutdown(socket.SHUT_RD)
-        except socket.error:
-            # This only occurs on a mac, and doesn't affect functionality.
-            pass
         if state.isComplete():
-            self.sendReuseResponse(test, state, tryReuse, doneRerun)
+            self.sendReuseResponse(test, state, tryReuse, doneRerun, claimCount)
         else:
             QueueSystemServer.instance.setRemoteProcessId(test, pid)
 
 
-class SlaveServerResponder(plugins.Responder, ThreadingTCPServer):
+class SlaveConnection:
+    """ Reads messages from one slave connection as data arrives, and holds what is still to be written back """
+    # Bigger messages, i.e. ones with files in, are spooled to disk
+    maxMessageMemory = 1024 * 1024
+
+    def __init__(self, sock, address):
+        self.socket = sock
+        self.address = address
+        self.persistent = None  # don't know until we see the first line
+        self.firstLine = bytearray()
+        self.splitter = MessageSplitter(self.newMessage)
+        self.message = None
+        self.completeMessages = deque()
+        self.busy = False
+        self.outBuffer = bytearray()
+        self.closeAfterWrite = False
+
+    def newMessage(self):
+        return SpooledTemporaryFile(self.maxMessageMemory)
+
+    def dataReceived(self, data):
+        if self.persistent is None:
+            self.firstLine += data
+            pos = self.firstLine.find(b"\n")
+            if pos == -1:
+                return
+            data = self.firstLine[pos + 1:]
+            if self.firstLine[:pos].strip() == connectionText.encode():
+                self.persistent = True
+            else:
+                # One message per connection, ended when they close their side, as sent by older slaves
+                self.persistent = False
+                self.message = self.newMessage()
+                data = self.firstLine
+            self.firstLine = None
+        if self.persistent:
+            self.completeMessages.extend(self.splitter.feed(data))
+        else:
+            self.message.write(data)
+
+    def connectionClosed(self):
+        # Returns whether there is anything left to answer
+        if self.persistent is False:
+            self.completeMessages.append(self.message)
+            self.message = None
+            self.closeAfterWrite = True
+            return True
+        return False
+
+    def addResponse(self, response):
+        if self.persistent:
+            self.outBuffer += packResponse(response)
+        else:
+            self.closeAfterWrite = True
+            self.outBuffer += response
+        self.busy = False
+
+    def writeData(self):
+        sent = self.socket.send(self.outBuffer)
+        del self.outBuffer[:sent]
+        return len(self.outBuffer) == 0
+
+
+class SlaveServerResponder(plugins.Responder):
     # Python's default value of 5 isn't very much...
     # There doesn't seem to be any disadvantage of allowing a longer queue, so we will use the system's maximum size
-    request_queue_size = socket.SOMAXCONN
+    requestQueueSize = socket.SOMAXCONN
+    # All connections are served by one thread, the work on each message is done by a limited number of others
+    workerCount = min(32, (os.cpu_count() or 1) + 4)
 
     def __init__(self, optionMap, allApps):
         plugins.Responder.__init__(self)
-        ThreadingTCPServer.__init__(self, (getIPAddress(allApps), 0), self.handlerClass())
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.bind((getIPAddress(allApps), 0))
+        self.socket.listen(self.requestQueueSize)
+        self.socket.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.socket, selectors.EVENT_READ)
+        # Worker threads hand back responses through here, and wake us up with the socket pair
+        self.responseQueue = Queue()
+        self.wakeReader, self.wakeWriter = socket.socketpair()
+        self.wakeReader.setblocking(False)
+        self.wakeWriter.setblocking(False)
+        self.selector.register(self.wakeReader, selectors.EVENT_READ)
+        self.workers = ThreadPoolExecutor(self.workerCount, thread_name_prefix="SlaveServerWorker")
+        self.connections = {}
         self.testMap = {}
         self.testLocks = {}
         self.filePushLock = Lock()
@@ -1066,16 +1335,143 @@ class SlaveServerResponder(plugins.Responder, ThreadingTCPServer):
         return False  # We wait for sockets and stuff
 
     def run(self):
-        while not self.terminate:
-            self.diag.info("Waiting for a new request...")
+        while not self.readyToTerminate():
             try:
-                self.handle_request()
+                for key, events in self.selector.select():
+                    self.handleEvent(key.fileobj, events)
             except:
                 # e.g. can get interrupted system call here in 'select' if we get a signal
                 sys.stderr.write("WARNING: slave server caught exception while processing request!\n")
                 plugins.printException()
 
         self.diag.info("Terminating slave server")
+        for connection in list(self.connections.values()):
+            self.closeConnection(connection)
+        self.selector.close()
+        self.socket.close()
+        self.workers.shutdown(wait=False)
+
+    def readyToTerminate(self):
+        # Answer anything already being worked on first, the slaves are waiting for it
+        return self.terminate and not any((conn.busy or conn.outBuffer for conn in self.connections.values()))
+
+    def handleEvent(self, sock, events):
+        if sock is self.socket:
+            self.acceptConnections()
+        elif sock is self.wakeReader:
+            self.handleResponses()
+        else:
+            connection = self.connections.get(sock)
+            if connection is None:
+                return
+            if events & selectors.EVENT_WRITE:
+                self.writeToConnection(connection)
+            if events & selectors.EVENT_READ and connection.socket in self.connections:
+                self.readFromConnection(connection)
+
+    def acceptConnections(self):
+        while True:
+            try:
+                sock, address = self.socket.accept()
+            except BlockingIOError:
+                return
+            sock.setblocking(False)
+            self.connections[sock] = SlaveConnection(sock, address)
+            self.selector.register(sock, selectors.EVENT_READ)
+
+    def readFromConnection(self, connection):
+        try:
+            data = connection.socket.recv(chunkSize)
+        except BlockingIOError:
+            return
+        except socket.error as e:
+            self.diag.info("Lost connection to slave at " + connection.address[0] + " : " + str(e))
+            return self.closeConnection(connection)
+        if data:
+            connection.dataReceived(data)
+            self.dispatchMessages(connection)
+        elif connection.connectionClosed():
+            self.watchConnection(connection, 0)
+            self.dispatchMessages(connection)
+        else:
+            self.closeConnection(connection)
+
+    def dispatchMessages(self, connection):
+        # Slaves wait for each answer before sending more, but don't rely on it
+        if connection.busy or not connection.completeMessages:
+            return
+        message = connection.completeMessages.popleft()
+        if message.tell() == 0:
+            # Empty messages are heartbeats
+            self.queueResponse(connection, b"")
+        else:
+            connection.busy = True
+            self.workers.submit(self.handleMessage, connection, message)
+
+    def handleMessage(self, connection, message):
+        response = b""
+        try:
+            message.seek(0)
+            handler = self.handlerClass()(message, connection.address, self)
+            response = handler.handle()
+        except:
+            sys.stderr.write("WARNING: slave server caught exception while processing request!\n")
+            plugins.printException()
+        finally:
+            message.close()
+            self.responseQueue.put((connection, response))
+            self.wakeUp()
+
+    def wakeUp(self):
+        try:
+            self.wakeWriter.send(b"x")
+        except BlockingIOError:
+            pass  # plenty of wakeups already waiting
+
+    def handleResponses(self):
+        try:
+            while self.wakeReader.recv(chunkSize):
+                pass
+        except BlockingIOError:
+            pass
+        while not self.responseQueue.empty():
+            connection, response = self.responseQueue.get()
+            self.queueResponse(connection, response)
+
+    def queueResponse(self, connection, response):
+        connection.addResponse(response)
+        if connection.socket in self.connections:
+            self.watchConnection(connection, selectors.EVENT_WRITE)
+
+    def writeToConnection(self, connection):
+        try:
+            finished = connection.writeData()
+        except BlockingIOError:
+            return
+        except socket.error as e:
+            self.diag.info("Lost connection to slave at " + connection.address[0] + " : " + str(e))
+            return self.closeConnection(connection)
+        if finished:
+            if connection.closeAfterWrite:
+                self.closeConnection(connection)
+            else:
+                self.watchConnection(connection, selectors.EVENT_READ)
+                self.dispatchMessages(connection)
+
+    def watchConnection(self, connection, events):
+        try:
+            if events:
+                self.selector.modify(connection.socket, events)
+            else:
+                self.selector.unregister(connection.socket)
+        except KeyError:
+            if events:
+                self.selector.register(connection.socket, events)
+
+    def closeConnection(self, connection):
+        if self.connections.pop(connection.socket, None) is not None:
+            self.watchConnection(connection, 0)
+            connection.socket.close()
 
     def notifyAllRead(self, *args):
         if len(self.testMap) == 0:
@@ -1084,10 +1480,7 @@ class SlaveServerResponder(plugins.Responder, ThreadingTCPServer):
     def notifyAllComplete(self):
         self.diag.info("Notified all complete, shutting down soon...")
         self.terminate = True
-        sendSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sendSocket.connect(self.socket.getsockname())
-        sendSocket.sendall("TERMINATE_SERVER\n".encode(getpreferredencoding()))
-        sendSocket.close()
+        self.wakeUp()
 
     def getAddress(self):
         host, port = self.socket.getsockname()
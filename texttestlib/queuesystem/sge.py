@@ -67,6 +67,23 @@ class QueueSystem(gridqueuesystem.QueueSystem):
         qsubArgs += ["-o", os.devnull, "-e", self.getSlaveStartErrorFile()]
         return self.addExtraAndCommand(qsubArgs, submissionRules, commandArgs)
 
+    def supportsArrayJobs(self):
+        return True
+
+    def getArraySubmitCmdArgs(self, cmdArgs, taskCount):
+        return cmdArgs[:1] + ["-t", "1-" + str(taskCount)] + cmdArgs[1:]
+
+    def getArrayTaskIds(self, jobId, taskCount):
+        return [jobId + "." + str(taskId) for taskId in range(1, taskCount + 1)]
+
+    def getJobIdArgs(self, jobId):
+        # Array tasks are identified as <job>.<task>, which qstat -j and qacct don't understand
+        if "." in jobId:
+            arrayJobId, taskId = jobId.split(".")
+            return [arrayJobId, "-t", taskId]
+        else:
+            return [jobId]
+
     def getResourceArg(self, submissionRules):
         resourceList = submissionRules.findResourceList()
         machines = submissionRules.findMachineList()
@@ -93,7 +110,8 @@ class QueueSystem(gridqueuesystem.QueueSystem):
                                 "'\nError message from SGE follows:\n" + output)
 
     def getJobId(self, line):
-        return line.split()[2]
+        # Array jobs are reported as <job>.<task range>
+        return line.split()[2].split(".")[0]
 
     def findJobId(self, stdout):
         jobId = ""
@@ -115,21 +133,60 @@ class QueueSystem(gridqueuesystem.QueueSystem):
         for line in outMsg.splitlines():
             words = line.split()
             if len(words) >= 5 and words[0].isdigit():
-                jobId = words[0]
                 statusLetter = self.getStatusLetter(words, 4)
                 if statusLetter in self.errorStatuses:
-                    self.errorReasons[jobId] = self.getErrorReason(jobId)
-                    self.killJob(jobId)
+                    self.deleteErrorJobs(words)
                     continue
 
-                status = self.allStatuses.get(statusLetter)
-                if status:
-                    statusDict[jobId] = status
-                else:
-                    log.info("WARNING: unexpected job status " + repr(statusLetter) + " received from SGE!")
-                    statusDict[jobId] = statusLetter, statusLetter
+                for jobId in self.getJobIds(words):
+                    status = self.allStatuses.get(statusLetter)
+                    if status:
+                        statusDict[jobId] = status
+                    else:
+                        log.info("WARNING: unexpected job status " + repr(statusLetter) + " received from SGE!")
+                        statusDict[jobId] = statusLetter, statusLetter
         return statusDict
 
+    def deleteErrorJobs(self, words):
+        # A whole array, or a range of its tasks, is reported on one line: ask about it and delete it once, not per task
+        errorReason = self.getErrorReason(words[0])
+        for jobId in self.getJobIds(words):
+            self.errorReasons[jobId] = errorReason
+        taskRange = self.getTaskRange(words)
+        if taskRange:
+            for part in taskRange.split(","):
+                self.killJob(words[0] + "." + part)
+        else:
+            self.killJob(words[0])
+
+    def getJobIds(self, words):
+        taskRange = self.getTaskRange(words)
+        if taskRange:
+            return [words[0] + "." + str(taskId) for taskId in self.expandTaskRange(taskRange)]
+        else:
+            return [words[0]]
+
+    def getTaskRange(self, words):
+        # After the submit/start time come the queue (if running), the slots, and the array task IDs (if any)
+        dateIndex = 5
+        while dateIndex < len(words) and not self.isDate(words[dateIndex]):
+            dateIndex += 1
+        remaining = [word for word in words[dateIndex + 2:] if "@" not in word]
+        if len(remaining) >= 2:
+            return remaining[-1]
+
+    def expandTaskRange(self, taskRange):
+        # e.g. 1-10:1 or 3,5 for pending tasks, just a number for running ones
+        taskIds = []
+        for part in taskRange.split(","):
+            if "-" in part:
+                rangeText, _, step = part.partition(":")
+                first, last = rangeText.split("-")
+                taskIds += list(range(int(first), int(last) + 1, int(step or 1)))
+            else:
+                taskIds.append(int(part))
+        return taskIds
+
     def isDate(self, text):
         return len(text) == 10 and text.count("/") == 2
 
@@ -140,7 +197,7 @@ class QueueSystem(gridqueuesystem.QueueSystem):
             return self.getStatusLetter(words, statusIndex + 1)
 
     def getErrorReason(self, jobId):
-        proc = subprocess.Popen(["qstat", "-j", jobId], stdin=open(os.devnull), encoding=getpreferredencoding(),
+        proc = subprocess.Popen(["qstat", "-j", jobId.split(".")[0]], stdin=open(os.devnull), encoding=getpreferredencoding(),
                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         outMsg = proc.communicate()[0]
         for line in outMsg.splitlines():
@@ -182,10 +239,11 @@ class QueueSystem(gridqueuesystem.QueueSystem):
             return "Could not find info about job: " + jobId + "\nqacct error was as follows:\n" + acctError
 
     def getAccountInfo(self, jobId, extraArgs=[]):
-        cmdArgs = ["qacct", "-j", jobId] + extraArgs
+        jobIdArgs = self.getJobIdArgs(jobId)
+        cmdArgs = ["qacct", "-j"] + jobIdArgs + extraArgs
         proc = subprocess.Popen(cmdArgs, stdin=open(os.devnull), stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding=getpreferredencoding())
         outMsg, errMsg = proc.communicate()
-        notFoundMsg = "error: job id " + jobId + " not found"
+        notFoundMsg = "error: job id " + jobIdArgs[0] + " not found"
         if len(errMsg) == 0 or notFoundMsg not in errMsg:
             return outMsg, errMsg
         else:
@@ -272,6 +330,12 @@ def getUserSignalKillInfo(userSignalNumber, explicitKillMethod):
     else:
         return explicitKillMethod()
 
+# Used by slave to find which test it should run, when submitted as part of an array job
+
+
+def getArrayTaskIndex():
+    return int(os.getenv("SGE_TASK_ID")) - 1
+
 # Used by slave to find all execution machines
 
 
@@ -9,6 +9,8 @@ import time
 import socket
 import signal
 import logging
+from threading import Thread, Lock
+from collections import deque
 from .utils import *
 from texttestlib import plugins
 from texttestlib.default.runtest import RunTest
@@ -24,6 +26,12 @@ def importAndCallFromQueueSystem(app, *args):
     return plugins.importAndCall(moduleName, *args)
 
 
+def getArrayTaskTestPath(app, taskFile):
+    taskIndex = importAndCallFromQueueSystem(app, "getArrayTaskIndex")
+    with open(taskFile) as f:
+        return f.read().splitlines()[taskIndex]
+
+
 # Use a non-monitoring runTest, but the rest from unix
 class RunTestInSlave(RunTest):
     def getBriefText(self, execMachines):
@@ -69,6 +77,8 @@ class RedirectLogResponder(plugins.Responder):
 
 class SocketResponder(plugins.Responder, plugins.Observable):
     synchFiles = False
+    heartbeatInterval = 20
+    maxClaimCount = 100
 
     def __init__(self, optionMap, *args):
         plugins.Responder.__init__(self)
@@ -77,6 +87,14 @@ class SocketResponder(plugins.Responder, plugins.Observable):
         self.transferAll = optionMap.get("keepslave") or optionMap.get("keeptmp")
         self.testsForRerun = []
         self.serverAddress = self.getServerAddress(optionMap)
+        self.connection = None
+        self.connectionFiles = None
+        self.connectionLock = Lock()
+        self.lastMessageTime = time.time()
+        self.heartbeatThread = None
+        self.testsClaimed = 0
+        self.recentDurations = deque(maxlen=10)
+        self.lastCompleteTime = None
 
     def getServerAddress(self, optionMap):
         servAddrStr = optionMap.get("servaddr", os.getenv("CAPTUREMOCK_SERVER"))
@@ -105,65 +123,133 @@ class SocketResponder(plugins.Responder, plugins.Observable):
     def notifyKillProcesses(self, *args):
         self.killed = True
 
-    def getProcessIdentifier(self, test, sendFiles):
+    def getProcessIdentifier(self, test, sendFiles, claimCount):
         identifier = str(os.getpid())
         rerun = test in self.testsForRerun
         if rerun:
             self.testsForRerun.remove(test)
-        return makeIdentifierLine(identifier, sendFiles, False, self.killed, rerun)
+        return makeIdentifierLine(identifier, sendFiles, False, self.killed, rerun, claimCount)
+
+    def getClaimCount(self, test):
+        # Once we've run all the tests we were given, ask for as many as we think we can run in the configured time
+        now = time.time()
+        if self.lastCompleteTime is not None:
+            self.recentDurations.append(now - self.lastCompleteTime)
+        self.lastCompleteTime = now
+        if self.testsClaimed > 0:
+            self.testsClaimed -= 1
+            if self.testsClaimed > 0:
+                return 0
+        batchTime = test.getConfigValue("queue_system_batch_time")
+        if not batchTime or not self.recentDurations:
+            return 1
+        averageDuration = sum(self.recentDurations) / len(self.recentDurations)
+        return max(1, min(self.maxClaimCount, int(batchTime / averageDuration)))
 
     def notifyRerun(self, test):
         self.testsForRerun.append(test)
 
     def notifyLifecycleChange(self, test, state, changeDesc):
         testData = socketSerialise(test)
-        protocol = int(os.getenv("TEXTTEST_PICKLE_PROTOCOL", 2)) # Which pickle protocol to use. Useful to set to plain text for self-tests.
-        pickleData = dumps(state, protocol=protocol)
+        protocol = os.getenv("TEXTTEST_PICKLE_PROTOCOL") # Send a plain pickle with this protocol instead. Useful to set to plain text for self-tests.
+        pickleData = dumps(state, protocol=int(protocol)) if protocol else plugins.serialiseTestState(state)
         sendFiles = self.synchFiles and changeDesc == "complete" and (self.transferAll or not test.state.hasSucceeded())
-        fullData = self.getProcessIdentifier(test, sendFiles) + os.linesep + testData + os.linesep
+        claimCount = self.getClaimCount(test) if changeDesc == "complete" else 1
+        headerData = (self.getProcessIdentifier(test, sendFiles, claimCount) + os.linesep + testData + os.linesep).encode(getpreferredencoding())
         if sendFiles:
-            fullData += directorySerialise(test.writeDirectory) + os.linesep
-        fullDataBytes = fullData.encode(getpreferredencoding()) + pickleData
-        return self.sendAndInterpret(fullDataBytes, self.interpretResponse, state)
+            # Stream the files, reading them again if we have to retry
+            def getFullData():
+                yield headerData
+                yield from directorySerialise(test.writeDirectory)
+                yield pickleData
+            return self.sendAndInterpret(getFullData, self.interpretResponse, state)
+        else:
+            return self.sendAndInterpret(headerData + pickleData, self.interpretResponse, state)
 
     def sendAndInterpret(self, fullData, responseMethod, *args):
         sleepTime = 1
         for _ in range(9):
-            sendSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            if not self.connect(sendSocket):
-                return self.notify("NoMoreExtraTests")
-            try:
-                response = self.sendData(sendSocket, fullData)
+            with self.connectionLock:
+                reused = self.connection is not None
+                if not self.getConnection():
+                    return self.notify("NoMoreExtraTests")
+                try:
+                    response = self.sendData(fullData)
+                    error = None
+                except (socket.error, EOFError) as e:
+                    self.closeConnection()
+                    error = e
+            if error is None:
                 return responseMethod(response, *args) if responseMethod else True
-            except socket.error as e:
-                plugins.log.info("Failed to communicate with master process - waiting " +
-                                 str(sleepTime) + " seconds and then trying again.")
-                plugins.log.info("Error received was " + str(e))
-                time.sleep(sleepTime)
-                sleepTime *= 2
+            elif reused:
+                # Probably the master or something in between closed it while we were idle, reconnect straight away
+                plugins.log.info("Connection to master process was lost, reconnecting : " + str(error))
+                continue
+            plugins.log.info("Failed to communicate with master process - waiting " +
+                             str(sleepTime) + " seconds and then trying again.")
+            plugins.log.info("Error received was " + str(error))
+            time.sleep(sleepTime)
+            sleepTime *= 2
 
         message = "Terminating as failed to communicate with master process : " + self.exceptionOutput()
         sys.stderr.write(message)
         plugins.log.info(message.strip())
         self.notify("NoMoreExtraTests")
 
-    def sendData(self, sendSocket, fullData):
-        sendSocket.sendall(fullData)
-        sendSocket.shutdown(socket.SHUT_WR)
-        if self.synchFiles:
-            # Remote socket, possibly firewalls that kill connections, possibly other things. Use timeout and be prepared to retry...
-            # TCP timeout is typically 30 seconds, give up a bit before that
-            sendSocket.settimeout(25)
-        response = sendSocket.makefile('rb').read()
-        sendSocket.close()
-        return str(response, getpreferredencoding())
+    def getConnection(self):
+        # One connection for all our messages, reopened if it goes away
+        if self.connection is None:
+            sendSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            if not self.connect(sendSocket):
+                return False
+            if self.synchFiles:
+                # Remote socket, possibly firewalls that kill connections, possibly other things. Use timeout and be prepared to retry...
+                # TCP timeout is typically 30 seconds, give up a bit before that
+                sendSocket.settimeout(25)
+            self.connection = sendSocket
+            self.connectionFiles = sendSocket.makefile("rb"), sendSocket.makefile("wb", buffering=chunkSize)
+            self.connectionFiles[1].write((connectionText + "\n").encode())
+            if self.heartbeatThread is None:
+                self.heartbeatThread = Thread(target=self.sendHeartbeats, daemon=True)
+                self.heartbeatThread.start()
+        return True
+
+    def closeConnection(self):
+        if self.connection is not None:
+            for f in self.connectionFiles:
+                try:
+                    f.close()
+                except socket.error:
+                    pass
+            self.connection.close()
+            self.connection = None
+
+    def sendData(self, fullData):
+        readFile, writeFile = self.connectionFiles
+        writeMessage(writeFile, fullData() if callable(fullData) else [ fullData ])
+        self.lastMessageTime = time.time()
+        return str(readResponse(readFile), getpreferredencoding())
+
+    def sendHeartbeats(self):
+        # Let the master know we're still there, and find out quickly if the connection has gone
+        while True:
+            time.sleep(self.heartbeatInterval)
+            with self.connectionLock:
+                if self.connection is not None and time.time() - self.lastMessageTime >= self.heartbeatInterval:
+                    try:
+                        self.sendData(b"")
+                    except (socket.error, EOFError) as e:
+                        plugins.log.info("Lost connection to master process, will reconnect when needed : " + str(e))
+                        self.closeConnection()
 
     def interpretResponse(self, response, state):
-        if len(response) > 0:
-            appDesc, testPath = socketParse(response)
+        testStrings = response.splitlines()
+        self.testsClaimed += len(testStrings)
+        for testString in testStrings:
+            appDesc, testPath = socketParse(testString)
             appParts = appDesc.split(".")
             self.notify("ExtraTest", testPath, appParts[0], appParts[1:])
-        elif state.isComplete():
+        if state.isComplete() and self.testsClaimed == 0:
             self.notify("NoMoreExtraTests")
 
     def notifyRequiredTestData(self, test, paths):
@@ -4,7 +4,11 @@ Utilities for both master and slave code
 """
 
 import os
+import sys
+import zlib
+import struct
 import socket
+import itertools
 from texttestlib import plugins
 from locale import getpreferredencoding
 
@@ -12,6 +16,7 @@ noReusePostfix = ".NO_REUSE"
 rerunPostfix = ".RERUN_TEST"
 sendFilePostfix = ".SEND_FILES"
 getFilePostfix = ".GET_FILES"
+claimPostfix = ".CLAIM_"
 
 
 def getIPAddress(apps):
@@ -48,7 +53,7 @@ def socketParse(testString):
     return testString.strip().split(":", 1)
 
 
-def makeIdentifierLine(identifier, sendFiles=False, getFiles=False, noReuse=False, rerun=False):
+def makeIdentifierLine(identifier, sendFiles=False, getFiles=False, noReuse=False, rerun=False, claimCount=1):
     if sendFiles:
         identifier += sendFilePostfix
     if getFiles:
@@ -57,10 +62,18 @@ def makeIdentifierLine(identifier, sendFiles=False, getFiles=False, noReuse=Fals
         identifier += noReusePostfix
     if rerun:
         identifier += rerunPostfix
+    if claimCount != 1:
+        # How many more tests the slave wants to be given, if not the usual one
+        identifier += claimPostfix + str(claimCount)
     return identifier
 
 
 def parseIdentifier(line):
+    claimCount = 1
+    if claimPostfix in line:
+        line, claimText = line.rsplit(claimPostfix, 1)
+        claimCount = int(claimText)
+
     rerun = line.endswith(rerunPostfix)
     if rerun:
         line = line.replace(rerunPostfix, "")
@@ -77,34 +90,151 @@ def parseIdentifier(line):
     if getFiles:
         line = line.replace(getFilePostfix, "")
 
-    return line, sendFiles, getFiles, tryReuse, rerun
+    return line, sendFiles, getFiles, tryReuse, rerun, claimCount
 
 
 dirText = "DIRECTORY_CONTENTS"
 fileText = "FILE_CONTENTS"
 endPrefix = "END_"
+archiveText = "DIRECTORY_ARCHIVE"
+archiveFormat = "1 zlib"
+chunkSize = 65536
+compressionLevel = 1 # Mostly text, level 1 gets most of the benefit at a fraction of the cost
+frameHeader = struct.Struct(">I")
+
+
+# Slaves open their connection with this line, then send messages as length-prefixed chunks ended by an empty one
+# Each gets a single length-prefixed response. An empty message is a heartbeat.
+connectionText = "TEXTTEST_SLAVE_CONNECTION"
+
+
+def writeMessage(f, chunks):
+    for chunk in chunks:
+        if chunk:
+            f.write(frameHeader.pack(len(chunk)))
+            f.write(chunk)
+    f.write(frameHeader.pack(0))
+    f.flush()
+
+
+def readResponse(f):
+    return readExactly(f, frameHeader.unpack(readExactly(f, frameHeader.size))[0])
+
+
+def packResponse(response):
+    return frameHeader.pack(len(response)) + response
+
+
+class MessageSplitter:
+    """ The master's side of writeMessage: is given data as it arrives, however it is split up,
+    and writes each message to a file made by newMessage, returning those that are complete """
+    def __init__(self, newMessage):
+        self.newMessage = newMessage
+        self.buffer = bytearray()
+        self.frameRemaining = 0
+        self.message = None
+
+    def feed(self, data):
+        self.buffer += data
+        completeMessages = []
+        while True:
+            if self.frameRemaining == 0:
+                if len(self.buffer) < frameHeader.size:
+                    return completeMessages
+                self.frameRemaining = frameHeader.unpack_from(self.buffer)[0]
+                del self.buffer[:frameHeader.size]
+                if self.message is None:
+                    self.message = self.newMessage()
+                if self.frameRemaining == 0:
+                    completeMessages.append(self.message)
+                    self.message = None
+                    continue
+            if not self.buffer:
+                return completeMessages
+            data = self.buffer[:self.frameRemaining]
+            self.message.write(data)
+            self.frameRemaining -= len(data)
+            del self.buffer[:len(data)]
 
 
 def directorySerialise(dirName, ignoreLinks=False):
-    text = ""
+    # Generator of byte chunks, so neither end has to hold a whole directory in memory
+    # Each file is a name line, then length-prefixed zlib frames ended by an empty one, then a crc32 of the contents
+    yield (archiveText + " " + archiveFormat + "\n").encode()
     for root, _, files in os.walk(dirName):
         for fn in sorted(files):
             path = os.path.join(root, fn)
             if not os.path.islink(path):
                 relpath = plugins.relpath(path, dirName)
-                text += fileText + " " + relpath + "\n"
-                with open(path) as f:
-                    text += f.read()
-                if not text.endswith("\n"):
-                    text += "\n"
-                text += endPrefix + fileText + "\n"
-    text += endPrefix + dirText
-    return text
+                yield (fileText + " " + relpath + "\n").encode("utf-8", "surrogateescape")
+                yield from fileSerialise(path)
+    yield (endPrefix + dirText + "\n").encode()
+
+
+def fileSerialise(path):
+    compressor = zlib.compressobj(compressionLevel)
+    checksum = 0
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(chunkSize)
+            if not data:
+                break
+            checksum = zlib.crc32(data, checksum)
+            compressed = compressor.compress(data)
+            if compressed:
+                yield frameHeader.pack(len(compressed)) + compressed
+    compressed = compressor.flush()
+    yield frameHeader.pack(len(compressed)) + compressed + frameHeader.pack(0) + frameHeader.pack(checksum)
 
 
 def directoryUnserialise(rootDir, f):
-    currFile = None
+    firstLine = f.readline()
+    if not firstLine.startswith(archiveText.encode()):
+        # Text format, as sent by older slaves
+        return textDirectoryUnserialise(rootDir, f, firstLine)
+
     for line in f:
+        if line.startswith((endPrefix + dirText).encode()):
+            break
+        elif line.startswith(fileText.encode()):
+            fn = line[len(fileText) + 1:].rstrip(b"\r\n").decode("utf-8", "surrogateescape")
+            path = os.path.join(rootDir, fn)
+            plugins.ensureDirExistsForFile(path)
+            fileUnserialise(path, f)
+
+
+def readExactly(f, size):
+    data = f.read(size)
+    if len(data) < size:
+        raise EOFError("Connection closed before all data was received")
+    return data
+
+
+def fileUnserialise(path, f):
+    decompressor = zlib.decompressobj()
+    checksum = 0
+    with open(path, "wb") as currFile:
+        while True:
+            frameSize = frameHeader.unpack(readExactly(f, frameHeader.size))[0]
+            if frameSize == 0:
+                break
+            data = decompressor.decompress(readExactly(f, frameSize), chunkSize)
+            while data:
+                checksum = zlib.crc32(data, checksum)
+                currFile.write(data)
+                # Limit the output size, highly compressed data can be very large
+                data = decompressor.decompress(decompressor.unconsumed_tail, chunkSize)
+        data = decompressor.flush()
+        checksum = zlib.crc32(data, checksum)
+        currFile.write(data)
+    expected = frameHeader.unpack(readExactly(f, frameHeader.size))[0]
+    if checksum != expected:
+        sys.stderr.write("WARNING: file transferred from slave to '" + path + "' does not match its checksum, it may be corrupt.\n")
+
+
+def textDirectoryUnserialise(rootDir, f, firstLine):
+    currFile = None
+    for line in itertools.chain([ firstLine ], f):
         lineStr = str(line, getpreferredencoding())
         if currFile is not None:
             if lineStr.startswith(endPrefix + fileText):
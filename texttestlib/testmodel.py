@@ -10,6 +10,10 @@ import logging
 import glob
 import functools
 import fnmatch
+import weakref
+import re
+import pickle
+import hashlib
 
 from multiprocessing import cpu_count
 from collections import OrderedDict
@@ -28,17 +32,71 @@ http://www.texttest.org
 
 
 class DirectoryCache:
+    # Caches in use by any test tree, so that several applications or versions sharing directories list them only once
+    # Weak references: they drop out when the last test using them goes
+    sharedCaches = weakref.WeakValueDictionary()
+    sharedCacheLock = Lock()
+    listingCount = 0
+    sharedCount = 0
+
     def __init__(self, dir):
         self.dir = dir
         self.contents = []
-        self.refresh()
+        # Incremented whenever the directory is re-read, so anything derived from the contents can be invalidated
+        self.generation = 0
+        self.stemIndex = None
+        self.modTime = None
+        self.readContents()
+
+    @classmethod
+    def getShared(cls, dir):
+        key = os.path.normpath(dir)
+        with cls.sharedCacheLock:
+            cache = cls.sharedCaches.get(key)
+            if cache is None:
+                cache = cls(dir)
+                cls.sharedCaches[key] = cache
+            elif cache.getModificationTime() != cache.modTime:
+                # Changed since it was read, perhaps even removed and recreated
+                cache.refresh()
+            else:
+                cls.sharedCount += 1
+            return cache
+
+    @classmethod
+    def getSharingSummary(cls):
+        entryCount = sum((len(cache.contents) for cache in list(cls.sharedCaches.values())))
+        return str(cls.listingCount) + " directory listings made, " + str(cls.sharedCount) + " avoided by sharing, " + \
+            str(len(cls.sharedCaches)) + " shared directories holding " + str(entryCount) + " entries"
 
     def refresh(self):
+        self.generation += 1
+        self.readContents()
+
+    def getModificationTime(self):
+        try:
+            return os.stat(self.dir).st_mtime_ns
+        except OSError:
+            pass
+
+    def readContents(self):
+        DirectoryCache.listingCount += 1
+        # Before listing, so that any change made while we list is noticed next time
+        self.modTime = self.getModificationTime()
         try:
             self.contents = os.listdir(self.dir)
             self.contents.sort()
         except OSError:  # usually caused by people removing stuff externally
             self.contents = []
+        self.stemIndex = None
+
+    def getFilesWithFirstPart(self, firstPart):
+        # Index the contents by the part before the first dot, so stem lookups don't scan the whole directory
+        if self.stemIndex is None:
+            self.stemIndex = {}
+            for fileName in self.contents:
+                self.stemIndex.setdefault(fileName.split(".", 1)[0], []).append(fileName)
+        return self.stemIndex.get(firstPart, [])
 
     def hasStem(self, stem):
         for fileName in self.contents:
@@ -75,7 +133,7 @@ class DirectoryCache:
             return newCache.findVersionSets(local, predicate)
 
         versionSets = OrderedDict()
-        for fileName in self.contents:
+        for fileName in self.getFilesWithFirstPart(stem.split(".", 1)[0]):
             versionSet = self.findVersionSet(fileName, stem)
             if versionSet is not None and (predicate is None or predicate(versionSet)):
                 versionSets.setdefault(versionSet, []).append(self.pathName(fileName))
@@ -107,12 +165,23 @@ class DynamicMapping:
 
 
 class TestEnvironment(OrderedDict):
+    # So that anything derived from the values knows when to work them out again
+    changeCount = 0
+
     def __init__(self, populateFunction):
         OrderedDict.__init__(self)
         self.diag = logging.getLogger("read environment")
         self.populateFunction = populateFunction
         self.populated = False
 
+    def __setitem__(self, var, value):
+        self.changeCount += 1
+        OrderedDict.__setitem__(self, var, value)
+
+    def __delitem__(self, var):
+        self.changeCount += 1
+        OrderedDict.__delitem__(self, var)
+
     def checkPopulated(self):
         if not self.populated:
             self.populated = True
@@ -138,9 +207,10 @@ class TestEnvironment(OrderedDict):
             else:
                 varsToUnset.append(key)
         varsToUnset += ignoreVars
-        from pprint import pformat
-        self.diag.info("Got variables " + pformat(values))
-        self.diag.info("Removing variables " + repr(varsToUnset))
+        if self.diag.isEnabledFor(logging.INFO):
+            from pprint import pformat
+            self.diag.info("Got variables " + pformat(values))
+            self.diag.info("Removing variables " + repr(varsToUnset))
         # copy in the external environment last
         return plugins.copyEnvironment(values, varsToUnset)
 
@@ -161,7 +231,7 @@ class TestEnvironment(OrderedDict):
         else:
             # We create expansions of PATH externally, make sure we expand them if needed
             value = os.getenv(var, defaultValue) if expandExternal or var == "PATH" else defaultValue
-        self.diag.info("Single: got " + var + " = " + repr(value))
+        self.diag.info("Single: got %s = %r", var, value)
         return value
 
     def getSelfReference(self, var, originalVar, expandExternal):
@@ -176,7 +246,7 @@ class TestEnvironment(OrderedDict):
         for var, valueOrMethod in vars:
             newValue = self.expandSelfReferences(var, valueOrMethod, expandExternal)
             if newValue is not None:
-                self.diag.info("Storing " + var + " = " + repr(newValue))
+                self.diag.info("Storing %s = %r", var, newValue)
                 self[var] = newValue
 
         while self.expandVariables(expandExternal):
@@ -185,7 +255,7 @@ class TestEnvironment(OrderedDict):
     def expandSelfReferences(self, var, valueOrMethod, expandExternal):
         if type(valueOrMethod) in (str, bytes):
             mapping = DynamicMapping(self.getSelfReference, var, expandExternal)
-            self.diag.info("Expanding self references for " + repr(var) + " in " + repr(valueOrMethod))
+            self.diag.info("Expanding self references for %r in %r", var, valueOrMethod)
             return string.Template(valueOrMethod).safe_substitute(mapping)
         else:
             return valueOrMethod(var, self._getSingleValue(var, ""))
@@ -194,18 +264,21 @@ class TestEnvironment(OrderedDict):
         expanded = False
         for var, value in self.items():
             if "$" in value:
-                self.diag.info("Expanding " + var + "...")
+                self.diag.info("Expanding %s...", var)
             mapping = DynamicMapping(self.getSingleValueNoSelfRef, var, expandExternal)
             newValue = string.Template(value).safe_substitute(mapping)
             if newValue != value:
                 expanded = True
-                self.diag.info("Expanded " + var + " = " + newValue)
+                self.diag.info("Expanded %s = %s", var, newValue)
                 self[var] = newValue
         return expanded
 
 
 # Base class for TestCase and TestSuite
 class Test(plugins.Observable):
+    # Incremented whenever the configuration is re-read
+    configGeneration = 0
+
     def __init__(self, name, description, dircache, app, parent=None):
         # Should notify which test it is
         plugins.Observable.__init__(self, passSelf=True)
@@ -217,6 +290,8 @@ class Test(plugins.Observable):
         self.parent = parent
         self.dircache = dircache
         self.configDir = None
+        self.fileNameCache = {}
+        self.fileNameCacheGenerations = None
         self.diag = logging.getLogger("test objects")
         self.reloadConfiguration()
         populateFunction = plugins.Callable(app.setEnvironment, self)
@@ -241,6 +316,7 @@ class Test(plugins.Observable):
         return self.parent is not None and self.dircache.hasStem("config." + self.app.name)
 
     def reloadConfiguration(self):
+        self.configGeneration += 1
         if self.hasLocalConfig():
             parentConfigDir = self.getParentConfigDir()
             newConfigDir = deepcopy(parentConfigDir)
@@ -279,7 +355,10 @@ class Test(plugins.Observable):
         return self.name.ljust(maxLength)
 
     def changeDirectory(self, newDir, origRelPath):
-        self.dircache = DirectoryCache(newDir)
+        self.dircache = DirectoryCache.getShared(newDir)
+        # The new cache's generation may well match the old one's
+        self.fileNameCache = {}
+        self.fileNameCacheGenerations = None
         self.notify("NameChange", origRelPath)
 
     def setName(self, newName):
@@ -299,8 +378,10 @@ class Test(plugins.Observable):
     def classDescription(self):
         return self.classId().replace("-", " ")
 
-    def diagnose(self, message):
-        self.diag.info("In test " + self.uniqueName + " : " + message)
+    def diagnose(self, message, *args):
+        # Formatting is left to the logger, so costs nothing unless diagnostics are enabled
+        if self.diag.isEnabledFor(logging.INFO):
+            self.diag.info("In test %s : %s", self.uniqueName, message % args if args else message)
 
     def setUniqueName(self, newName):
         if newName != self.uniqueName:
@@ -358,16 +439,16 @@ class Test(plugins.Observable):
         return stems
 
     def listApprovedFiles(self, allVersions, defFileCategory="all"):
-        self.diagnose("Looking for standard files, definition files in category " + repr(defFileCategory))
+        self.diagnose("Looking for standard files, definition files in category %r", defFileCategory)
         defFileStems = self.expandedDefFileStems(defFileCategory)
         defFiles = self.getFilesFromStems(defFileStems, allVersions)
         resultFiles = self.listResultFiles(allVersions)
-        self.diagnose("Found " + repr(resultFiles) + " and " + repr(defFiles))
+        self.diagnose("Found %r and %r", resultFiles, defFiles)
         return resultFiles, defFiles
 
     def listResultFiles(self, allVersions):
         exclude = self.expandedDefFileStems() + self.getDataFileNames() + ["file_edits"]
-        self.diagnose("Excluding " + repr(exclude))
+        self.diagnose("Excluding %r", exclude)
 
         def predicate(stem, vset): return stem not in exclude and self.app.name in vset
         stems = self.dircache.findAllStems(predicate)
@@ -391,7 +472,7 @@ class Test(plugins.Observable):
         return files
 
     def listStdFilesWithStem(self, stem, allVersions):
-        self.diagnose("Getting files for stem " + stem)
+        self.diagnose("Getting files for stem %s", stem)
         files = []
         if allVersions:
             files += self.findAllStdFiles(stem)
@@ -509,17 +590,43 @@ class Test(plugins.Observable):
         else:
             return self.app
 
+    def getCachedFileNames(self, method, *args):
+        if "td" in self.app.inputOptions:
+            return method(*args)  # the test data directory is read afresh every time
+        # Results only change if files are added or removed here or further up, which means those directory caches get refreshed,
+        # or if the configuration or the environment used to find the extra search directories changes
+        generations = tuple(((test.dircache.generation, test.configGeneration) for test in self.getAllTestsToRoot())) + \
+            (self.app.dircache.generation, self.app.configGeneration, self.environment.changeCount) + \
+            tuple((cache.generation for cache in list(self.app.extraDirCaches.values()) if cache))
+        if self.fileNameCacheGenerations != generations:
+            self.fileNameCache = {}
+            self.fileNameCacheGenerations = generations
+        key = (method.__name__,) + args
+        if key not in self.fileNameCache:
+            self.fileNameCache[key] = method(*args)
+        result = self.fileNameCache[key]
+        return list(result) if isinstance(result, list) else result
+
     def getFileName(self, stem, refVersion=None):
-        self.diagnose("Getting file from " + stem)
+        self.diagnose("Getting file from %s", stem)
+        return self.getCachedFileNames(self._getFileName, stem, refVersion)
+
+    def _getFileName(self, stem, refVersion):
         return self.getAppForVersion(refVersion).getFileNameFromCaches([self.dircache], stem)
 
     def getPathName(self, stem, configName=None, refVersion=None):
-        self.diagnose("Getting path name from " + stem)
+        self.diagnose("Getting path name from %s", stem)
+        return self.getCachedFileNames(self._getPathName, stem, configName, refVersion)
+
+    def _getPathName(self, stem, configName, refVersion):
         app = self.getAppForVersion(refVersion)
         return self.pathNameMethod(stem, configName, app.getFileNameFromCaches)
 
     def getAllPathNames(self, stem, configName=None, refVersion=None):
-        self.diagnose("Getting all path names from " + stem)
+        self.diagnose("Getting all path names from %s", stem)
+        return self.getCachedFileNames(self._getAllPathNames, stem, configName, refVersion)
+
+    def _getAllPathNames(self, stem, configName, refVersion):
         app = self.getAppForVersion(refVersion)
         return self.pathNameMethod(stem, configName, app.getAllFileNames)
 
@@ -527,7 +634,8 @@ class Test(plugins.Observable):
         if configName is None:
             configName = stem
         dirCaches = self.getDirCachesToRoot(configName)
-        self.diagnose("Directories to be searched: " + repr([d.dir for d in dirCaches]))
+        if self.diag.isEnabledFor(logging.INFO):
+            self.diagnose("Directories to be searched: %r", [d.dir for d in dirCaches])
         return method(dirCaches, stem)
 
     def getAllTestsToRoot(self):
@@ -547,7 +655,10 @@ class Test(plugins.Observable):
         return self.app.getAllDirCaches(configName, fromTests, envMapping=self.environment)
 
     def getAllFileNames(self, stem, refVersion=None):
-        self.diagnose("Getting file from " + stem)
+        self.diagnose("Getting file from %s", stem)
+        return self.getCachedFileNames(self._getAllFileNames, stem, refVersion)
+
+    def _getAllFileNames(self, stem, refVersion):
         appToUse = self.app
         if refVersion:
             appToUse = self.app.getRefVersionApplication(refVersion)
@@ -660,7 +771,7 @@ class Test(plugins.Observable):
         for filter in filters:
             self.notifyIfMainThread("ActionProgress")
             if not self.isAcceptedBy(filter, checkContents):
-                self.diagnose("Rejected due to " + repr(filter))
+                self.diagnose("Rejected due to %r", filter)
                 return False
         return True
 
@@ -701,14 +812,14 @@ class Test(plugins.Observable):
     def changeState(self, state):
         isCompletion = not self.state.isComplete() and state.isComplete()
         self.state = state
-        self.diagnose("Change notified to state " + state.category)
+        self.diagnose("Change notified to state %s", state.category)
         if state and state.lifecycleChange:
             self.sendStateNotify(isCompletion)
 
     def sendStateNotify(self, isCompletion):
         notifyMethod = self.getNotifyMethod(isCompletion)
         notifyMethod("LifecycleChange", self.state, self.state.lifecycleChange)
-        self.diagnose("Send state notify with lifecycle change " + self.state.lifecycleChange)
+        self.diagnose("Send state notify with lifecycle change %s", self.state.lifecycleChange)
         if self.state.lifecycleChange == "complete":
             notifyMethod("Complete")
 
@@ -915,7 +1026,8 @@ class TestCase(Test):
         os.rename(newPath, os.path.join(os.path.dirname(newPath), "backup.aborted"))
         stateFile = self.getStateFile()
         if os.path.isfile(stateFile):
-            return plugins.getNewTestStateFromFile(open(stateFile))
+            with open(stateFile, "rb") as f:
+                return plugins.getNewTestStateFromFile(f)
 
     def backupPreviousTemporaryData(self, restoreLatest=False):
         writeDir = self.getDirectory(temporary=1)
@@ -973,8 +1085,11 @@ class TestCase(Test):
             return
 
         file = plugins.openForWrite(stateFile, "wb")
-        pickler = Pickler(file, protocol=2)
-        pickler.dump(self.state)
+        protocol = os.getenv("TEXTTEST_PICKLE_PROTOCOL")  # Set to write plain pickles, as older versions read
+        if protocol:
+            Pickler(file, protocol=int(protocol)).dump(self.state)
+        else:
+            plugins.writeTestStateToFile(self.state, file)
         file.close()
 
     def isAcceptedBy(self, filter, *args):
@@ -1343,7 +1458,7 @@ class TestSuite(Test):
                 subTest.notify("Add", initial)
 
     def createTestCache(self, testName):
-        return DirectoryCache(os.path.join(self.getDirectory(), testName))
+        return DirectoryCache.getShared(os.path.join(self.getDirectory(), testName))
 
     def getSubtestClass(self, cache):
         return TestSuite if cache.hasStem("testsuite." + self.app.name) else TestCase
@@ -1520,7 +1635,126 @@ class ConfigurationCall:
         raise BadConfigError(message)
 
 
+class ConfigCache:
+    """ Snapshots of fully read application configuration, kept in the personal cache directory if
+    $TEXTTEST_CONFIG_CACHE is set. A snapshot is used as long as none of the files and directories
+    it was read from have changed, and the same options and environment are in use """
+    formatVersion = 1
+    # Options which differ between slave processes without affecting the configuration
+    ignoredOptions = ["tp", "xw", "xr"]
+    environmentVariables = ["PATH", "HOME", "DISPLAY", "EDITOR"]
+    variablePattern = re.compile(r"\$\{?(\w+)")
+
+    def __init__(self, app):
+        self.app = app
+        self.diag = logging.getLogger("Config Cache")
+        self.key = self.getKey()
+        keyDigest = hashlib.sha1(self.key.encode()).hexdigest()
+        self.fileName = os.path.join(plugins.getPersonalDir("cache"), "config", app.name + "." + keyDigest + ".pickle")
+
+    @staticmethod
+    def isEnabled():
+        return os.getenv("TEXTTEST_CONFIG_CACHE", "0") != "0" and plugins.getPersonalConfigDir() is not None
+
+    def getKey(self):
+        options = sorted((key, str(value)) for key, value in self.app.inputOptions.items() if key not in self.ignoredOptions)
+        textTestVars = sorted((var, value) for var, value in os.environ.items() if var.startswith("TEXTTEST_"))
+        return repr((self.formatVersion, self.app.name, self.app.versions, self.app.dircache.dir, options, textTestVars))
+
+    @staticmethod
+    def getStamp(path):
+        try:
+            stat = os.stat(path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            pass
+
+    def findPathsUsed(self):
+        paths = list(self.app.configDir.filesRead)
+        dirCaches = self.app.defaultDirCaches + self.app.getAllDirCaches("config", [self.app.dircache])
+        paths += [dirCache.dir for dirCache in dirCaches]
+        paths += [os.path.dirname(fileName) for fileName in self.app.configDir.filesRead]
+        personalDir = plugins.getPersonalConfigDir()
+        if personalDir:
+            paths.append(personalDir)
+        # Defaults come from the code of the config modules, which might also change
+        for cls in type(self.app.configObject).__mro__:
+            module = sys.modules.get(cls.__module__)
+            if module and getattr(module, "__file__", None):
+                paths.append(module.__file__)
+        paths.append(__file__)
+        return list(OrderedDict.fromkeys(paths))
+
+    def findVariablesUsed(self):
+        variables = list(self.environmentVariables)
+        for fileName in self.app.configDir.filesRead:
+            try:
+                with open(fileName, errors="ignore") as f:
+                    variables += self.variablePattern.findall(f.read())
+            except OSError:
+                pass
+        return dict((var, os.getenv(var)) for var in variables)
+
+    def save(self, warnings):
+        configDir = self.app.configDir
+        paths = self.findPathsUsed()
+        snapshot = {"key": self.key,
+                    "stamps": [(path, self.getStamp(path)) for path in paths],
+                    "variables": self.findVariablesUsed(),
+                    "items": list(configDir.items()),
+                    "aliases": configDir.aliases,
+                    "fileTrackSections": configDir.fileTrackSections,
+                    "docs": self.app.configDocs,
+                    "warnings": warnings}
+        try:
+            plugins.ensureDirExistsForFile(self.fileName)
+            tmpFile = self.fileName + "." + str(os.getpid())
+            with open(tmpFile, "wb") as f:
+                Pickler(f, protocol=pickle.HIGHEST_PROTOCOL).dump(snapshot)
+            os.replace(tmpFile, self.fileName)
+            self.diag.info("Saved configuration for " + self.app.name + " to " + self.fileName)
+        except (OSError, pickle.PicklingError, TypeError, AttributeError) as e:
+            self.diag.info("Could not save configuration to " + self.fileName + " : " + str(e))
+
+    def load(self):
+        try:
+            with open(self.fileName, "rb") as f:
+                snapshot = Unpickler(f).load()
+        except (OSError, EOFError, UnpicklingError, AttributeError, ImportError) as e:
+            self.diag.info("No usable configuration at " + self.fileName + " : " + str(e))
+            return
+        if snapshot.get("key") != self.key:
+            return
+        for path, stamp in snapshot["stamps"]:
+            if self.getStamp(path) != stamp:
+                self.diag.info("Configuration out of date, " + path + " has changed")
+                return
+        for var, value in snapshot["variables"].items():
+            if os.getenv(var) != value:
+                self.diag.info("Configuration out of date, environment variable " + var + " has changed")
+                return
+        return snapshot
+
+    def restore(self):
+        snapshot = self.load()
+        if snapshot is None:
+            return False
+        configDir = self.app.configDir
+        for key, value in snapshot["items"]:
+            configDir[key] = value
+        configDir.aliases.update(snapshot["aliases"])
+        configDir.fileTrackSections.update(snapshot["fileTrackSections"])
+        self.app.configDocs = snapshot["docs"]
+        for warning in snapshot["warnings"]:
+            configDir.warn(warning)
+        self.diag.info("Read configuration for " + self.app.name + " from " + self.fileName)
+        return True
+
+
 class Application(object):
+    # Incremented whenever the configuration is read again
+    configGeneration = 0
+
     def __init__(self, name, dircache, versions, inputOptions, configEntries={}):
         self.name = name
         self.dircache = dircache
@@ -1528,6 +1762,7 @@ class Application(object):
         self.extras = []
         # Cache all environment files in the whole suite to stop constantly re-reading them
         self.envFiles = {}
+        self.prioritySortCache = {}
         self.versions = versions
         self.diag = logging.getLogger("application")
         self.inputOptions = inputOptions
@@ -1569,9 +1804,23 @@ class Application(object):
 
     def setUpConfiguration(self, configEntries={}):
         self.configDir.clear()
+        self.configDir.filesRead = []
         self.configDocs = {}
         self.defaultDirCaches = self.getDefaultDirCaches()
         self.extraDirCaches = {}
+        self.configGeneration += 1
+        configCache = ConfigCache(self) if len(configEntries) == 0 and ConfigCache.isEnabled() else None
+        if configCache and configCache.restore():
+            self.configObject = self.makeConfigObject()
+        else:
+            warningCount = len(self.configDir.warnings)
+            self.readConfiguration(configEntries)
+            if configCache:
+                configCache.save(self.configDir.warnings[warningCount:])
+        if not plugins.TestState.showExecHosts:
+            plugins.TestState.showExecHosts = self.configObject.showExecHostsInFailures(self)
+
+    def readConfiguration(self, configEntries):
         self.setConfigDefaults()
 
         # Read our pre-existing config files
@@ -1595,8 +1844,6 @@ class Application(object):
         self.configDir.readValues(self.getPersonalConfigFiles(), insert=False, errorOnUnknown=False)
         self.setInterpreters()
         self.diag.info("Config file settings are: " + "\n" + repr(self.configDir))
-        if not plugins.TestState.showExecHosts:
-            plugins.TestState.showExecHosts = self.configObject.showExecHostsInFailures(self)
 
     def reloadConfiguration(self):
         # Try to make this as atomic as possible, to avoid problems when other threads
@@ -1606,6 +1853,7 @@ class Application(object):
         self.configObject = tmpApp.configObject
         self.extraDirCaches = tmpApp.extraDirCaches
         self.defaultDirCaches = tmpApp.defaultDirCaches
+        self.configGeneration += 1
         self.configDocs = tmpApp.configDocs
         self.reapplyOverrides()
 
@@ -1854,11 +2102,11 @@ class Application(object):
         if allVersions:
             sortedVersionSets = sorted(list(versionSets.keys()), key=cmp_to_key(self.compareForDisplay))
         else:
-            sortedVersionSets = sorted(list(versionSets.keys()), key=cmp_to_key(self.compareForPriority))
+            sortedVersionSets = self.sortForPriority(list(versionSets.keys()))
         allFiles = []
         for vset in sortedVersionSets:
             allFiles += versionSets[vset]
-        self.diag.info("Files for stem " + stem + " found " + repr(allFiles))
+        self.diag.info("Files for stem %s found %r", stem, allFiles)
         return allFiles
 
     def getRefVersionApplication(self, refVersion):
@@ -2049,6 +2297,20 @@ class Application(object):
     def cmp(self, a, b):
         return (a > b) - (a < b)  # python 3 equivalent of cmp() function
 
+    def sortForPriority(self, versionSets):
+        # The same few combinations of version sets turn up for nearly every file, so don't keep comparing them.
+        # Everything compareForPriority depends on is part of the key, so config changes are picked up.
+        if len(versionSets) <= 1:
+            return versionSets
+        allVersions = sorted(set().union(*versionSets))
+        priorities = tuple((self.getVersionPriority(version) for version in allVersions))
+        key = tuple(versionSets), tuple(self.versions), tuple(self.getBaseVersions()), priorities
+        sortedVersionSets = self.prioritySortCache.get(key)
+        if sortedVersionSets is None:
+            sortedVersionSets = sorted(versionSets, key=cmp_to_key(self.compareForPriority))
+            self.prioritySortCache[key] = sortedVersionSets
+        return sortedVersionSets
+
     def compareForPriority(self, vset1, vset2):
         versionSet = set(self.versions)
         self.diag.info("Compare " + repr(vset1) + " to " + repr(vset2))